@@ -0,0 +1,135 @@
+"""
+Benchmark of allocation and time per reading of air datasets.
+Each reading goes through the same steps as in gatherer: parsing raw device status,
+creating dataclass instance and reading air and health fields.
+Legacy implementation (regular dataclasses, fields recomputed on each access) is included for comparison.
+
+Usage:
+$ python3 data_model.py --readings 10000
+"""
+
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass, fields
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from models.data import DeviceData, MiAirPurifier3HData
+
+
+# region LEGACY
+
+
+@dataclass
+class LegacyAirData:
+    device: DeviceData
+    temperature: float = None
+    humidity: int = None
+    aqi: int = None
+
+    AIR_DATA_FIELDS = {"aqi", "humidity", "temperature"}
+    HEALTH_DATA_FIELDS = {}
+
+    def __post_init__(self) -> None:
+        self.temperature = (
+            round(self.temperature, ndigits=1) if self.temperature else None
+        )
+
+    @property
+    def air_data(self) -> dict:
+        return dict(
+            [(field, self.__getattribute__(field)) for field in self.AIR_DATA_FIELDS]
+        )
+
+    @property
+    def health_data(self) -> dict:
+        return dict(
+            [(field, self.__getattribute__(field)) for field in self.HEALTH_DATA_FIELDS]
+        )
+
+
+@dataclass(eq=False)
+class LegacyMiAirPurifier3HData(LegacyAirData):
+    filter_life_remaining: int = None
+
+    HEALTH_DATA_FIELDS = {"filter_life_remaining"}
+
+
+def legacy_reading(device: DeviceData, status: dict) -> tuple:
+    parsed_data = {}
+    for key, value in status.items():
+        if key in [field.name for field in fields(LegacyMiAirPurifier3HData)]:
+            parsed_data[key] = value
+    data = LegacyMiAirPurifier3HData(device, **parsed_data)
+    return data, data.air_data, data.health_data
+
+
+# endregion
+
+
+def current_reading(device: DeviceData, status: dict) -> tuple:
+    parsed_data = {
+        key: value
+        for key, value in status.items()
+        if key in MiAirPurifier3HData.FIELD_NAMES
+    }
+    data = MiAirPurifier3HData(device, **parsed_data)
+    return data, data.air_data, data.health_data
+
+
+def generate(readings: int) -> list:
+    """Returns raw statuses, similar to the ones returned by miio library."""
+    return [
+        {
+            "power": "on",
+            "aqi": random.randint(0, 100),
+            "average_aqi": random.randint(0, 100),
+            "humidity": random.randint(30, 60),
+            "temperature": random.uniform(18, 26),
+            "fan_level": 2,
+            "filter_life_remaining": random.randint(0, 100),
+            "filter_hours_used": random.randint(0, 3000),
+            "motor_speed": random.randint(300, 2000),
+            "led": True,
+            "buzzer": False,
+            "child_lock": False,
+            "mode": "auto",
+        }
+        for _ in range(readings)
+    ]
+
+
+def measure(name: str, function, device: DeviceData, statuses: list) -> None:
+    """Prints time and retained memory per reading of given implementation."""
+    gc.collect()
+    start = time.perf_counter()
+    for status in statuses:
+        function(device, status)
+    duration = time.perf_counter() - start
+    # memory retained by readings, as if they were kept for whole cycle
+    gc.collect()
+    tracemalloc.start()
+    readings = [function(device, status) for status in statuses]
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{name:<8} {duration / len(statuses) * 1e6:>8.2f} us/reading   "
+        f"{retained / len(readings):>8.0f} bytes/reading"
+    )
+
+
+# main section of script
+if __name__ == "__main__":
+    # parses script arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", "--readings", type=int, default=10000)
+    arguments = parser.parse_args()
+    device = DeviceData("Purifier", "room", "air", "xiaomi", "AA:BB:CC:DD:EE:FF")
+    statuses = generate(arguments.readings)
+    measure("legacy", legacy_reading, device, statuses)
+    measure("current", current_reading, device, statuses)
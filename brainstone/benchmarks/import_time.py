@@ -0,0 +1,90 @@
+"""
+Startup regression check of brainstone scripts, based on 'python -X importtime'.
+Imports given script module in fresh interpreter several times and fails, when the best
+cumulative import time exceeds budget or when any of deferred libraries is imported eagerly.
+
+Usage:
+$ python3 import_time.py --module gatherer --budget 150
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+# absolute path to brainstone directory
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+# libraries that should be imported only by code paths that use them
+DEFERRED = (
+    "bluepy",
+    "influxdb_client",
+    "lywsd03mmc",
+    "miio",
+    "numpy",
+    "requests",
+    "scapy",
+)
+
+
+def measure(module: str) -> dict:
+    """Imports module in fresh interpreter and returns import times of each imported module,
+    {name: (self, cumulative)} in microseconds."""
+    environment = dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join((os.path.join(BASE_DIR, "scripts"), BASE_DIR)),
+    )
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        # current directory precedes PYTHONPATH, so modules of repository root do not shadow these
+        cwd=BASE_DIR,
+        env=environment,
+        capture_output=True,
+        text=True,
+    )
+    if process.returncode:
+        raise RuntimeError(f"Unable to import {module}\n{process.stderr}")
+    times = {}
+    for line in process.stderr.splitlines():
+        # import time: {self} | {cumulative} | {indentation}{name}
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:") :].split("|")
+        times[name.strip()] = (int(own), int(cumulative))
+    return times
+
+
+# main section of script
+if __name__ == "__main__":
+    # parses script arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--module", default="gatherer")
+    parser.add_argument(
+        "-b", "--budget", type=float, default=150, help="Import time budget in ms"
+    )
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    parser.add_argument(
+        "-t", "--top", type=int, default=10, help="Number of listed slowest modules"
+    )
+    arguments = parser.parse_args()
+    # the best run is used, as first ones include filling bytecode cache
+    runs = [measure(arguments.module) for _ in range(arguments.repeat)]
+    times = min(runs, key=lambda run: run[arguments.module][1])
+    total = times[arguments.module][1] / 1000
+    print(f"{'self [ms]':>10} {'cumulative [ms]':>16}  module")
+    for name, (own, cumulative) in sorted(
+        times.items(), key=lambda item: item[1][0], reverse=True
+    )[: arguments.top]:
+        print(f"{own / 1000:>10.1f} {cumulative / 1000:>16.1f}  {name}")
+    print(f"\n{arguments.module}: {total:.1f} ms (budget {arguments.budget:.0f} ms)")
+    failures = []
+    if total > arguments.budget:
+        failures.append(
+            f"import time exceeds budget by {total - arguments.budget:.1f} ms"
+        )
+    eager = sorted({name.split(".")[0] for name in times}.intersection(DEFERRED))
+    if eager:
+        failures.append(f"deferred libraries imported eagerly: {', '.join(eager)}")
+    for failure in failures:
+        print(f"FAILED | {failure}")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,103 @@
+"""
+Microbenchmark of rendering air points into line protocol.
+Compares LineProtocolSerializer with influxdb_client.Point based path used previously.
+
+Usage:
+$ python3 line_protocol.py --points 100000 --devices 20
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from models.data import DeviceData, MiAirPurifier3HData
+from models.line_protocol import LineProtocolSerializer
+
+
+def generate(points: int, devices: int) -> list:
+    """Returns list of random air datasets of given number of devices."""
+    metadata = [
+        DeviceData(
+            name=f"Purifier {index}",
+            location=f"room {index % 5}",
+            category="air",
+            brand="xiaomi",
+            mac_address=f"AA:BB:CC:DD:{index // 256:02X}:{index % 256:02X}",
+        )
+        for index in range(devices)
+    ]
+    return [
+        MiAirPurifier3HData(
+            metadata[index % devices],
+            temperature=random.uniform(18, 26),
+            humidity=random.randint(30, 60),
+            aqi=random.randint(0, 100),
+            filter_life_remaining=random.randint(0, 100),
+        )
+        for index in range(points)
+    ]
+
+
+def fields(data) -> dict:
+    return {"aqi": data.aqi, "humidity": data.humidity, "temperature": data.temperature}
+
+
+def serializer_path(datasets: list, timestamp: float) -> int:
+    """Renders datasets with LineProtocolSerializer and returns size of rendered batch."""
+    serializer = LineProtocolSerializer()
+    for data in datasets:
+        serializer.air(data, fields(data), timestamp)
+    return len(serializer.getvalue())
+
+
+def point_path(datasets: list, timestamp: float) -> int:
+    """Renders datasets with influxdb_client.Point and returns size of rendered batch."""
+    from influxdb_client import Point
+
+    lines = []
+    for data in datasets:
+        point = (
+            Point("air")
+            .tag("room", data.device.location)
+            .tag("mac_address", data.device.mac_address.lower())
+            .tag("device", data.device.name)
+            .tag("category", data.device.category)
+            .tag("brand", data.device.brand)
+            .time(int(timestamp * 1e9))
+        )
+        for field, value in fields(data).items():
+            point.field(field, value)
+        lines.append(point.to_line_protocol())
+    return len("\n".join(lines).encode("utf-8"))
+
+
+def measure(name: str, function, datasets: list, repeat: int) -> None:
+    """Prints the best points per second rate of given rendering path."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = function(datasets, time.time())
+        best = min(best, time.perf_counter() - start)
+    print(
+        f"{name:<12} {len(datasets) / best:>12,.0f} points/s   {size / len(datasets):.0f} bytes/point"
+    )
+
+
+# main section of script
+if __name__ == "__main__":
+    # parses script arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-p", "--points", type=int, default=100000)
+    parser.add_argument("-d", "--devices", type=int, default=20)
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    arguments = parser.parse_args()
+    datasets = generate(arguments.points, arguments.devices)
+    measure("serializer", serializer_path, datasets, arguments.repeat)
+    try:
+        measure("Point", point_path, datasets, arguments.repeat)
+    except ImportError:
+        print("Point        influxdb_client is not installed")
@@ -0,0 +1,215 @@
+"""
+Benchmark of whole air gathering pipeline, that runs without hardware and external services.
+Air purifiers are replaced by fake miIO devices on loopback addresses, monitors by simulated
+bluetooth driver, InfluxDB and ntfy server by local HTTP sink (see simulators.py).
+Each cycle goes through the same steps as in gatherer: fetching data by executor,
+storing readings in ring buffers, compression, writing points to InfluxDB and sending notification.
+Each number of devices is measured in fresh interpreter, with empty state directory,
+so reported peak memory is not affected by previous runs.
+
+Usage:
+$ python3 pipeline.py --devices 10 100 1000 --cycles 3
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "scripts"
+    )
+)
+
+import config
+from gatherer import Air
+from messenger import send_notification
+from models.device import MiMonitor2, read_device
+from simulators import SimulatedMonitor, monitor_data, purifier_data, serve
+from utils import tracing
+from utils.resilience import DeadlineExecutor, ProcessExecutor
+from utils.ring_buffer import ReadingsStore
+
+# drivers replaced by simulated ones
+SIMULATED = {MiMonitor2: SimulatedMonitor}
+
+
+def stats(sink: str) -> dict:
+    """Returns counters of sink."""
+    with urllib.request.urlopen(f"{sink}/stats") as response:
+        return json.load(response)
+
+
+@tracing.traced("benchmark.cycle")
+def cycle(devices: list) -> dict:
+    """Runs single gathering cycle and returns duration of its stages in seconds."""
+    start = time.perf_counter()
+    if config.GATHERER["ISOLATION"] == "process":
+        executor = ProcessExecutor()
+    else:
+        executor = DeadlineExecutor()
+    drivers = {}
+    for device_data in devices:
+        driver = Air.driver(device_data)
+        driver = SIMULATED.get(driver, driver)
+        drivers[device_data.mac_address] = (driver, device_data)
+        executor.submit(
+            device_data.mac_address,
+            read_device,
+            driver,
+            device_data,
+            lane="bluetooth" if driver.CAPABILITY == "bluetooth" else None,
+        )
+    results, failures = set(), 0
+    for result in executor.run():
+        driver, device_data = drivers[result.key]
+        if result.value:
+            results.add(driver.DATA_CLASS.unpack(device_data, result.value))
+        else:
+            failures += 1
+    with ReadingsStore() as readings:
+        for data in results:
+            readings.add(data)
+    fetched = time.perf_counter()
+    # saving stage of gatherer is used as is, without running its scan
+    Air.__new__(Air).save(results)
+    saved = time.perf_counter()
+    send_notification(
+        f"{len(results)} devices read", "Benchmark", priority=1, token="benchmark"
+    )
+    return {
+        "scan": fetched - start,
+        "save": saved - fetched,
+        "notify": time.perf_counter() - saved,
+        "total": time.perf_counter() - start,
+        "failures": failures,
+    }
+
+
+def scenario(arguments: argparse.Namespace) -> dict:
+    """Runs cycles with given number of devices and returns their summary."""
+    config.DATABASE["INFLUX"]["URL"] = arguments.sink
+    SimulatedMonitor.LATENCY = arguments.ble_latency
+    monitors = round(arguments.scenario * arguments.monitors)
+    devices = [purifier_data(index) for index in range(arguments.scenario - monitors)]
+    devices += [monitor_data(index) for index in range(monitors)]
+    before = stats(arguments.sink)
+    cycles = [cycle(devices) for _ in range(arguments.cycles)]
+    after = stats(arguments.sink)
+    total = sum(result["total"] for result in cycles)
+    return {
+        "devices": arguments.scenario,
+        "monitors": monitors,
+        "median": statistics.median(result["total"] for result in cycles),
+        "worst": max(result["total"] for result in cycles),
+        "scan": statistics.median(result["scan"] for result in cycles),
+        "save": statistics.median(result["save"] for result in cycles),
+        "notify": statistics.median(result["notify"] for result in cycles),
+        "failures": sum(result["failures"] for result in cycles),
+        "points": after["points"] - before["points"],
+        "points_per_second": (after["points"] - before["points"]) / total,
+        "notifications": after["notifications"] - before["notifications"],
+        # maximum resident set size is given in kilobytes on Linux
+        "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def measure(devices: int, arguments: argparse.Namespace) -> dict:
+    """Runs scenario of given number of devices in fresh interpreter."""
+    with tempfile.TemporaryDirectory(prefix="brainstone_benchmark_") as state:
+        environment = dict(
+            os.environ,
+            BRAINSTONE_STATE_DIR=state,
+            NTFY_URL=arguments.sink,
+            GATHERER_ISOLATION=arguments.isolation,
+        )
+        process = subprocess.run(
+            [
+                sys.executable,
+                os.path.realpath(__file__),
+                "--scenario",
+                str(devices),
+                "--cycles",
+                str(arguments.cycles),
+                "--monitors",
+                str(arguments.monitors),
+                "--ble-latency",
+                str(arguments.ble_latency),
+                "--sink",
+                arguments.sink,
+            ],
+            env=environment,
+            capture_output=True,
+            text=True,
+        )
+    if process.returncode:
+        raise RuntimeError(f"Scenario of {devices} devices failed\n{process.stderr}")
+    return json.loads(process.stdout.splitlines()[-1])
+
+
+# main section of script
+if __name__ == "__main__":
+    # parses script arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--devices", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("-c", "--cycles", type=int, default=3)
+    parser.add_argument(
+        "-m",
+        "--monitors",
+        type=float,
+        default=0.1,
+        help="Share of bluetooth monitors among devices",
+    )
+    parser.add_argument(
+        "--ble-latency",
+        type=float,
+        default=0.02,
+        help="Time of simulated bluetooth reading in seconds",
+    )
+    parser.add_argument(
+        "-i", "--isolation", choices=("thread", "process"), default="thread"
+    )
+    parser.add_argument("-p", "--port", type=int, default=8087, help="Port of sink")
+    # internal arguments of scenario process
+    parser.add_argument("--scenario", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--sink", help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+    if arguments.scenario is not None:
+        # pipeline logs each device, only problems are shown
+        logging.basicConfig(level=logging.WARNING)
+        print(json.dumps(scenario(arguments)))
+        sys.exit(0)
+    arguments.sink = f"http://127.0.0.1:{arguments.port}"
+    # stand-ins are run in separate process, so they do not affect measured process
+    ready = multiprocessing.Event()
+    simulator = multiprocessing.Process(
+        target=serve,
+        args=(max(arguments.devices), arguments.port, ready),
+        daemon=True,
+    )
+    simulator.start()
+    if not ready.wait(60):
+        sys.exit("Simulators have not started")
+    print(
+        f"{'devices':>8} {'median [s]':>11} {'worst [s]':>10} {'scan [s]':>9} "
+        f"{'save [s]':>9} {'points/s':>9} {'failures':>9} {'peak RSS [MB]':>14}"
+    )
+    for devices in sorted(arguments.devices):
+        result = measure(devices, arguments)
+        print(
+            f"{result['devices']:>8} {result['median']:>11.3f} {result['worst']:>10.3f} "
+            f"{result['scan']:>9.3f} {result['save']:>9.3f} "
+            f"{result['points_per_second']:>9.0f} {result['failures']:>9} "
+            f"{result['peak_rss']:>14.1f}"
+        )
+    simulator.terminate()
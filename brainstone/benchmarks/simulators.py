@@ -0,0 +1,260 @@
+"""
+Stand-ins of devices and external services, used to benchmark gathering pipeline without hardware.
+- FakeAirPurifier answers miIO protocol (handshake, miIO.info, get/set_properties) over UDP,
+  the same way as Xiaomi Mi Air Purifier 3H does, so the real miio client is exercised.
+  Each fake device listens on its own loopback address (127.0.x.y:54321).
+- SimulatedMonitor is MiMonitor2 driver that returns synthetic bluetooth readings after
+  configured latency, instead of connecting to bluetooth adapter.
+- SinkHandler accepts InfluxDB writes (/api/v2/write) and ntfy notifications (any other POST)
+  and counts them, counters are returned on GET /stats.
+
+Usage:
+$ python3 simulators.py --devices 100 --port 8087
+"""
+
+import argparse
+import asyncio
+import datetime
+import hashlib
+import json
+import os
+import random
+import struct
+import sys
+import threading
+import time
+import typing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from models.data import DeviceData
+from models.device import MiMonitor2
+
+
+# port of miIO protocol
+MIIO_PORT = 54321
+
+# model reported by fake air purifiers
+MIIO_MODEL = "zhimi.airpurifier.mb3"
+
+# miIO packet header, magic, length, unknown, device id, timestamp
+HEADER = struct.Struct(">HHI4sI")
+
+
+def purifier_address(index: int) -> str:
+    """Returns loopback address of fake air purifier of given index."""
+    return f"127.0.{1 + index // 250}.{1 + index % 250}"
+
+
+def purifier_data(index: int) -> DeviceData:
+    """Returns metadata of fake air purifier of given index."""
+    return DeviceData(
+        name=f"Purifier {index}",
+        location=f"room {index % 20}",
+        category="air",
+        brand="xiaomi",
+        mac_address=f"AA:00:00:00:{index // 256:02X}:{index % 256:02X}",
+        ip_address=purifier_address(index),
+        token=hashlib.md5(f"purifier {index}".encode()).hexdigest(),
+    )
+
+
+def monitor_data(index: int) -> DeviceData:
+    """Returns metadata of simulated monitor of given index."""
+    return DeviceData(
+        name=f"Monitor {index}",
+        location=f"room {index % 20}",
+        category="air",
+        brand="xiaomi",
+        mac_address=f"BB:00:00:00:{index // 256:02X}:{index % 256:02X}",
+    )
+
+
+class FakeAirPurifier(asyncio.DatagramProtocol):
+    """miIO protocol device, that reports random walk of air readings."""
+
+    def __init__(self, index: int) -> None:
+        self.token = bytes.fromhex(purifier_data(index).token)
+        self.device_id = struct.pack(">I", index + 1)
+        # AES-128-CBC key and initialization vector derived from token
+        self.key = hashlib.md5(self.token).digest()
+        self.iv = hashlib.md5(self.key + self.token).digest()
+        self.values = {
+            "temperature": random.uniform(18, 26),
+            "humidity": random.randint(30, 60),
+            "aqi": random.randint(0, 100),
+            "filter_life_remaining": random.randint(0, 100),
+            "power": True,
+        }
+        self.transport = None
+
+    def connection_made(self, transport: asyncio.DatagramTransport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, address: typing.Tuple) -> None:
+        if len(data) < HEADER.size + 16:
+            return
+        length = HEADER.unpack_from(data)[1]
+        # handshake, checksum field of reply is not verified by clients
+        if length == 32:
+            self.transport.sendto(self.__header(32) + b"\xff" * 16, address)
+            return
+        try:
+            request = json.loads(self.__decrypt(data[32:length]).rstrip(b"\x00"))
+        except ValueError:
+            return
+        reply = {"id": request["id"], "result": self.__result(request)}
+        payload = self.__encrypt(json.dumps(reply).encode() + b"\x00")
+        header = self.__header(32 + len(payload))
+        checksum = hashlib.md5(header + self.token + payload).digest()
+        self.transport.sendto(header + checksum + payload, address)
+
+    def __result(self, request: typing.Dict) -> typing.Any:
+        """Returns result of requested method."""
+        method, params = request.get("method"), request.get("params") or []
+        if method == "miIO.info":
+            return {"model": MIIO_MODEL, "fw_ver": "2.1.0", "hw_ver": "esp32"}
+        if method == "get_properties":
+            self.__step()
+            return [
+                {**param, "code": 0, "value": self.values.get(param["did"], 0)}
+                for param in params
+            ]
+        if method == "set_properties":
+            return [{**param, "code": 0} for param in params]
+        return ["ok"]
+
+    def __step(self) -> None:
+        """Moves readings by small random step."""
+        self.values["temperature"] += random.uniform(-0.3, 0.3)
+        self.values["humidity"] = max(
+            0, min(100, self.values["humidity"] + random.randint(-1, 1))
+        )
+        self.values["aqi"] = max(0, self.values["aqi"] + random.randint(-5, 5))
+
+    def __header(self, length: int) -> bytes:
+        return HEADER.pack(0x2131, length, 0, self.device_id, int(time.time()))
+
+    def __encrypt(self, plaintext: bytes) -> bytes:
+        from cryptography.hazmat.primitives import padding
+        from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+        padder = padding.PKCS7(128).padder()
+        padded = padder.update(plaintext) + padder.finalize()
+        encryptor = Cipher(algorithms.AES(self.key), modes.CBC(self.iv)).encryptor()
+        return encryptor.update(padded) + encryptor.finalize()
+
+    def __decrypt(self, ciphertext: bytes) -> bytes:
+        from cryptography.hazmat.primitives import padding
+        from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+        decryptor = Cipher(algorithms.AES(self.key), modes.CBC(self.iv)).decryptor()
+        padded = decryptor.update(ciphertext) + decryptor.finalize()
+        unpadder = padding.PKCS7(128).unpadder()
+        return unpadder.update(padded) + unpadder.finalize()
+
+
+class SimulatedMonitor(MiMonitor2):
+    """Mi Monitor 2 driver, that returns synthetic readings instead of connecting over bluetooth."""
+
+    # time of simulated bluetooth connection and notification
+    LATENCY = 0.02
+
+    def fetch(self) -> dict:
+        time.sleep(self.LATENCY)
+        # readings depend on device and current minute, so they change slowly between cycles
+        seed = random.Random(f"{self.metadata.mac_address}{int(time.time() // 60)}")
+        return {
+            "temperature": round(seed.uniform(18, 26), 1),
+            "humidity": seed.randint(30, 60),
+            "battery": seed.randint(20, 100),
+        }
+
+
+class SinkHandler(BaseHTTPRequestHandler):
+    """Accepts InfluxDB writes and ntfy notifications."""
+
+    # counters shared by each request, {name: value}
+    counters = {"writes": 0, "points": 0, "bytes": 0, "notifications": 0}
+    lock = threading.Lock()
+
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with self.lock:
+            self.counters["bytes"] += len(body)
+            if self.path.startswith("/api/v2/write"):
+                self.counters["writes"] += 1
+                self.counters["points"] += sum(1 for line in body.splitlines() if line)
+            else:
+                self.counters["notifications"] += 1
+        if self.path.startswith("/api/v2/write"):
+            self.send_response(204)
+            self.end_headers()
+        else:
+            self.__reply({"id": "benchmark", "event": "message"})
+
+    def do_GET(self) -> None:
+        if self.path != "/stats":
+            self.send_error(404)
+            return
+        with self.lock:
+            self.__reply(self.counters)
+
+    def log_message(self, format: str, *args) -> None:
+        # requests are not logged, as sink is called thousands times per cycle
+        pass
+
+    def __reply(self, content: typing.Dict) -> None:
+        body = json.dumps(content).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+async def start_purifiers(devices: int) -> typing.List[asyncio.DatagramTransport]:
+    """Starts given number of fake air purifiers."""
+    loop = asyncio.get_running_loop()
+    transports = []
+    for index in range(devices):
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda index=index: FakeAirPurifier(index),
+            local_addr=(purifier_address(index), MIIO_PORT),
+        )
+        transports.append(transport)
+    return transports
+
+
+def serve(
+    devices: int, port: int, ready: typing.Optional[threading.Event] = None
+) -> None:
+    """Runs fake air purifiers and sink until process is terminated.
+    Given event (i.e. multiprocessing.Event) is set when each stand-in is listening."""
+    sink = ThreadingHTTPServer(("127.0.0.1", port), SinkHandler)
+    threading.Thread(target=sink.serve_forever, daemon=True).start()
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(start_purifiers(devices))
+    if ready is not None:
+        ready.set()
+    print(
+        f"{datetime.datetime.now():%H:%M:%S} | {devices} purifiers on "
+        f"{purifier_address(0)}-{purifier_address(max(devices - 1, 0))}:{MIIO_PORT}, "
+        f"sink on http://127.0.0.1:{port}",
+        flush=True,
+    )
+    loop.run_forever()
+
+
+# main section of script
+if __name__ == "__main__":
+    # parses script arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--devices", type=int, default=100)
+    parser.add_argument("-p", "--port", type=int, default=8087)
+    arguments = parser.parse_args()
+    try:
+        serve(arguments.devices, arguments.port)
+    except KeyboardInterrupt:
+        pass
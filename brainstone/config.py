@@ -1,5 +1,5 @@
 import os
-import logging
+import socket
 
 from dotenv import load_dotenv
 
@@ -13,15 +13,8 @@ VARIABLES_PATH = os.path.join(BASE_DIR, ".env")
 # absolute path to log file
 LOG_FILE = os.path.join(os.sep, "var", "log", "cron.log")
 
-# logging configuration
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s | %(levelname)s | %(message)s",
-    handlers=[logging.StreamHandler(), logging.FileHandler(LOG_FILE)],
-)
-
-# imported libraries logging configuration
-logging.getLogger("miio").setLevel(logging.WARNING)
+# absolute path to directory that stores state shared between gatherer runs
+STATE_DIR = os.environ.get("BRAINSTONE_STATE_DIR", os.path.join(BASE_DIR, "state"))
 
 # loading environmental variables
 load_dotenv(VARIABLES_PATH)
@@ -41,3 +34,196 @@ DATABASE = {
         "PORT": 5432,
     },
 }
+
+# logging configuration
+LOGGING = {
+    # level of root logger and levels of modules, given as "module=LEVEL" pairs separated by commas,
+    # levels of modules can be changed at runtime in "logging" state file
+    "LEVEL": os.environ.get("LOG_LEVEL", "INFO"),
+    "LEVELS": os.environ.get("LOG_LEVELS", "miio=WARNING"),
+    # "json" renders each record as JSON document, "text" as plain line
+    "FORMAT": os.environ.get("LOG_FORMAT", "json"),
+    # log file, rotated when it exceeds given size, with given number of rotated files kept
+    "FILE": os.environ.get("LOG_FILE", LOG_FILE),
+    "MAX_BYTES": int(os.environ.get("LOG_MAX_BYTES", 10 * 1024 * 1024)),
+    "BACKUP_COUNT": int(os.environ.get("LOG_BACKUP_COUNT", 5)),
+    # name of state file with runtime levels of modules
+    "STATE": "logging",
+}
+
+# notifications configuration
+NOTIFICATIONS = {
+    # address of ntfy server, topic is taken from system settings
+    "URL": os.environ.get("NTFY_URL", "https://ntfy.sh").rstrip("/"),
+    # minimal time between notifications of the same ongoing issue, in seconds
+    "COOLDOWN": float(os.environ.get("NOTIFICATIONS_COOLDOWN", 300)),
+    # name of state file with time of last notification of each issue
+    "STATE": "notifications",
+}
+
+# gathering cycles configuration (time values in seconds)
+GATHERER = {
+    # maximum time of single device communication
+    "DEVICE_TIMEOUT": float(os.environ.get("GATHERER_DEVICE_TIMEOUT", 20)),
+    # maximum time of whole gathering cycle, has to be shorter than cron interval (1 minute)
+    "CYCLE_BUDGET": float(os.environ.get("GATHERER_CYCLE_BUDGET", 50)),
+    # number of consecutive failures after which device is skipped
+    "BREAKER_THRESHOLD": int(os.environ.get("GATHERER_BREAKER_THRESHOLD", 3)),
+    # first and maximum backoff time of skipped device
+    "BREAKER_BACKOFF": float(os.environ.get("GATHERER_BREAKER_BACKOFF", 300)),
+    "BREAKER_BACKOFF_MAX": float(
+        os.environ.get("GATHERER_BREAKER_BACKOFF_MAX", 6 * 3600)
+    ),
+    # "thread" runs device drivers in threads of gatherer process, "process" runs them
+    # in supervised worker processes, that are killed when driver hangs
+    "ISOLATION": os.environ.get("GATHERER_ISOLATION", "thread"),
+    # maximum number of worker processes
+    "WORKERS": int(os.environ.get("GATHERER_WORKERS", os.cpu_count() or 1)),
+}
+
+# adaptive polling configuration (time values in seconds)
+SCHEDULER = {
+    # bounds of single device polling interval
+    "MIN_INTERVAL": float(os.environ.get("SCHEDULER_MIN_INTERVAL", 60)),
+    "MAX_INTERVAL": float(os.environ.get("SCHEDULER_MAX_INTERVAL", 1800)),
+    # interval of device that has not been polled yet
+    "DEFAULT_INTERVAL": float(os.environ.get("SCHEDULER_DEFAULT_INTERVAL", 300)),
+    # interval multipliers applied on fast changing and on stable readings
+    "SHRINK_FACTOR": 0.5,
+    "STRETCH_FACTOR": 1.5,
+    # maximum random deviation of interval, as a fraction of interval
+    "JITTER": 0.1,
+    # change of value between two readings that is considered as fast
+    "THRESHOLDS": {"temperature": 0.5, "humidity": 3, "aqi": 10},
+}
+
+# compression of air and health points before writing them into InfluxDB
+COMPRESSION = {
+    # "deadband", "swinging_door" or "off"
+    "MODE": os.environ.get("COMPRESSION_MODE", "deadband"),
+    # maximum time without writing a field, has to be shorter than time range queried by central
+    "HEARTBEAT": float(os.environ.get("COMPRESSION_HEARTBEAT", 1800)),
+    # maximum error of reconstructed series, fields without tolerance are written on every change
+    "TOLERANCES": {
+        "temperature": 0.2,
+        "humidity": 1,
+        "aqi": 2,
+        "battery": 1,
+        "filter_life_remaining": 1,
+    },
+}
+
+# recent readings kept in memory-mapped ring buffers, shared between brainstone components
+READINGS = {
+    # time window covered by buffers, in seconds
+    "WINDOW": float(os.environ.get("READINGS_WINDOW", 24 * 3600)),
+    # time window of statistics exported as metrics, in seconds
+    "STATS_WINDOW": float(os.environ.get("READINGS_STATS_WINDOW", 3600)),
+    # the shortest time between two readings of single device, in seconds
+    "RESOLUTION": SCHEDULER["MIN_INTERVAL"],
+    # directory of buffer files, buffers are kept only in memory when it is empty
+    "DIRECTORY": os.environ.get(
+        "READINGS_DIRECTORY", os.path.join(STATE_DIR, "readings")
+    ),
+}
+
+# network scanning configuration (time values in seconds)
+NETWORK = {
+    # comma separated list of swept subnets
+    "SUBNETS": os.environ.get("NETWORK_SUBNETS", "192.168.0.0/24").split(","),
+    # network interface used for scanning, default route interface when empty
+    "INTERFACE": os.environ.get("NETWORK_INTERFACE") or None,
+    # time between full sweeps, in between only recently seen hosts are probed
+    "SWEEP_INTERVAL": float(os.environ.get("NETWORK_SWEEP_INTERVAL", 900)),
+    # hosts seen within this time are probed on each cycle
+    "KNOWN_HOST_TTL": float(os.environ.get("NETWORK_KNOWN_HOST_TTL", 24 * 3600)),
+    # time of waiting for answers after last request and number of resends of unanswered requests
+    "TIMEOUT": float(os.environ.get("NETWORK_TIMEOUT", 1)),
+    "RETRIES": int(os.environ.get("NETWORK_RETRIES", 1)),
+    # number of addresses swept by single worker request and number of parallel workers
+    "CHUNK_SIZE": int(os.environ.get("NETWORK_CHUNK_SIZE", 64)),
+    "WORKERS": int(os.environ.get("NETWORK_WORKERS", 4)),
+    # passive mode, presence is detected by sniffing ARP and DHCP traffic
+    "PASSIVE": os.environ.get("NETWORK_PASSIVE", "false").lower() == "true",
+    # time between saving presence in passive mode, silent hosts are confirmed by probe
+    "PASSIVE_INTERVAL": float(os.environ.get("NETWORK_PASSIVE_INTERVAL", 300)),
+}
+
+# distributed polling, nodes claim air devices from poll_tasks table of shared PostgreSQL database
+QUEUE = {
+    "ENABLED": os.environ.get("QUEUE_ENABLED", "false").lower() == "true",
+    # unique name of this node
+    "NODE": os.environ.get("QUEUE_NODE") or socket.gethostname(),
+    # comma separated list of interfaces of this node, "lan" and "bluetooth"
+    "CAPABILITIES": os.environ.get("QUEUE_CAPABILITIES", "lan,bluetooth").split(","),
+    # comma separated list of MAC addresses of bluetooth devices in range of this node's adapter,
+    # node claims any bluetooth device when empty
+    "BLUETOOTH": [
+        mac_address.strip().lower()
+        for mac_address in os.environ.get("QUEUE_BLUETOOTH", "").split(",")
+        if mac_address.strip()
+    ],
+    # time after which task claimed by node that did not release it can be claimed by other nodes
+    "LEASE": float(os.environ.get("QUEUE_LEASE", 300)),
+    # maximum number of tasks claimed in single cycle
+    "LIMIT": int(os.environ.get("QUEUE_LIMIT", 100)),
+}
+
+# metrics exposed in Prometheus format by exporter script
+METRICS = {
+    # port of /metrics endpoint, brainstone uses host network
+    "PORT": int(os.environ.get("METRICS_PORT", 9101)),
+    # upper bounds of histograms buckets, in seconds
+    "BUCKETS": (
+        0.005,
+        0.01,
+        0.025,
+        0.05,
+        0.1,
+        0.25,
+        0.5,
+        1,
+        2.5,
+        5,
+        10,
+        30,
+        60,
+        120,
+        300,
+    ),
+}
+
+# on-demand profiling of gatherer cycles
+PROFILING = {
+    # "cprofile", "sampling" or empty string when profiling is disabled
+    "MODE": os.environ.get("PROFILING_MODE", ""),
+    # comma separated list of profiled stages, "cycle", "scan" and "save"
+    "STAGES": os.environ.get("PROFILING_STAGES", "cycle").split(","),
+    # directory of profiles and number of the newest profiles kept of each gatherer and stage
+    "DIRECTORY": os.environ.get(
+        "PROFILING_DIRECTORY", os.path.join(STATE_DIR, "profiles")
+    ),
+    "KEEP": int(os.environ.get("PROFILING_KEEP", 20)),
+    # time between stack samples of sampling profiler, in seconds
+    "INTERVAL": float(os.environ.get("PROFILING_INTERVAL", 0.005)),
+}
+
+# tracing of cycles, database queries, devices and notifications
+TRACING = {
+    # "file", "http" or empty string when tracing is disabled
+    "EXPORTER": os.environ.get("TRACING_EXPORTER", ""),
+    # directory of traces and number of the newest traces kept
+    "DIRECTORY": os.environ.get("TRACING_DIRECTORY", os.path.join(STATE_DIR, "traces")),
+    "KEEP": int(os.environ.get("TRACING_KEEP", 50)),
+    # collector of http exporter and timeout of its requests, in seconds
+    "ENDPOINT": os.environ.get("TRACING_ENDPOINT", "http://localhost:9102/spans"),
+    "TIMEOUT": float(os.environ.get("TRACING_TIMEOUT", 2)),
+}
+
+
+def setup_logging() -> None:
+    """Configures logging of brainstone script. Called by entry points instead of at import,
+    so importing modules does not open log file. Subsequent calls have no effect."""
+    from utils.logs import setup
+
+    setup(LOGGING)
@@ -1,13 +1,79 @@
 """
 This script contains dataclasses representation of custom data structures in system.
+Dataclasses are slotted, so instances carry no per-instance __dict__. Names of fields,
+field groups and their extractors are computed once per class, not on each access.
 """
 
-from dataclasses import dataclass
+import operator
+import typing
+from collections.abc import Mapping
+from dataclasses import dataclass, fields
+
+
+# region HELPERS
+
+
+def slotted(cls: type) -> type:
+    """Recreates dataclass with __slots__ of its own fields.
+    Equivalent of dataclass(slots=True), which is available since Python 3.10.
+    Default values are removed from class namespace, as they would conflict with slots,
+    generated __init__ keeps its own references to them. Methods of recreated class
+    must not use zero-argument super()."""
+    inherited = {
+        name for base in cls.__mro__[1:] for name in getattr(base, "__slots__", ())
+    }
+    names = tuple(field.name for field in fields(cls) if field.name not in inherited)
+    namespace = dict(cls.__dict__)
+    for name in names + ("__dict__", "__weakref__"):
+        namespace.pop(name, None)
+    namespace["__slots__"] = names
+    slotted_cls = type(cls)(cls.__name__, cls.__bases__, namespace)
+    slotted_cls.__qualname__ = cls.__qualname__
+    return slotted_cls
+
+
+def extractor(names: typing.Tuple[str, ...]) -> typing.Callable:
+    """Returns function that extracts values of given attributes as tuple."""
+    if not names:
+        return lambda instance: ()
+    if len(names) == 1:
+        getter = operator.attrgetter(names[0])
+        return lambda instance: (getter(instance),)
+    return operator.attrgetter(*names)
+
+
+class FieldView(Mapping):
+    """Read-only mapping of selected dataclass fields.
+    Values are read from dataclass instance on access, nothing is copied."""
+
+    __slots__ = ("_instance", "_names")
+
+    def __init__(self, instance: object, names: typing.Tuple[str, ...]) -> None:
+        self._instance = instance
+        self._names = names
+
+    def __getitem__(self, key: str) -> typing.Any:
+        if key not in self._names:
+            raise KeyError(key)
+        return getattr(self._instance, key)
+
+    def __iter__(self) -> typing.Iterator[str]:
+        return iter(self._names)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+
+# endregion
 
 
 # region DEVICES
 
 
+@slotted
 @dataclass
 class DeviceData:
     """Dataclass representation of entities stored in
@@ -29,6 +95,7 @@ class DeviceData:
         return self.mac_address == other.mac_address
 
 
+@slotted
 @dataclass
 class UnknownDeviceData:
     """Dataclass representation of entities stored in
@@ -51,6 +118,7 @@ class UnknownDeviceData:
 # region AIR DATASETS
 
 
+@slotted
 @dataclass
 class Data:
     """Base class of each datasets dataclasses in this module."""
@@ -58,7 +126,41 @@ class Data:
     # fields
     device: DeviceData
 
+    # names of fields and names of fields other than device in declaration order,
+    # computed once per class
+    FIELD_NAMES = frozenset()
+    VALUE_NAMES = ()
+
+    def __init_subclass__(cls) -> None:
+        """Precomputes names and extractors of fields groups of each subclass.
+        Fields groups declared as sets are converted into tuples sorted by name.
+        Zero-argument super() is not used in slotted classes, as it refers to class before recreation.
+        """
+        cls.FIELD_NAMES = frozenset(getattr(cls, "__dataclass_fields__", ()))
+        cls.VALUE_NAMES = tuple(
+            name
+            for name in getattr(cls, "__dataclass_fields__", ())
+            if name != "device"
+        )
+        cls._values = staticmethod(extractor(cls.VALUE_NAMES))
+        for group in ("AIR", "HEALTH"):
+            names = tuple(sorted(getattr(cls, f"{group}_DATA_FIELDS", ())))
+            setattr(cls, f"{group}_DATA_FIELDS", names)
+            setattr(cls, f"_{group.lower()}_values", staticmethod(extractor(names)))
+
+    def pack(self) -> typing.Tuple:
+        """Returns values of fields other than device, in declaration order.
+        Packed dataset is compact to send between processes, device metadata is known to receiver.
+        """
+        return self._values(self)
+
+    @classmethod
+    def unpack(cls, device: DeviceData, values: typing.Sequence) -> "Data":
+        """Returns dataset of given device from values returned by pack method."""
+        return cls(device, *values)
+
 
+@slotted
 @dataclass
 class AirData(Data):
     """Dataclass of air devices datasets."""
@@ -70,7 +172,7 @@ class AirData(Data):
 
     # fields groups
     AIR_DATA_FIELDS = {"aqi", "humidity", "temperature"}
-    HEALTH_DATA_FIELDS = {}
+    HEALTH_DATA_FIELDS = set()
 
     def __hash__(self):
         return hash(self.device.mac_address)
@@ -85,18 +187,27 @@ class AirData(Data):
         )
 
     @property
-    def air_data(self) -> dict:
-        return dict(
-            [(field, self.__getattribute__(field)) for field in self.AIR_DATA_FIELDS]
-        )
+    def air_data(self) -> FieldView:
+        """Returns mapping of air fields, backed by dataclass instance."""
+        return FieldView(self, self.AIR_DATA_FIELDS)
 
     @property
-    def health_data(self) -> dict:
-        return dict(
-            [(field, self.__getattribute__(field)) for field in self.HEALTH_DATA_FIELDS]
-        )
+    def health_data(self) -> FieldView:
+        """Returns mapping of health fields, backed by dataclass instance."""
+        return FieldView(self, self.HEALTH_DATA_FIELDS)
+
+    @property
+    def air_values(self) -> typing.Tuple:
+        """Returns values of air fields, ordered by field name."""
+        return self._air_values(self)
+
+    @property
+    def health_values(self) -> typing.Tuple:
+        """Returns values of health fields, ordered by field name."""
+        return self._health_values(self)
 
 
+@slotted
 @dataclass(eq=False)
 class MiAirPurifier3HData(AirData):
     """Dataclass of Xiaomi Air Purifier 3H device."""
@@ -112,6 +223,7 @@ class MiAirPurifier3HData(AirData):
         return self.filter_life_remaining
 
 
+@slotted
 @dataclass(eq=False)
 class MiMonitor2Data(AirData):
     """Dataclass of Xiaomi Monitor 2 device."""
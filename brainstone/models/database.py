@@ -4,25 +4,28 @@ This script is used for storing classes used to communicate with databases.
 
 import config
 import logging
-import traceback
 import typing
 from datetime import datetime
 
-import influxdb_client
 import psycopg2
 import psycopg2.extras
-from influxdb_client import Point
-from influxdb_client.client.write_api import SYNCHRONOUS
 
 from models.data import DeviceData, UnknownDeviceData, AirData
+from models.line_protocol import LineProtocolSerializer
+from utils import tracing
+from utils.metrics import REGISTRY
+
+# logger of this module
+logger = logging.getLogger(__name__)
 
 
 class PostgreSQL:
     """Class responsible for PostgreSQL database communication."""
 
+    @tracing.traced("PostgreSQL.connect")
     def __init__(self, settings: bool = False) -> None:
         """Initializes database and api connection."""
-        logging.debug(f"DATABASE | {self.__class__.__name__} | Connecting")
+        logger.debug("DATABASE | %s | Connecting", self.__class__.__name__)
         self.client = psycopg2.connect(
             host=config.DATABASE["POSTGRE"]["HOST"],
             database=config.DATABASE["POSTGRE"]["NAME"],
@@ -35,22 +38,25 @@ class PostgreSQL:
             self.api = self.client.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
         else:
             self.api = self.client.cursor()
-        logging.debug(f"DATABASE | {self.__class__.__name__} | Connected")
+        logger.debug("DATABASE | %s | Connected", self.__class__.__name__)
 
     def __enter__(self) -> object:
         return self
 
+    @tracing.traced("PostgreSQL.close")
     def __exit__(self, exc_type, exc_value, exc_traceback) -> None:
         """Closes database and api connection."""
         # log error if any exception ocurred during context process
         if any((exc_type, exc_value, exc_traceback)):
-            logging.error(exc_value)
+            logger.error(exc_value)
         # closes connection and api
         self.api.close()
         self.client.close()
-        logging.debug(f"DATABASE | {self.__class__.__name__} | Connection closed")
+        logger.debug("DATABASE | %s | Connection closed", self.__class__.__name__)
 
     @property
+    @tracing.traced()
+    @REGISTRY.timed("brainstone_database_duration_seconds", database="postgresql")
     def devices(self) -> typing.Set[DeviceData]:
         """Returns set of registered devices."""
         try:
@@ -64,14 +70,14 @@ class PostgreSQL:
             )
             devices = set(DeviceData(*row) for row in self.api.fetchall())
         except Exception:
-            logging.error(
-                f"DATABASE | POSTGRESQL | UNKNOWN ERROR OCURRED\n{traceback.format_exc()}"
-            )
+            logger.exception("DATABASE | POSTGRESQL | UNKNOWN ERROR OCURRED")
             return set()
         else:
             return devices
 
     @property
+    @tracing.traced()
+    @REGISTRY.timed("brainstone_database_duration_seconds", database="postgresql")
     def settings(self) -> typing.Dict:
         """Returns current system settings."""
         try:
@@ -79,14 +85,14 @@ class PostgreSQL:
             result = self.api.fetchone()
             settings = dict(result)
         except Exception:
-            logging.error(
-                f"DATABASE | POSTGRESQL | UNKNOWN ERROR OCURRED\n{traceback.format_exc()}"
-            )
+            logger.exception("DATABASE | POSTGRESQL | UNKNOWN ERROR OCURRED")
             return {}
         else:
             return settings
 
     @property
+    @tracing.traced()
+    @REGISTRY.timed("brainstone_database_duration_seconds", database="postgresql")
     def unknown_devices(self) -> typing.Set[UnknownDeviceData]:
         """Returns set of unregistered devices."""
         try:
@@ -95,13 +101,13 @@ class PostgreSQL:
                 UnknownDeviceData(**row) for row in self.api.fetchall()
             )
         except Exception:
-            logging.error(
-                f"DATABASE | POSTGRESQL | UNKNOWN ERROR OCURRED\n{traceback.format_exc()}"
-            )
+            logger.exception("DATABASE | POSTGRESQL | UNKNOWN ERROR OCURRED")
             return set()
         else:
             return unknown_devices
 
+    @tracing.traced()
+    @REGISTRY.timed("brainstone_database_duration_seconds", database="postgresql")
     def add_unknown_device(self, mac_address: str) -> bool:
         """Checks if given mac address exists in database. If it doesn't insert new row.
         Otherwise, update existed row with current date and time.
@@ -129,13 +135,161 @@ class PostgreSQL:
                     ),
                 )
         except Exception:
-            logging.error(
-                f"DATABASE | POSTGRESQL | UNKNOWN ERROR OCURRED\n{traceback.format_exc()}"
+            logger.exception("DATABASE | POSTGRESQL | UNKNOWN ERROR OCURRED")
+            return False
+        else:
+            return True
+
+    @tracing.traced()
+    @REGISTRY.timed("brainstone_database_duration_seconds", database="postgresql")
+    def update_ip_addresses(self, addresses: typing.Dict[str, str]) -> int:
+        """Updates IP addresses of registered devices in single query.
+        Given dictionary maps MAC addresses to IP addresses, MAC addresses are compared case insensitive.
+        Returns number of updated devices, or -1 if operation failed.
+        """
+        try:
+            psycopg2.extras.execute_values(
+                self.api,
+                """
+                UPDATE devices_device AS d
+                SET ip_address = v.ip_address
+                FROM (VALUES %s) AS v(mac_address, ip_address)
+                WHERE lower(d.mac_address) = lower(v.mac_address)
+                AND d.ip_address IS DISTINCT FROM v.ip_address;
+                """,
+                list(addresses.items()),
+                page_size=max(len(addresses), 1),
+            )
+            updated = self.api.rowcount
+        except Exception:
+            logger.exception("DATABASE | POSTGRESQL | UNKNOWN ERROR OCURRED")
+            return -1
+        else:
+            if updated:
+                logger.info(
+                    "DATABASE | POSTGRESQL | Updated IP address of %s devices", updated
+                )
+            return updated
+
+    @tracing.traced()
+    @REGISTRY.timed("brainstone_database_duration_seconds", database="postgresql")
+    def sync_poll_tasks(self, tasks: typing.Dict[str, str]) -> bool:
+        """Creates poll task of each given device that has none and removes tasks of devices
+        that are not given anymore. Given dictionary maps MAC addresses to required capability.
+        Returns True if operation succeed. Otherwise, returns False.
+        """
+        try:
+            # table is created on database initialization, existing databases are upgraded by migrator
+            psycopg2.extras.execute_values(
+                self.api,
+                """
+                INSERT INTO poll_tasks(mac_address, capability) VALUES %s
+                ON CONFLICT (mac_address) DO UPDATE SET capability = EXCLUDED.capability
+                WHERE poll_tasks.capability <> EXCLUDED.capability;
+                """,
+                list(tasks.items()),
+                page_size=max(len(tasks), 1),
             )
+            self.api.execute(
+                "DELETE FROM poll_tasks WHERE NOT (mac_address = ANY(%s::varchar[]));",
+                (list(tasks),),
+            )
+        except Exception:
+            logger.exception("DATABASE | POSTGRESQL | UNKNOWN ERROR OCURRED")
             return False
         else:
             return True
 
+    @tracing.traced()
+    @REGISTRY.timed("brainstone_database_duration_seconds", database="postgresql")
+    def claim_poll_tasks(
+        self,
+        node: str,
+        capabilities: typing.List[str],
+        bluetooth: typing.List[str],
+        lease: float,
+        limit: int,
+    ) -> typing.Set[str]:
+        """Claims due poll tasks for given node and returns their MAC addresses.
+        Tasks locked by other nodes are skipped, so nodes never wait for each other and never claim
+        the same task. Task claimed by node that did not release it before lease expiry is claimed again.
+        Bluetooth tasks are claimed only if device is in range of node, when range list is given.
+        """
+        try:
+            self.api.execute(
+                """
+                UPDATE poll_tasks AS t
+                SET node = %(node)s,
+                    lease_until = now() + %(lease)s * interval '1 second',
+                    attempts = t.attempts + 1
+                FROM (
+                    SELECT mac_address FROM poll_tasks
+                    WHERE due_time <= now()
+                    AND (lease_until IS NULL OR lease_until < now())
+                    AND capability = ANY(%(capabilities)s::varchar[])
+                    AND (
+                        capability <> 'bluetooth'
+                        OR cardinality(%(bluetooth)s::varchar[]) = 0
+                        OR lower(mac_address) = ANY(%(bluetooth)s::varchar[])
+                    )
+                    ORDER BY due_time
+                    LIMIT %(limit)s
+                    FOR UPDATE SKIP LOCKED
+                ) AS c
+                WHERE t.mac_address = c.mac_address
+                RETURNING t.mac_address;
+                """,
+                {
+                    "node": node,
+                    "lease": lease,
+                    "capabilities": capabilities,
+                    "bluetooth": bluetooth,
+                    "limit": limit,
+                },
+            )
+            claimed = {row[0] for row in self.api.fetchall()}
+        except Exception:
+            logger.exception("DATABASE | POSTGRESQL | UNKNOWN ERROR OCURRED")
+            return set()
+        else:
+            logger.debug("DATABASE | POSTGRESQL | Claimed %s poll tasks", len(claimed))
+            return claimed
+
+    @tracing.traced()
+    @REGISTRY.timed("brainstone_database_duration_seconds", database="postgresql")
+    def release_poll_tasks(self, node: str, intervals: typing.Dict[str, float]) -> int:
+        """Releases poll tasks claimed by given node and schedules next polls.
+        Given dictionary maps MAC addresses to number of seconds to next poll. Tasks whose lease
+        has been taken over by other node are left untouched.
+        Returns number of released tasks, or -1 if operation failed.
+        """
+        try:
+            psycopg2.extras.execute_values(
+                self.api,
+                """
+                UPDATE poll_tasks AS t
+                SET node = NULL,
+                    lease_until = NULL,
+                    attempts = 0,
+                    due_time = now() + v.seconds * interval '1 second'
+                FROM (VALUES %s) AS v(mac_address, seconds, node)
+                WHERE t.mac_address = v.mac_address AND t.node = v.node;
+                """,
+                [
+                    (mac_address, seconds, node)
+                    for mac_address, seconds in intervals.items()
+                ],
+                page_size=max(len(intervals), 1),
+            )
+            released = self.api.rowcount
+        except Exception:
+            logger.exception("DATABASE | POSTGRESQL | UNKNOWN ERROR OCURRED")
+            return -1
+        else:
+            return released
+
+    @tracing.traced()
+    @REGISTRY.timed("brainstone_database_duration_seconds", database="postgresql")
     def get_device_by_name(self, device_name: str = "") -> DeviceData:
         """Returns set of DeviceData objects of given device name."""
         try:
@@ -151,13 +305,12 @@ class PostgreSQL:
             )
             device = DeviceData(*self.api.fetchone())
         except Exception:
-            logging.error(
-                f"DATABASE | POSTGRESQL | UNKNOWN ERROR OCURRED\n{traceback.format_exc()}"
-            )
+            logger.exception("DATABASE | POSTGRESQL | UNKNOWN ERROR OCURRED")
             return None
         else:
             return device
 
+    @tracing.traced()
     def get_device_by_type(self, device_type: str = "") -> typing.Set[DeviceData]:
         """Returns set of DeviceData objects of given device type."""
         try:
@@ -165,104 +318,170 @@ class PostgreSQL:
                 device for device in self.devices if device.category == device_type
             )
         except Exception:
-            logging.error(
-                f"DATABASE | POSTGRESQL | UNKNOWN ERROR OCURRED\n{traceback.format_exc()}"
-            )
+            logger.exception("DATABASE | POSTGRESQL | UNKNOWN ERROR OCURRED")
             return set()
         else:
             return devices_data
 
 
 class InfluxDB:
-    """Class responsible for Influx database connection."""
+    """Class responsible for Influx database connection.
+    Points are rendered straight into line protocol. In batch mode points are buffered
+    per bucket and written when buffer reaches BATCH_SIZE points or when context is closed,
+    otherwise each point is written immediately."""
 
+    # maximum number of points written in single request
+    BATCH_SIZE = 5000
+
+    def __init__(self, batch: bool = False) -> None:
+        self.batch = batch
+        # serializers of each bucket
+        self.buffers = {}
+
+    @tracing.traced("InfluxDB.connect")
     def __enter__(self) -> object:
+        # client library is imported on first connection, as it is the slowest import of brainstone
+        import influxdb_client
+        from influxdb_client.client.write_api import SYNCHRONOUS
+
         # initializes database connection
-        logging.debug(f"DATABASE | {self.__class__.__name__} | Connecting")
+        logger.debug("DATABASE | %s | Connecting", self.__class__.__name__)
         self.client = influxdb_client.InfluxDBClient(
             url=config.DATABASE["INFLUX"]["URL"],
             token=config.DATABASE["INFLUX"]["API_TOKEN"],
             org=config.DATABASE["INFLUX"]["ORGANIZATION"],
         )
         self.api = self.client.write_api(write_options=SYNCHRONOUS)
-        logging.debug(f"DATABASE | {self.__class__.__name__} | Connected")
+        logger.debug("DATABASE | %s | Connected", self.__class__.__name__)
         return self
 
+    @tracing.traced("InfluxDB.close")
     def __exit__(self, exc_type, exc_value, exc_traceback) -> None:
         # closes database connection
         # if any exception ocurred during context process
         if any((exc_type, exc_value, exc_traceback)):
-            logging.error(exc_value)
+            logger.error(exc_value)
+        # writes points remaining in buffers
+        self.flush()
         # closes database connection
         self.api.close()
         self.client.close()
-        logging.debug(f"DATABASE | {self.__class__.__name__} | Connection closed")
+        logger.debug("DATABASE | %s | Connection closed", self.__class__.__name__)
+
+    def buffer(self, bucket: str) -> LineProtocolSerializer:
+        """Returns serializer of given bucket."""
+        if bucket not in self.buffers:
+            self.buffers[bucket] = LineProtocolSerializer()
+        return self.buffers[bucket]
+
+    def flush(self, bucket: str = None) -> bool:
+        """Writes points buffered for given bucket (or each bucket) to database.
+        Returns True, if operation succeed. Otherwise returns False.
+        """
+        result = True
+        for name in (bucket,) if bucket else tuple(self.buffers):
+            serializer = self.buffers.get(name)
+            if not serializer:
+                continue
+            try:
+                with REGISTRY.timer(
+                    "brainstone_database_duration_seconds",
+                    database="influxdb",
+                    operation="write",
+                ), tracing.span("InfluxDB.write", bucket=name, points=len(serializer)):
+                    self.api.write(
+                        bucket=name,
+                        org=config.DATABASE["INFLUX"]["ORGANIZATION"],
+                        record=serializer.getvalue(),
+                        write_precision=serializer.precision,
+                    )
+                REGISTRY.increment(
+                    "brainstone_points_written_total", len(serializer), bucket=name
+                )
+            except Exception:
+                logger.exception("DATABASE | INFLUXDB | UNKNOWN ERROR OCURRED")
+                result = False
+            finally:
+                serializer.clear()
+        return result
+
+    def written(self, bucket: str) -> bool:
+        """Writes bucket buffer if batch mode is disabled or buffer is full.
+        Returns True, if operation succeed. Otherwise returns False.
+        """
+        if not self.batch or len(self.buffers[bucket]) >= self.BATCH_SIZE:
+            return self.flush(bucket)
+        return True
 
     def add_point_network(
-        self, measurement: str, metric: str, field: str, value: typing.Any
+        self,
+        measurement: str,
+        metric: str,
+        field: str,
+        value: typing.Any,
+        timestamp: float = None,
     ) -> bool:
         """Writes single network data entity to database.
         Returns True, if operation succeed. Otherwise returns False.
         """
         try:
-            point = Point(measurement).tag("metric", metric).field(field, value)
-            self.api.write(
-                bucket="network",
-                org=config.DATABASE["INFLUX"]["ORGANIZATION"],
-                record=point,
-            )
+            self.buffer("network").network(measurement, metric, field, value, timestamp)
         except Exception:
-            logging.error(
-                f"DATABASE | INFLUXDB | UNKNOWN ERROR OCURRED\n{traceback.format_exc()}"
-            )
+            logger.exception("DATABASE | INFLUXDB | UNKNOWN ERROR OCURRED")
             return False
         else:
-            return True
+            return self.written("network")
 
-    def add_point_air(self, air_data: AirData) -> bool:
+    def add_point_air(
+        self,
+        air_data: AirData,
+        fields: typing.Mapping[str, typing.Any] = None,
+        timestamp: float = None,
+    ) -> bool:
         """Writes single air data entity to database.
+        When 'fields' are given, only those fields are written (i.e. after compression).
+        When 'timestamp' (seconds since epoch) is not given, server time is used.
         Returns True, if operation succeed. Otherwise returns False.
         """
         try:
-            point = (
-                Point("air")
-                .tag("room", air_data.device.location)
-                .field("aqi", air_data.aqi)
-                .field("humidity", air_data.humidity)
-                .field("temperature", air_data.temperature)
-            )
-            self.api.write(
-                bucket="air",
-                org=config.DATABASE["INFLUX"]["ORGANIZATION"],
-                record=point,
-            )
+            if fields is None:
+                fields = self.air_fields(air_data)
+            if not self.buffer("air").air(air_data, fields, timestamp):
+                return True
         except Exception:
-            logging.error(
-                f"DATABASE | INFLUXDB | UNKNOWN ERROR OCURRED\n{traceback.format_exc()}"
-            )
+            logger.exception("DATABASE | INFLUXDB | UNKNOWN ERROR OCURRED")
             return False
         else:
-            return True
+            return self.written("air")
 
-    def add_point_health(self, air_data: AirData) -> bool:
+    def add_point_health(
+        self,
+        air_data: AirData,
+        fields: typing.Mapping[str, typing.Any] = None,
+        timestamp: float = None,
+    ) -> bool:
         """Writes single health data entity to database.
+        When 'fields' are given, only those fields are written (i.e. after compression).
+        When 'timestamp' (seconds since epoch) is not given, server time is used.
         Returns True, if operation succeed. Otherwise returns False.
         """
         try:
-            point = (
-                Point("health")
-                .tag("room", air_data.device.location)
-                .field("battery/filter", air_data.health_data_indicator)
-            )
-            self.api.write(
-                bucket="health",
-                org=config.DATABASE["INFLUX"]["ORGANIZATION"],
-                record=point,
-            )
+            if fields is None:
+                fields = self.health_fields(air_data)
+            if not self.buffer("health").health(air_data, fields, timestamp):
+                return True
         except Exception:
-            logging.error(
-                f"DATABASE | INFLUXDB | UNKNOWN ERROR OCURRED\n{traceback.format_exc()}"
-            )
+            logger.exception("DATABASE | INFLUXDB | UNKNOWN ERROR OCURRED")
             return False
         else:
-            return True
+            return self.written("health")
+
+    @staticmethod
+    def air_fields(air_data: AirData) -> typing.Mapping[str, typing.Any]:
+        """Returns fields of air point."""
+        return air_data.air_data
+
+    @staticmethod
+    def health_fields(air_data: AirData) -> typing.Mapping[str, typing.Any]:
+        """Returns fields of health point, each health metric is stored under its own name."""
+        return air_data.health_data
@@ -3,31 +3,44 @@ This script contains dedicated classes for communication with IoT devices connec
 """
 
 import logging
-import traceback
 import typing
 from abc import ABC, abstractmethod
-from dataclasses import fields
-
-import bluepy
-import miio
-import miio.exceptions
-from lywsd03mmc import Lywsd03mmcClient
 
+import config
 from models.data import (
     DeviceData,
     MiAirPurifier3HData,
     MiMonitor2Data,
 )
+from utils import tracing
+from utils.metrics import REGISTRY
+
+# logger of this module
+logger = logging.getLogger(__name__)
+
+# device libraries are imported by drivers that use them, as each of them
+# takes significant part of gatherer startup time
+if typing.TYPE_CHECKING:
+    import miio
 
 
 class Device(ABC):
     """Base class of each device class in this script."""
 
+    # dataclass of processed data
+    DATA_CLASS = DeviceData
+    # interface used for communication, "lan" or "bluetooth"
+    CAPABILITY = "lan"
+
     def __init__(self, device_data: DeviceData) -> None:
         # device metadata
         self.metadata = device_data
         # fetching raw data from device
-        self.raw_data = self.fetch()
+        with tracing.span(
+            f"{self.__class__.__name__}.fetch", device=device_data.mac_address
+        ):
+            self.raw_data = self.fetch()
+            tracing.annotate(available=self.available)
         # processing raw data
         self.processed_data = self.process_data()
 
@@ -36,6 +49,11 @@ class Device(ABC):
         """Returns processed data."""
         return self.processed_data
 
+    @property
+    def available(self) -> bool:
+        """Returns True if raw data has been fetched from device."""
+        return bool(self.raw_data)
+
     @abstractmethod
     def fetch(self) -> typing.Any:
         """Should implements the logic of fetching data from device."""
@@ -52,33 +70,44 @@ class MiAirPurifier3H(Device):
     https://mi-home.pl/products/mi-air-purifier-3h
     """
 
-    def fetch(self) -> miio.DeviceStatus:
+    # dataclass of processed data
+    DATA_CLASS = MiAirPurifier3HData
+
+    def fetch(self) -> "miio.DeviceStatus":
         """Connects to device and fetches data."""
+        import miio
+        import miio.exceptions
+
         try:
-            logging.debug(
-                f"DEVICE | MiAirPurifier3H | Connecting to {self.metadata.ip_address}"
+            logger.debug(
+                "DEVICE | MiAirPurifier3H | Connecting to %s", self.metadata.ip_address
             )
             # fetches data from device using miio library
             device = miio.AirPurifierMiot(
                 ip=self.metadata.ip_address,
                 token=self.metadata.token,
+                timeout=config.GATHERER["DEVICE_TIMEOUT"],
             )
             # retrieving data from device
             data = device.status()
         except miio.exceptions.DeviceException:
-            logging.error(f"DEVICE | MiAirPurifier3H | UNABLE TO DISCOVER DEVICE")
+            logger.error("DEVICE | MiAirPurifier3H | UNABLE TO DISCOVER DEVICE")
             return miio.DeviceStatus()
         except Exception:
-            logging.error(
-                f"DEVICE | MiAirPurifier3H | UNKNOWN ERROR OCURRED\n{traceback.format_exc()}"
-            )
+            logger.exception("DEVICE | MiAirPurifier3H | UNKNOWN ERROR OCURRED")
             return miio.DeviceStatus()
         else:
-            logging.debug(
-                f"DEVICE | MiAirPurifier3H | Connected to {self.metadata.ip_address}"
+            logger.debug(
+                "DEVICE | MiAirPurifier3H | Connected to %s", self.metadata.ip_address
             )
             return data
 
+    @property
+    def available(self) -> bool:
+        """Returns True if device status has been fetched.
+        Empty miio.DeviceStatus returned on failure has no 'data' attribute."""
+        return bool(getattr(self.raw_data, "data", None))
+
     def process_data(self) -> MiAirPurifier3HData:
         """Processes data from device and returns it as instance of dataclass."""
         try:
@@ -87,9 +116,7 @@ class MiAirPurifier3H(Device):
             # create dataclass instance
             processed_data = MiAirPurifier3HData(self.metadata, **parsed_data)
         except Exception:
-            logging.error(
-                f"DEVICE | MiAirPurifier3H | UNKNOWN ERROR OCURRED\n{traceback.format_exc()}"
-            )
+            logger.exception("DEVICE | MiAirPurifier3H | UNKNOWN ERROR OCURRED")
             return MiAirPurifier3HData(self.metadata)
         else:
             return processed_data
@@ -97,17 +124,14 @@ class MiAirPurifier3H(Device):
     def __parse(self, data) -> dict:
         """Parses data received from device into dictionary."""
         try:
-            # dictionary that will store parsed dataset
-            parsed_data = {}
-            # iterates over device data properties
-            for key, value in data.data.items():
-                # filters out only fields that are used in target dataclass
-                if key in [field.name for field in fields(MiAirPurifier3HData)]:
-                    parsed_data[key] = value
+            # filters out only fields that are used in target dataclass
+            parsed_data = {
+                key: value
+                for key, value in data.data.items()
+                if key in MiAirPurifier3HData.FIELD_NAMES
+            }
         except Exception:
-            logging.error(
-                f"DEVICE | MiAirPurifier3H | UNKNOWN ERROR OCURRED\n{traceback.format_exc()}"
-            )
+            logger.exception("DEVICE | MiAirPurifier3H | UNKNOWN ERROR OCURRED")
             return {}
         else:
             return parsed_data
@@ -118,27 +142,39 @@ class MiMonitor2(Device):
     https://mi-home.pl/products/mi-temperature-humidity-monitor-2
     """
 
+    # dataclass of processed data
+    DATA_CLASS = MiMonitor2Data
+    # interface used for communication
+    CAPABILITY = "bluetooth"
+
     def fetch(self) -> dict:
         """Connects to device and fetches data."""
+        import bluepy.btle
+        from lywsd03mmc import Lywsd03mmcClient
+
         try:
-            logging.debug(
-                f"DEVICE | MiMonitor2 | Connecting to {self.metadata.ip_address}"
+            logger.debug(
+                "DEVICE | MiMonitor2 | Connecting to %s", self.metadata.ip_address
             )
             # fetches data from device using external library
-            client = Lywsd03mmcClient(self.metadata.mac_address)
+            client = Lywsd03mmcClient(
+                self.metadata.mac_address,
+                notification_timeout=config.GATHERER["DEVICE_TIMEOUT"],
+            )
             # converts data to dictionary
             data = client.data._asdict()
         except bluepy.btle.BTLEDisconnectError:
-            logging.error("Error occurred when trying connect to device!")
+            REGISTRY.increment(
+                "brainstone_ble_disconnects_total", device=self.metadata.mac_address
+            )
+            logger.error("Error occurred when trying connect to device!")
             return {}
         except Exception:
-            logging.error(
-                f"DEVICE | MiMonitor2 | UNKNOWN ERROR OCURRED\n{traceback.format_exc()}"
-            )
+            logger.exception("DEVICE | MiMonitor2 | UNKNOWN ERROR OCURRED")
             return {}
         else:
-            logging.debug(
-                f"DEVICE | MiMonitor2 | Connected to {self.metadata.ip_address}"
+            logger.debug(
+                "DEVICE | MiMonitor2 | Connected to %s", self.metadata.ip_address
             )
             return data
 
@@ -147,9 +183,18 @@ class MiMonitor2(Device):
         try:
             processed_data = MiMonitor2Data(self.metadata, **self.raw_data)
         except Exception:
-            logging.error(
-                f"DEVICE | MiMonitor2 | UNKNOWN ERROR OCURRED\n{traceback.format_exc()}"
-            )
+            logger.exception("DEVICE | MiMonitor2 | UNKNOWN ERROR OCURRED")
             return MiMonitor2Data(self.metadata)
         else:
             return processed_data
+
+
+def read_device(
+    driver: typing.Type[Device], device_data: DeviceData
+) -> typing.Optional[typing.Tuple]:
+    """Fetches data from device with given driver class and returns packed dataset,
+    or None if device has not responded. Packed dataset is restored with DATA_CLASS.unpack.
+    Used by gatherer executors, including worker processes that can not share dataclass instances.
+    """
+    device = driver(device_data)
+    return device.data.pack() if device.available else None
@@ -0,0 +1,163 @@
+"""
+This script contains serializer that renders datasets directly into InfluxDB line protocol.
+It replaces building influxdb_client.Point objects on hot paths. Escaped series keys of devices
+are cached, so each next point of the same device costs only fields and timestamp formatting.
+https://docs.influxdata.com/influxdb/v2/reference/syntax/line-protocol/
+"""
+
+import math
+import typing
+
+from models.data import AirData, DeviceData
+
+
+# multipliers converting seconds into timestamp of given precision
+PRECISIONS = {"s": 1, "ms": 10**3, "us": 10**6, "ns": 10**9}
+
+# escaping tables of each line protocol element
+MEASUREMENT_ESCAPES = str.maketrans({",": "\\,", " ": "\\ ", "\n": "\\n"})
+KEY_ESCAPES = str.maketrans({",": "\\,", "=": "\\=", " ": "\\ ", "\n": "\\n"})
+STRING_ESCAPES = str.maketrans({'"': '\\"', "\\": "\\\\"})
+
+
+def escape_measurement(value: str) -> str:
+    """Escapes measurement name."""
+    return value.translate(MEASUREMENT_ESCAPES)
+
+
+def escape_key(value: str) -> str:
+    """Escapes tag key, tag value or field key."""
+    return value.translate(KEY_ESCAPES)
+
+
+def writable(value: typing.Any) -> bool:
+    """Returns True if value can be written as field. Empty values are skipped,
+    as well as non-finite floats, that are rejected by InfluxDB together with whole batch
+    (influxdb_client.Point skips them too)."""
+    if value is None:
+        return False
+    return not isinstance(value, float) or math.isfinite(value)
+
+
+def format_field(value: typing.Any) -> str:
+    """Formats field value, types match the ones written by influxdb_client.Point."""
+    # bool has to be checked before int, as it is its subclass
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, int):
+        return f"{value}i"
+    if isinstance(value, float):
+        return repr(value)
+    return f'"{str(value).translate(STRING_ESCAPES)}"'
+
+
+class LineProtocolSerializer:
+    """Renders points into single reusable bytearray buffer.
+    Each point is terminated with new line, so buffer content can be written as one batch.
+    """
+
+    def __init__(self, precision: str = "ns") -> None:
+        self.precision = precision
+        self.multiplier = PRECISIONS[precision]
+        # buffer that stores rendered points
+        self.buffer = bytearray()
+        # number of points stored in buffer
+        self.length = 0
+        # cache of escaped series keys, {(measurement, mac_address): bytes}
+        self.series = {}
+
+    def __len__(self) -> int:
+        return self.length
+
+    def getvalue(self) -> bytes:
+        """Returns rendered points."""
+        return bytes(self.buffer)
+
+    def clear(self) -> None:
+        """Removes rendered points, buffer memory is kept for next batch."""
+        del self.buffer[:]
+        self.length = 0
+
+    def series_key(self, measurement: str, device: DeviceData) -> bytes:
+        """Returns escaped measurement with device tags, sorted by tag key."""
+        key = (measurement, device.mac_address)
+        series = self.series.get(key)
+        if series is None:
+            tags = {
+                "brand": device.brand,
+                "category": device.category,
+                "device": device.name,
+                "mac_address": device.mac_address.lower(),
+                "room": device.location,
+            }
+            series = self.series[key] = self.render_series(measurement, tags)
+        return series
+
+    @staticmethod
+    def render_series(measurement: str, tags: typing.Dict[str, str]) -> bytes:
+        """Returns escaped measurement with tags. Empty tags are omitted, as line protocol does not allow them."""
+        elements = [escape_measurement(measurement)]
+        for tag, value in sorted(tags.items()):
+            if value:
+                elements.append(f"{escape_key(tag)}={escape_key(str(value))}")
+        return ",".join(elements).encode("utf-8")
+
+    def add(
+        self,
+        series: bytes,
+        fields: typing.Mapping[str, typing.Any],
+        timestamp: float = None,
+    ) -> bool:
+        """Renders single point of already escaped series. Empty and non-finite fields are skipped.
+        Returns False, if there was no field to render."""
+        rendered = ",".join(
+            f"{escape_key(field)}={format_field(value)}"
+            for field, value in fields.items()
+            if writable(value)
+        )
+        if not rendered:
+            return False
+        buffer = self.buffer
+        buffer += series
+        buffer += b" "
+        buffer += rendered.encode("utf-8")
+        if timestamp is not None:
+            buffer += b" %d" % int(timestamp * self.multiplier)
+        buffer += b"\n"
+        self.length += 1
+        return True
+
+    def air(
+        self,
+        air_data: AirData,
+        fields: typing.Mapping[str, typing.Any],
+        timestamp: float = None,
+    ) -> bool:
+        """Renders air point of device."""
+        return self.add(self.series_key("air", air_data.device), fields, timestamp)
+
+    def health(
+        self,
+        air_data: AirData,
+        fields: typing.Mapping[str, typing.Any],
+        timestamp: float = None,
+    ) -> bool:
+        """Renders health point of device."""
+        return self.add(self.series_key("health", air_data.device), fields, timestamp)
+
+    def network(
+        self,
+        measurement: str,
+        metric: str,
+        field: str,
+        value: typing.Any,
+        timestamp: float = None,
+    ) -> bool:
+        """Renders network point."""
+        key = (measurement, metric)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = self.render_series(
+                measurement, {"metric": metric}
+            )
+        return self.add(series, {field: value}, timestamp)
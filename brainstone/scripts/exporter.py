@@ -0,0 +1,53 @@
+"""
+This script serves brainstone metrics in Prometheus text format on /metrics endpoint.
+Metrics are recorded by gatherer runs and merged into metrics state file, so exporter
+only renders that file on each scrape.
+
+Usage:
+$ python3 exporter.py --port 9101
+"""
+
+import argparse
+import logging
+import os
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import config
+from utils.metrics import REGISTRY
+
+# logger of this module
+logger = logging.getLogger("exporter")
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Handles scrape requests."""
+
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        # scrapes are not logged, they would flood cron log
+        pass
+
+
+# main section of script
+if __name__ == "__main__":
+    config.setup_logging()
+    # parses script arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-p", "--port", type=int, default=config.METRICS["PORT"])
+    arguments = parser.parse_args()
+    server = ThreadingHTTPServer(("", arguments.port), MetricsHandler)
+    logger.info("EXPORTER | Serving metrics on port %s", arguments.port)
+    server.serve_forever()
@@ -3,35 +3,56 @@ This script is used for gathering data from devices connected to local network.
 """
 
 import argparse
-import copy
 import logging
 import os
 import sys
-import traceback
+import time
 import typing
 from abc import ABC, abstractmethod
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
 
-from scapy.all import arping
-
+import config
 import sentry
-from models.data import (
-    DeviceData,
-    AirData,
-    MiAirPurifier3HData,
-    MiMonitor2Data,
-)
+from models.data import AirData, DeviceData
 from models.database import PostgreSQL, InfluxDB
-from models.device import MiAirPurifier3H, MiMonitor2
+from models.device import Device, MiAirPurifier3H, MiMonitor2, read_device
+from utils import logs, tracing
+from utils.arp import ArpScanner, ArpTable
+from utils.compression import get_compressor
+from utils.metrics import REGISTRY
+from utils.presence import PassiveMonitor
+from utils.profiling import profile
+from utils.ring_buffer import ReadingsStore
+from utils.resilience import (
+    CircuitBreaker,
+    CycleLock,
+    DeadlineExecutor,
+    ProcessExecutor,
+)
+from utils.scheduler import AdaptiveScheduler
+
+# logger of this module
+logger = logging.getLogger("gatherer")
 
 
 class Gatherer(ABC):
     """Base class of each other classes in this script."""
 
     def __init__(self) -> None:
-        """Initializes object by calling save method that takes the result of scan method as an argument."""
-        self.save(self.scan())
+        """Initializes object by calling save method that takes the result of scan method as an argument.
+        Records logged within cycle carry its identifier.
+        Cycle and each of its stages are profiled when profiling is enabled for them
+        and traced when tracing is enabled."""
+        name = self.__class__.__name__.lower()
+        with logs.cycle(name) as cycle, REGISTRY.timer(
+            "brainstone_cycle_duration_seconds", gatherer=name
+        ), tracing.span(f"{name}.cycle", cycle=cycle):
+            with profile(name, "cycle"):
+                with profile(name, "scan"), tracing.span(f"{name}.scan"):
+                    data = self.scan()
+                with profile(name, "save"), tracing.span(f"{name}.save"):
+                    self.save(data)
 
     @abstractmethod
     def save(self, data: typing.Set[str]) -> bool:
@@ -49,38 +70,49 @@ class Gatherer(ABC):
 class Network(Gatherer):
     """Gathers network data from devices connected to a local network."""
 
-    def scan(self) -> typing.Set[str]:
-        """Performs arp scan of local network and returns set of MAC addresses."""
+    def scan(self) -> typing.Dict[str, str]:
+        """Performs arp scan of local network and returns dictionary of MAC addresses
+        and IP addresses assigned to them. Recently seen hosts are probed directly,
+        configured subnets are swept only when sweep interval has passed."""
         try:
-            logging.debug("GATHERER | NETWORK | Scan started")
+            logger.debug("GATHERER | NETWORK | Scan started")
             # performs arp scan
-            answered, unanswered = arping("192.168.0.0/24", verbose=0)
-            # set of MAC addresses
-            mac_addresses = set(
-                destination["Ether"].src for source, destination in answered
-            )
+            addresses = ArpScanner(ArpTable()).scan()
         except Exception:
-            logging.error(f"GATHERER | NETWORK\n{traceback.format_exc()}")
-            return set()
+            logger.exception("GATHERER | NETWORK")
+            return {}
         else:
-            logging.debug("GATHERER | NETWORK | Scan completed")
-            return mac_addresses
+            logger.debug("GATHERER | NETWORK | Scan completed")
+            return addresses
 
-    def save(self, data: typing.Set[str]) -> bool:
+    def save(self, data: typing.Dict[str, str]) -> bool:
         """Saves MAC addresses and number of active devices to database.
         Before data are written to database, sentry.py script is used to verify
         if there are unknown MAC addresses in received 'data' set or
         number of connected devices exceed threshold.
+        IP addresses of registered devices are updated when they have changed.
         Returns True, if saving process succeed, otherwise False."""
         try:
-            logging.debug("GATHERER | NETWORK | Data saving")
-            # copying received data
-            mac_addresses = copy.deepcopy(data)
+            logger.debug("GATHERER | NETWORK | Data saving")
+            # set of MAC addresses
+            mac_addresses = set(data)
             # verifies if there is a new MAC address in received set
             # or number of connected devices exceed threshold
             sentry.check_network(mac_addresses=mac_addresses)
+            # updates IP addresses of registered devices, MAC to IP addresses table is stored
+            # only when they have been updated, so failed update is retried on next cycle
+            arp_table = ArpTable()
+            changed = arp_table.update(data)
+            updated = 0
+            if changed:
+                with PostgreSQL() as postgresql:
+                    updated = postgresql.update_ip_addresses(changed)
+            if updated < 0:
+                logger.error("GATHERER | NETWORK | IP addresses of devices not updated")
+            else:
+                arp_table.save()
             # connects to influx database
-            with InfluxDB() as influx_database:
+            with InfluxDB(batch=True) as influx_database:
                 # "availability" tag
                 # iterates over mac addresses
                 for mac_address in mac_addresses:
@@ -101,123 +133,346 @@ class Network(Gatherer):
                     field="quantity",
                     value=number_of_devices,
                 )
-                logging.info(
-                    f"GATHERER | "
-                    f"LOCATION = local | "
-                    f"DATA = network.availability | "
-                    f"VALUES = {mac_addresses} | "
+                logger.debug(
+                    "GATHERER | LOCATION = local | DATA = network.availability | VALUES = %s | ",
+                    mac_addresses,
                 )
-                logging.info(
-                    f"GATHERER | "
-                    f"LOCATION = local | "
-                    f"DATA = network.number | "
-                    f"VALUES = {number_of_devices} | "
+                logger.info(
+                    "GATHERER | LOCATION = local | DATA = network.number | VALUES = %s | ",
+                    number_of_devices,
                 )
         except Exception:
-            logging.error(f"GATHERER | NETWORK\n{traceback.format_exc()}")
+            logger.exception("GATHERER | NETWORK")
             return False
         else:
-            logging.debug("GATHERER | NETWORK | Data saved")
+            logger.debug("GATHERER | NETWORK | Data saved")
             return True
 
 
+class PassiveNetwork(Network):
+    """Gathers network data by sniffing ARP and DHCP traffic.
+    Hosts heard for the first time are verified by sentry immediately.
+    Once per passive interval presence is saved, known hosts that stayed silent
+    are confirmed by unicast ARP probe. Runs until process is terminated."""
+
+    def __init__(self) -> None:
+        # hosts seen recently are not reported as new
+        known = ArpTable().recent(config.NETWORK["KNOWN_HOST_TTL"])
+        self.monitor = PassiveMonitor(on_new=self.__verify, known=known)
+        self.monitor.start()
+        try:
+            while True:
+                time.sleep(config.NETWORK["PASSIVE_INTERVAL"])
+                with logs.cycle("passivenetwork") as cycle, REGISTRY.timer(
+                    "brainstone_cycle_duration_seconds", gatherer="passivenetwork"
+                ), profile("passivenetwork", "cycle"), tracing.span(
+                    "passivenetwork.cycle", cycle=cycle
+                ):
+                    with tracing.span("passivenetwork.scan"):
+                        data = self.scan()
+                    with tracing.span("passivenetwork.save"):
+                        self.save(data)
+                # process never exits, so metrics are merged after each save
+                REGISTRY.flush()
+        finally:
+            self.monitor.stop()
+
+    def scan(self) -> typing.Dict[str, str]:
+        """Returns dictionary of MAC and IP addresses of hosts present in last passive interval."""
+        try:
+            logger.debug("GATHERER | NETWORK | Passive scan started")
+            arp_table = ArpTable()
+            # hosts heard in last interval
+            addresses = self.monitor.present(config.NETWORK["PASSIVE_INTERVAL"])
+            # known hosts that stayed silent, only those are probed to confirm departures
+            silent = {
+                mac_address: ip_address
+                for mac_address, ip_address in arp_table.recent(
+                    config.NETWORK["KNOWN_HOST_TTL"]
+                ).items()
+                if mac_address not in addresses and ip_address
+            }
+            addresses.update(ArpScanner(arp_table).probe(silent))
+        except Exception:
+            logger.exception("GATHERER | NETWORK")
+            return {}
+        else:
+            logger.debug(
+                "GATHERER | NETWORK | Passive scan completed, %s silent hosts probed",
+                len(silent),
+            )
+            return addresses
+
+    @staticmethod
+    def __verify(mac_address: str, ip_address: str) -> None:
+        """Verifies host heard for the first time."""
+        sentry.check_network(mac_addresses={mac_address}, check_overload=False)
+
+
 class Air(Gatherer):
     """Gathers information from air devices connected to local network."""
 
     def scan(self) -> typing.Set[AirData]:
-        """Gathers air data from each device tagged as "air"."""
+        """Gathers air data from each device tagged as "air".
+        Each device is contacted with its own deadline and whole scan is limited by cycle budget.
+        Devices that failed repeatedly are skipped by circuit breaker
+        and devices that are not due are skipped by adaptive scheduler."""
         try:
-            logging.debug("GATHERER | AIR | Scan started")
+            logger.debug("GATHERER | AIR | Scan started")
             # set that stores air data from each device
             results = set()
+            # executor that runs device communication within deadlines,
+            # drivers are run in worker processes when isolation is enabled
+            if config.GATHERER["ISOLATION"] == "process":
+                executor = ProcessExecutor()
+            else:
+                executor = DeadlineExecutor()
+            # driver class and metadata of each submitted device, {mac_address: (driver, device_data)}
+            drivers = {}
             with PostgreSQL() as postgresql:
+                devices = postgresql.get_device_by_type("air")
+                # in distributed mode only devices claimed by this node are polled
+                if config.QUEUE["ENABLED"]:
+                    devices = self.__claim(postgresql, devices)
+            # MAC to IP addresses table, read only
+            arp_table = ArpTable()
+            with CircuitBreaker() as breaker, AdaptiveScheduler() as scheduler:
                 # iterates over air devices data
-                for device_data in postgresql.get_device_by_type("air"):
-                    # name of device
-                    device_name = device_data.name.lower()
-                    # calls specific method depending on device type
-                    if "purifier" in device_name:
-                        results.add(self.__scan_purifier(device_data))
-                    elif "monitor" in device_name:
-                        results.add(self.__scan_monitor(device_data))
+                for device_data in devices:
+                    # skips device that is not due in current cycle,
+                    # due time of claimed devices is kept by poll task
+                    if not config.QUEUE["ENABLED"] and not scheduler.due(
+                        device_data.mac_address
+                    ):
+                        continue
+                    # skips device with opened circuit
+                    if not breaker.allow(device_data.mac_address):
+                        logger.warning(
+                            "GATHERER | AIR | Device '%s' skipped, circuit is open",
+                            device_data.name,
+                        )
+                        continue
+                    # selects driver depending on device type
+                    driver = self.driver(device_data)
+                    if driver is None:
+                        logger.error("Device '%s' is not supported!", device_data.name)
+                        continue
+                    if driver.CAPABILITY == "lan":
+                        # IP address seen by the most recent ARP sweep
+                        device_data.ip_address = arp_table.resolve(
+                            device_data.mac_address, device_data.ip_address
+                        )
+                    drivers[device_data.mac_address] = (driver, device_data)
+                    # bluetooth devices share single adapter, so they are queried one by one
+                    executor.submit(
+                        device_data.mac_address,
+                        read_device,
+                        driver,
+                        device_data,
+                        lane="bluetooth" if driver.CAPABILITY == "bluetooth" else None,
+                    )
+                # collects results and updates circuit breaker
+                for result in executor.run():
+                    # skipped device is not penalized, it stays due for the next cycle
+                    if result.skipped:
+                        continue
+                    driver, device_data = drivers[result.key]
+                    REGISTRY.observe(
+                        "brainstone_fetch_duration_seconds",
+                        result.duration,
+                        device=result.key,
+                        driver=driver.__name__,
+                    )
+                    if result.value:
+                        results.add(driver.DATA_CLASS.unpack(device_data, result.value))
+                        breaker.success(result.key)
                     else:
-                        logging.error(f"Device '{device_name}' is not supported!")
+                        if result.error:
+                            logger.error(
+                                "GATHERER | AIR | %s | %s", result.key, result.error
+                            )
+                        REGISTRY.increment(
+                            "brainstone_fetch_failures_total",
+                            device=result.key,
+                            driver=driver.__name__,
+                        )
+                        breaker.failure(result.key)
+                        scheduler.postpone(result.key)
+                # stores readings in ring buffers and exports their window statistics
+                with ReadingsStore() as readings:
+                    for data in results:
+                        readings.add(data)
+                        readings.publish(data)
+                # calls sentry script to verifies data
+                issues = sentry.check_air(results)
+                sentry.check_diagnostic(results)
+                # adjusts polling interval of each device, locations with issues are polled faster
+                alerts = {location for _, location in issues}
+                for data in results:
+                    scheduler.update(
+                        data.device.mac_address,
+                        data.air_data,
+                        alert=data.device.location in alerts,
+                    )
+                # releases claimed devices, next poll is scheduled by adaptive scheduler
+                if config.QUEUE["ENABLED"]:
+                    with PostgreSQL() as postgresql:
+                        postgresql.release_poll_tasks(
+                            config.QUEUE["NODE"],
+                            {
+                                device_data.mac_address: scheduler.delay(
+                                    device_data.mac_address
+                                )
+                                for device_data in devices
+                            },
+                        )
         except Exception:
-            logging.error(f"GATHERER | AIR\n{traceback.format_exc()}")
+            logger.exception("GATHERER | AIR")
             return results
         else:
-            # calls sentry script to verifies data
-            sentry.check_air(results)
-            sentry.check_diagnostic(results)
-            logging.debug("GATHERER | AIR | Scan completed")
+            logger.debug("GATHERER | AIR | Scan completed")
             return results
 
+    @staticmethod
+    def driver(device_data: DeviceData) -> typing.Optional[typing.Type[Device]]:
+        """Returns driver class of given device, None if device is not supported."""
+        device_name = device_data.name.lower()
+        if "purifier" in device_name:
+            return MiAirPurifier3H
+        if "monitor" in device_name:
+            return MiMonitor2
+        return None
+
+    def __claim(
+        self, postgresql: PostgreSQL, devices: typing.Set[DeviceData]
+    ) -> typing.Set[DeviceData]:
+        """Synchronizes poll tasks with registered devices and returns devices claimed by this node."""
+        if devices:
+            postgresql.sync_poll_tasks(
+                {
+                    device_data.mac_address: self.driver(device_data).CAPABILITY
+                    for device_data in devices
+                    if self.driver(device_data)
+                }
+            )
+        claimed = postgresql.claim_poll_tasks(
+            config.QUEUE["NODE"],
+            config.QUEUE["CAPABILITIES"],
+            config.QUEUE["BLUETOOTH"],
+            config.QUEUE["LEASE"],
+            config.QUEUE["LIMIT"],
+        )
+        logger.debug(
+            "GATHERER | AIR | Node '%s' claimed %s devices",
+            config.QUEUE["NODE"],
+            len(claimed),
+        )
+        return {
+            device_data for device_data in devices if device_data.mac_address in claimed
+        }
+
     def save(self, air_data: typing.Set[AirData]) -> bool:
         """Saves retrieved data from each air devices to database.
+        Readings are passed through compression stage first, so values that did not change
+        more than configured tolerance are not written.
         Returns True, if saving process succeed, otherwise False."""
         try:
-            logging.debug("GATHERER | AIR | Data saving")
+            logger.debug("GATHERER | AIR | Data saving")
+            # time of readings
+            timestamp = time.time()
+            compressor = get_compressor()
+            written = True
             # connects to influx database
-            with InfluxDB() as influx_database:
+            with InfluxDB(batch=True) as influx_database:
                 # iterates over datasets
                 for data in air_data:
-                    # prepares data for saving into influx database
-                    influx_database.add_point_health(data)
-                    logging.info(
-                        f"GATHERER | "
-                        f"LOCATION = {data.device.location} | "
-                        f"DATA = health | "
-                        f"VALUES = {data.health_data_indicator} | "
-                    )
-                    influx_database.add_point_air(data)
-                    logging.info(
-                        f"GATHERER | "
-                        f"LOCATION = {data.device.location} | "
-                        f"DATA = air | "
-                        f"VALUES = AQI: {data.aqi}, HUMIDITY: {data.humidity}, TEMPERATURE: {data.temperature} | "
-                    )
+                    with logs.device(data.device.mac_address):
+                        # prepares data for saving into influx database
+                        rows = compressor.compress(
+                            f"health:{data.device.mac_address}",
+                            influx_database.health_fields(data),
+                            timestamp,
+                        )
+                        for row_timestamp, fields in rows.items():
+                            written &= influx_database.add_point_health(
+                                data, fields, row_timestamp
+                            )
+                        logger.info(
+                            "GATHERER | LOCATION = %s | DATA = health | "
+                            "VALUES = %s | WRITTEN = %s | ",
+                            data.device.location,
+                            data.health_data,
+                            len(rows),
+                        )
+                        rows = compressor.compress(
+                            f"air:{data.device.mac_address}",
+                            influx_database.air_fields(data),
+                            timestamp,
+                        )
+                        for row_timestamp, fields in rows.items():
+                            written &= influx_database.add_point_air(
+                                data, fields, row_timestamp
+                            )
+                        logger.info(
+                            "GATHERER | LOCATION = %s | DATA = air | "
+                            "VALUES = AQI: %s, HUMIDITY: %s, TEMPERATURE: %s | WRITTEN = %s | ",
+                            data.device.location,
+                            data.aqi,
+                            data.humidity,
+                            data.temperature,
+                            len(rows),
+                        )
+                written &= influx_database.flush()
+            # compression state is stored only when its rows have been written, otherwise
+            # readings of this cycle are compressed again from previous state on next cycle
+            if not written:
+                logger.error(
+                    "GATHERER | AIR | Data not written, compression state kept"
+                )
+                return False
+            compressor.save()
         except Exception:
-            logging.error(f"GATHERER | AIR\n{traceback.format_exc()}")
+            logger.exception("GATHERER | AIR")
             return False
         else:
-            logging.debug("GATHERER | AIR | Data saved")
+            logger.debug("GATHERER | AIR | Data saved")
             return True
 
-    def __scan_purifier(self, device_data: DeviceData) -> MiAirPurifier3HData:
-        """Gathers data from Xiaomi Purifier device."""
-        try:
-            # fetches data from device
-            device = MiAirPurifier3H(device_data)
-            # retrieved data
-            data = device.data
-        except Exception:
-            logging.error(f"GATHERER | AIR\n{traceback.format_exc()}")
-            return {}
-        else:
-            return data
-
-    def __scan_monitor(self, device_data: DeviceData) -> MiMonitor2Data:
-        """Gathers data from Xiaomi Monitor 2 device."""
-        try:
-            # fetches data from device
-            device = MiMonitor2(device_data)
-            # retrieved data
-            data = device.data
-        except Exception:
-            logging.error(f"GATHERER | AIR\n{traceback.format_exc()}")
-            return {}
-        else:
-            return data
-
 
 # main section of script
 if __name__ == "__main__":
+    config.setup_logging()
     # parses script arguments
     parser = argparse.ArgumentParser()
     parser.add_argument("-d", "--data")
+    parser.add_argument(
+        "-p",
+        "--passive",
+        action="store_true",
+        help="[NETWORK] Run passive presence monitor instead of single scan",
+    )
+    parser.add_argument(
+        "--profile",
+        choices=("cprofile", "sampling"),
+        help="Profile cycle stages given by PROFILING_STAGES with selected profiler",
+    )
     arguments = parser.parse_args()
-    # gathers data, depends on given argument
-    if arguments.data == "network":
-        Network()
-    if arguments.data == "air":
-        Air()
+    if arguments.profile:
+        config.PROFILING["MODE"] = arguments.profile
+    # lock prevents cycles of the same type from piling up
+    with CycleLock(f"gatherer_{arguments.data}") as lock:
+        if not lock.acquired:
+            logger.warning(
+                "GATHERER | %s | Previous cycle is still running, skipped",
+                str(arguments.data).upper(),
+            )
+        # gathers data, depends on given argument
+        # passive monitor keeps the lock, so next cron runs are skipped while it is alive
+        elif arguments.data == "network" and (
+            arguments.passive or config.NETWORK["PASSIVE"]
+        ):
+            PassiveNetwork()
+        elif arguments.data == "network":
+            Network()
+        elif arguments.data == "air":
+            Air()
@@ -5,37 +5,50 @@ Messenger module is used for communication with users.
 import logging
 import os
 import sys
-import traceback
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
 
-import requests
-
+import config
 from models.database import PostgreSQL
+from utils import tracing
+from utils.metrics import REGISTRY
+
+# logger of this module
+logger = logging.getLogger("messenger")
 
 
-def send_notification(text: str, title: str, priority: int = 3) -> int:
+@tracing.traced()
+@REGISTRY.timed("brainstone_notification_duration_seconds")
+def send_notification(
+    text: str, title: str, priority: int = 3, token: str = None
+) -> int:
     """Sends notification to 'ntfy' app server with predefined subject
     and string received by argument as notification content. Returns HTTP status code.
+    Topic is read from system settings, unless it is given by 'token' argument.
     """
+    # imported on first notification, most of gatherer runs do not send any
+    import requests
+
     try:
-        with PostgreSQL(settings=True) as postgresql_database:
-            # current settings
-            response = requests.post(
-                url=f"https://ntfy.sh/{postgresql_database.settings.get('ntfy_token')}",
-                data=text.encode("utf-8"),
-                headers={"Title": title.encode("utf-8"), "Priority": str(priority)},
-            )
-            response.raise_for_status()
+        if token is None:
+            with PostgreSQL(settings=True) as postgresql_database:
+                # current settings
+                token = postgresql_database.settings.get("ntfy_token")
+        response = requests.post(
+            url=f"{config.NOTIFICATIONS['URL']}/{token}",
+            data=text.encode("utf-8"),
+            headers={"Title": title.encode("utf-8"), "Priority": str(priority)},
+        )
+        response.raise_for_status()
     except requests.exceptions.HTTPError as e:
-        logging.error(f"MESSENGER | HTTP ERROR: {e}")
+        logger.error("MESSENGER | HTTP ERROR: %s", e)
     except requests.exceptions.ConnectionError as e:
-        logging.error(f"MESSENGER | HTTP CONNECTION ERROR: {e}")
+        logger.error("MESSENGER | HTTP CONNECTION ERROR: %s", e)
     except requests.exceptions.Timeout as e:
-        logging.error(f"MESSENGER | HTTP TIMEOUT ERROR: {e}")
+        logger.error("MESSENGER | HTTP TIMEOUT ERROR: %s", e)
     except requests.exceptions.RequestException as e:
-        logging.error(f"MESSENGER | HTTP UNKNOWN ERROR: {e}")
+        logger.error("MESSENGER | HTTP UNKNOWN ERROR: %s", e)
     except:
-        logging.error(f"MESSENGER | UNKNOWN ERROR OCURRED\n{traceback.format_exc()}")
+        logger.exception("MESSENGER | UNKNOWN ERROR OCURRED")
     else:
         return response.status_code
@@ -0,0 +1,279 @@
+"""
+This script is used for migrating data stored in InfluxDB to current tagging schema.
+Legacy "air" and "health" points are tagged only with 'room' and health values are stored
+under 'battery/filter' field. Current schema tags each point with device MAC address, name,
+category and brand, and stores each health metric under its own field name.
+
+Bucket is rewritten in time chunks. Each chunk is read, spooled to local file, deleted
+and written back with legacy points converted. If process is interrupted, spooled chunk
+is written back on next run, before any other chunk is processed.
+
+Tables of brainstone are created on PostgreSQL initialization, tables introduced later
+are created in existing database with --schema.
+
+Usage:
+$ python3 migrator.py --start 2023-01-01 --chunk 24 [--bucket air] [--dry-run]
+$ python3 migrator.py --schema
+"""
+
+import argparse
+import collections
+import datetime
+import logging
+import os
+import sys
+import typing
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import config
+from influxdb_client import Point
+from models.data import DeviceData
+from models.database import InfluxDB, PostgreSQL
+from utils.metrics import REGISTRY
+
+# logger of this module
+logger = logging.getLogger("migrator")
+
+
+# buckets and measurements migrated by this script
+BUCKETS = ("air", "health")
+
+# tags added to each point by current schema
+DEVICE_TAGS = ("mac_address", "device", "category", "brand")
+
+# health field names of each supported device type (by its name)
+HEALTH_FIELDS = {"purifier": "filter_life_remaining", "monitor": "battery"}
+
+# legacy health field name
+LEGACY_HEALTH_FIELD = "battery/filter"
+
+# value of device tags of points, whose device could not be determined
+UNKNOWN = "unknown"
+
+# tables of brainstone added after database initialization (docker/postgresql/1-create-tables.sql)
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS poll_tasks (
+    mac_address varchar(250) NOT NULL,
+    capability varchar(250) NOT NULL,
+    due_time timestamptz NOT NULL DEFAULT now(),
+    node varchar(250),
+    lease_until timestamptz,
+    attempts integer NOT NULL DEFAULT 0,
+    PRIMARY KEY (mac_address)
+);
+"""
+
+
+def upgrade_schema() -> None:
+    """Creates tables of brainstone that are missing in existing PostgreSQL database."""
+    with PostgreSQL() as postgresql:
+        postgresql.api.execute(SCHEMA)
+    logger.info("MIGRATOR | PostgreSQL schema is up to date")
+
+
+class Migrator:
+    """Rewrites single bucket to current tagging schema."""
+
+    def __init__(
+        self, influx_database: InfluxDB, devices: typing.Set[DeviceData], bucket: str
+    ) -> None:
+        self.influx_database = influx_database
+        self.bucket = bucket
+        self.query_api = influx_database.client.query_api()
+        self.delete_api = influx_database.client.delete_api()
+        # air devices grouped by their location
+        self.devices = collections.defaultdict(list)
+        for device in devices:
+            self.devices[device.location].append(device)
+        # local file storing chunk, that has been deleted but not yet written back
+        self.spool_path = os.path.join(config.STATE_DIR, f"migration_{bucket}.lp")
+
+    def migrate(
+        self,
+        start: datetime.datetime,
+        stop: datetime.datetime,
+        chunk: datetime.timedelta,
+        dry_run: bool = False,
+    ) -> int:
+        """Migrates bucket chunk by chunk. Returns number of converted legacy points."""
+        converted = 0
+        # finishes chunk interrupted in previous run
+        self.recover()
+        chunk_start = start
+        while chunk_start < stop:
+            chunk_stop = min(chunk_start + chunk, stop)
+            converted += self.migrate_chunk(chunk_start, chunk_stop, dry_run)
+            chunk_start = chunk_stop
+        return converted
+
+    def migrate_chunk(
+        self, start: datetime.datetime, stop: datetime.datetime, dry_run: bool
+    ) -> int:
+        """Migrates single chunk. Chunks without legacy points are not rewritten."""
+        points, converted = self.read(start, stop)
+        logger.info(
+            "MIGRATOR | %s | %s - %s | points = %s | legacy = %s",
+            self.bucket,
+            start.isoformat(),
+            stop.isoformat(),
+            len(points),
+            converted,
+        )
+        if not converted or dry_run:
+            return converted
+        # spools chunk before it is deleted
+        os.makedirs(config.STATE_DIR, exist_ok=True)
+        with open(self.spool_path, "w") as file:
+            file.write("\n".join(points))
+        REGISTRY.set("brainstone_spool_depth", len(points), bucket=self.bucket)
+        self.delete_api.delete(
+            start,
+            stop,
+            f'_measurement="{self.bucket}"',
+            bucket=self.bucket,
+            org=config.DATABASE["INFLUX"]["ORGANIZATION"],
+        )
+        self.recover()
+        return converted
+
+    def recover(self) -> None:
+        """Writes spooled chunk back to database and removes spool file."""
+        if not os.path.isfile(self.spool_path):
+            return
+        with open(self.spool_path, "r") as file:
+            points = file.read().splitlines()
+        # writes in batches, to keep single request small
+        for index in range(0, len(points), 5000):
+            self.influx_database.api.write(
+                bucket=self.bucket,
+                org=config.DATABASE["INFLUX"]["ORGANIZATION"],
+                record=points[index : index + 5000],
+            )
+        os.remove(self.spool_path)
+        REGISTRY.set("brainstone_spool_depth", 0, bucket=self.bucket)
+
+    def read(
+        self, start: datetime.datetime, stop: datetime.datetime
+    ) -> typing.Tuple[typing.List[str], int]:
+        """Returns all points of chunk in line protocol, with legacy points converted,
+        and number of converted legacy points."""
+        tables = self.query_api.query(
+            f"""
+            from(bucket: "{self.bucket}")
+            |> range(start: {start.isoformat()}, stop: {stop.isoformat()})
+            |> filter(fn: (r) => r["_measurement"] == "{self.bucket}")
+            """
+        )
+        # fields grouped by series tags and time
+        rows = collections.defaultdict(dict)
+        for table in tables:
+            for record in table.records:
+                tags = tuple(
+                    sorted(
+                        (key, value)
+                        for key, value in record.values.items()
+                        if not key.startswith("_")
+                        and key not in ("result", "table")
+                        and value is not None
+                    )
+                )
+                rows[(tags, record.get_time())][record.get_field()] = record.get_value()
+        points, converted = [], 0
+        for (tags, timestamp), fields in rows.items():
+            tags = dict(tags)
+            if "mac_address" not in tags:
+                tags, fields = self.convert(tags, fields)
+                converted += 1
+            point = Point(self.bucket).time(timestamp)
+            for key, value in tags.items():
+                point.tag(key, value)
+            for key, value in fields.items():
+                point.field(key, value)
+            points.append(point.to_line_protocol())
+        return points, converted
+
+    def convert(
+        self, tags: typing.Dict[str, str], fields: typing.Dict[str, typing.Any]
+    ) -> typing.Tuple[typing.Dict[str, str], typing.Dict[str, typing.Any]]:
+        """Converts legacy point to current schema. Device is determined by room and type of fields.
+        Only purifiers measure AQI, so air rows with 'aqi' field belong to purifier and rows
+        without it belong to monitor. When room contains several candidates, point is tagged
+        as unknown device and legacy health field name is preserved."""
+        candidates = self.devices.get(tags.get("room"), [])
+        if self.bucket == "air" and len(candidates) > 1:
+            kind = "purifier" if "aqi" in fields else "monitor"
+            candidates = [
+                device for device in candidates if kind in device.name.lower()
+            ]
+        if len(candidates) != 1:
+            return {**tags, **{tag: UNKNOWN for tag in DEVICE_TAGS}}, fields
+        device = candidates[0]
+        tags = {
+            **tags,
+            "mac_address": device.mac_address.lower(),
+            "device": device.name,
+            "category": device.category,
+            "brand": device.brand,
+        }
+        if LEGACY_HEALTH_FIELD in fields:
+            for kind, field in HEALTH_FIELDS.items():
+                if kind in device.name.lower():
+                    fields = {
+                        **{k: v for k, v in fields.items() if k != LEGACY_HEALTH_FIELD},
+                        field: fields[LEGACY_HEALTH_FIELD],
+                    }
+        return tags, fields
+
+
+# main section of script
+if __name__ == "__main__":
+    config.setup_logging()
+    # parses script arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-b", "--bucket", choices=BUCKETS, help="Bucket to migrate, all by default"
+    )
+    parser.add_argument(
+        "-s",
+        "--start",
+        help="Date of the oldest data to migrate, in format YEAR-MONTH-DAY",
+    )
+    parser.add_argument(
+        "-c", "--chunk", type=int, default=24, help="Size of chunk in hours"
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Only count legacy points"
+    )
+    parser.add_argument(
+        "--schema",
+        action="store_true",
+        help="Create tables missing in existing PostgreSQL database",
+    )
+    arguments = parser.parse_args()
+    if not arguments.start and not arguments.schema:
+        parser.error("one of the arguments -s/--start --schema is required")
+    try:
+        if arguments.schema:
+            upgrade_schema()
+        if arguments.start:
+            # data written after migration start already follows current schema
+            stop = datetime.datetime.now(datetime.timezone.utc)
+            start = datetime.datetime.strptime(arguments.start, "%Y-%m-%d").replace(
+                tzinfo=datetime.timezone.utc
+            )
+            with PostgreSQL() as postgresql:
+                devices = postgresql.get_device_by_type("air")
+            with InfluxDB() as influx_database:
+                for bucket in (arguments.bucket,) if arguments.bucket else BUCKETS:
+                    converted = Migrator(influx_database, devices, bucket).migrate(
+                        start,
+                        stop,
+                        datetime.timedelta(hours=arguments.chunk),
+                        arguments.dry_run,
+                    )
+                    logger.info(
+                        "MIGRATOR | %s | Converted %s points", bucket, converted
+                    )
+    except Exception:
+        logger.exception("MIGRATOR")
@@ -10,13 +10,19 @@ If any of them are, notification are sent.
 import logging
 import os
 import sys
-import traceback
+import time
 import typing
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
 
+import config
 import messenger
 from models.database import PostgreSQL
+from utils import tracing
+from utils.state import StateFile
+
+# logger of this module
+logger = logging.getLogger("sentry")
 
 
 # constant values
@@ -26,6 +32,26 @@ DEVICE_HEALTH_KEY_TRANSLATE_MAP = {
 }
 
 
+def notify(notified: StateFile, key: str, text: str, title: str, priority: int) -> None:
+    """Sends notification of issue, unless the same issue has been notified within cooldown.
+    Devices in alert state are polled every minute, so ongoing issue would be notified on each poll.
+    """
+    now = time.time()
+    if now - notified.data.get(key, 0) < config.NOTIFICATIONS["COOLDOWN"]:
+        logger.debug("SENTRY | %s has already been notified", key)
+        return
+    messenger.send_notification(text=text, title=title, priority=priority)
+    notified.data[key] = now
+
+
+def resolve(notified: StateFile, keys: typing.Iterable[str]) -> None:
+    """Forgets notifications of issues that are no longer detected,
+    so issue that occurs again is notified immediately."""
+    for key in keys:
+        notified.data.pop(key, None)
+
+
+@tracing.traced()
 def check_air(air_data: typing.List[typing.Any]) -> typing.Set[str]:
     """Checks if air temperature, quality or humidity does not exceed defined thresholds in any of datasets.
     (For testing purposes only) Returns set of tuples, that informs about detected issues. If there was no
@@ -33,13 +59,17 @@ def check_air(air_data: typing.List[typing.Any]) -> typing.Set[str]:
     """
     try:
 
-        logging.debug(f"DATABASE | SENTRY | Air data verification")
+        logger.debug("DATABASE | SENTRY | Air data verification")
 
         # empty set of issues
         issues = set()
+        # notification keys of issues detected in this check
+        alerts = set()
 
         # establish connection to settings database
-        with PostgreSQL(settings=True) as postgresql_database:
+        with PostgreSQL(settings=True) as postgresql_database, StateFile(
+            config.NOTIFICATIONS["STATE"]
+        ) as notified:
             # current settings
             settings = postgresql_database.settings
             # iterate over air devices data
@@ -53,24 +83,30 @@ def check_air(air_data: typing.List[typing.Any]) -> typing.Set[str]:
                         or data.temperature <= settings.get("temperature_min")
                     )
                 ):
-                    messenger.send_notification(
+                    notify(
+                        notified,
+                        f"air:temperature:{data.device.mac_address}",
                         text=f"Temperatura wynosi {data.temperature}°C",
                         title=data.device.location.capitalize(),
                         priority=3,
                     )
                     issues.add(("temperature", data.device.location))
+                    alerts.add(f"air:temperature:{data.device.mac_address}")
                 # checks if air quality exceeds threshold
                 if (
                     data.aqi
                     and settings.get("notify_aqi")
                     and data.aqi >= settings.get("aqi_threshold")
                 ):
-                    messenger.send_notification(
+                    notify(
+                        notified,
+                        f"air:aqi:{data.device.mac_address}",
                         text=f"Jakość powietrza wynosi {data.aqi}μg/m³",
                         title=data.device.location.capitalize(),
                         priority=3,
                     )
                     issues.add(("aqi", data.device.location))
+                    alerts.add(f"air:aqi:{data.device.mac_address}")
                 # checks if air humidity exceeds threshold
                 if (
                     data.humidity
@@ -80,30 +116,47 @@ def check_air(air_data: typing.List[typing.Any]) -> typing.Set[str]:
                         or data.humidity <= settings.get("humidity_min")
                     )
                 ):
-                    messenger.send_notification(
+                    notify(
+                        notified,
+                        f"air:humidity:{data.device.mac_address}",
                         text=f"Wilgotność powietrza wynosi {data.humidity}%",
                         title=data.device.location.capitalize(),
                         priority=3,
                     )
                     issues.add(("humidity", data.device.location))
+                    alerts.add(f"air:humidity:{data.device.mac_address}")
+            # notifications are kept per device, as only devices due are read in cycle
+            resolve(
+                notified,
+                (
+                    f"air:{field}:{data.device.mac_address}"
+                    for data in air_data
+                    for field in ("temperature", "aqi", "humidity")
+                    if f"air:{field}:{data.device.mac_address}" not in alerts
+                ),
+            )
 
     except Exception:
-        logging.error(f"SENTRY | AIR | UNKNOWN ERROR OCURRED\n{traceback.format_exc()}")
+        logger.exception("SENTRY | AIR | UNKNOWN ERROR OCURRED")
     finally:
-        logging.debug(f"DATABASE | SENTRY | Air data verified")
+        logger.debug("DATABASE | SENTRY | Air data verified")
         return issues
 
 
-def check_network(mac_addresses: typing.Set = {}) -> typing.Set[str]:
+@tracing.traced()
+def check_network(
+    mac_addresses: typing.Set = {}, check_overload: bool = True
+) -> typing.Set[str]:
     """Checks if following conditions are met:
     - number of connected devices to local network is more than predefined value.
+    (skipped when 'check_overload' is False, i.e. for single device detected by passive monitor)
     - unknown device has connected to local network.
     (For testing purposes only) Returns set of strings representing detected issues.
     If there is no issues, empty set will be returned.
     """
     try:
 
-        logging.debug(f"DATABASE | SENTRY | Network data verification")
+        logger.debug("DATABASE | SENTRY | Network data verification")
 
         # empty set of issues
         issues = set()
@@ -118,11 +171,14 @@ def check_network(mac_addresses: typing.Set = {}) -> typing.Set[str]:
             # number of active devices in local network
             number_of_devices = len(mac_addresses)
             # if number of active devices is equal or higher than predefined value
-            if settings.get(
-                "notify_network_overload"
-            ) and number_of_devices >= settings.get("network_overload_threshold"):
-                logging.warning(
-                    f"SENTRY | Network overload! Number of active devices = {number_of_devices}"
+            if (
+                check_overload
+                and settings.get("notify_network_overload")
+                and number_of_devices >= settings.get("network_overload_threshold")
+            ):
+                logger.warning(
+                    "SENTRY | Network overload! Number of active devices = %s",
+                    number_of_devices,
                 )
                 messenger.send_notification(
                     text=f"Liczba aktywnych urządzeń = {number_of_devices}",
@@ -148,22 +204,19 @@ def check_network(mac_addresses: typing.Set = {}) -> typing.Set[str]:
                         priority=4,
                     )
                     issues.add("unknown_device")
-                logging.warning(
-                    "SENTRY | Unknown device is connected to local network!"
-                )
+                logger.warning("SENTRY | Unknown device is connected to local network!")
                 # adds unknown device to database
                 for address in unknown_devices:
                     postgresql_database.add_unknown_device(address)
 
     except Exception:
-        logging.error(
-            f"SENTRY | NETWORK | UNKNOWN ERROR OCURRED\n{traceback.format_exc()}"
-        )
+        logger.exception("SENTRY | NETWORK | UNKNOWN ERROR OCURRED")
     finally:
-        logging.debug(f"DATABASE | SENTRY | Network data verified")
+        logger.debug("DATABASE | SENTRY | Network data verified")
         return issues
 
 
+@tracing.traced()
 def check_diagnostic(diagnostic_data: typing.List[typing.Any]) -> typing.Set[str]:
     """Verifies that the battery, filter or other consumable parts of the device
     are not at the end of their life.
@@ -172,13 +225,17 @@ def check_diagnostic(diagnostic_data: typing.List[typing.Any]) -> typing.Set[str
     """
     try:
 
-        logging.debug(f"DATABASE | SENTRY | Diagnostic data verification")
+        logger.debug("DATABASE | SENTRY | Diagnostic data verification")
 
         # empty set of issues
         issues = set()
+        # notification keys of issues detected in this check
+        alerts = set()
 
         # establish connection to settings database
-        with PostgreSQL(settings=True) as postgresql_database:
+        with PostgreSQL(settings=True) as postgresql_database, StateFile(
+            config.NOTIFICATIONS["STATE"]
+        ) as notified:
             # current settings
             settings = postgresql_database.settings
             # iteration over diagnostic data
@@ -191,20 +248,28 @@ def check_diagnostic(diagnostic_data: typing.List[typing.Any]) -> typing.Set[str
                         and value
                         and value <= settings.get("health_threshold")
                     ):
-                        logging.warning(
-                            f"SENTRY | Level of {field} in device {data.device.name} in location {data.device.location} is {value}"
+                        logger.warning(
+                            "SENTRY | Level of %s in device %s in location %s is %s",
+                            field,
+                            data.device.name,
+                            data.device.location,
+                            value,
                         )
-                        messenger.send_notification(
+                        notify(
+                            notified,
+                            f"health:{field}:{data.device.mac_address}",
                             text=f"Poziom {DEVICE_HEALTH_KEY_TRANSLATE_MAP[field]} wynosi {value}",
                             title=f"{data.device.name} - {data.device.location}",
                             priority=4,
                         )
                         issues.add((field, data.device.location))
+                    else:
+                        resolve(
+                            notified, (f"health:{field}:{data.device.mac_address}",)
+                        )
 
     except Exception:
-        logging.error(
-            f"SENTRY | DIAGNOSTIC | UNKNOWN ERROR OCURRED\n{traceback.format_exc()}"
-        )
+        logger.exception("SENTRY | DIAGNOSTIC | UNKNOWN ERROR OCURRED")
     finally:
-        logging.debug(f"DATABASE | SENTRY | Diagnostic data verified")
+        logger.debug("DATABASE | SENTRY | Diagnostic data verified")
         return issues
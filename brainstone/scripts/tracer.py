@@ -0,0 +1,94 @@
+"""
+This script shows traces recorded by brainstone as waterfalls of their spans.
+It also runs local collector, that receives spans sent by http exporter
+(TRACING_EXPORTER=http) and stores them in traces directory.
+
+Usage:
+$ python3 tracer.py show [--trace TRACE_ID]
+$ python3 tracer.py list
+$ python3 tracer.py collect --port 9102
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import config
+from utils import tracing
+
+# logger of this module
+logger = logging.getLogger("tracer")
+
+
+class CollectorHandler(BaseHTTPRequestHandler):
+    """Receives spans posted by http exporter."""
+
+    def do_POST(self) -> None:
+        if self.path.split("?")[0] != "/spans":
+            self.send_error(404)
+            return
+        try:
+            spans = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            tracing.write(spans)
+        except (ValueError, TypeError, KeyError):
+            self.send_error(400)
+            return
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format: str, *args) -> None:
+        # each root span is posted, it would flood log
+        pass
+
+
+def show(trace_id: str = None) -> None:
+    """Prints waterfall of given trace, or the newest one."""
+    print(tracing.waterfall(tracing.read(trace_id)))
+
+
+def summary() -> None:
+    """Prints root span and duration of each stored trace."""
+    for path in sorted(glob.glob(os.path.join(config.TRACING["DIRECTORY"], "*.jsonl"))):
+        with open(path) as file:
+            spans = [json.loads(line) for line in file if line.strip()]
+        roots = [item for item in spans if not item["parent_id"]] or spans
+        print(
+            f"{os.path.basename(path)[:-6]} {roots[0]['name']:<24} "
+            f"{(roots[0]['duration'] or 0) * 1000:>10.1f} ms {len(spans):>6} spans"
+        )
+
+
+# main section of script
+if __name__ == "__main__":
+    config.setup_logging()
+    # parses script arguments
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+    show_parser = commands.add_parser("show", help="Print waterfall of trace")
+    show_parser.add_argument(
+        "-t",
+        "--trace",
+        help="Identifier (or its prefix) of trace, the newest by default",
+    )
+    commands.add_parser("list", help="List stored traces")
+    collect_parser = commands.add_parser("collect", help="Run local collector")
+    collect_parser.add_argument("-p", "--port", type=int, default=9102)
+    arguments = parser.parse_args()
+    if arguments.command == "show":
+        show(arguments.trace)
+    elif arguments.command == "list":
+        summary()
+    else:
+        server = ThreadingHTTPServer(("", arguments.port), CollectorHandler)
+        logger.info(
+            "TRACER | Collecting spans on port %s into %s",
+            arguments.port,
+            config.TRACING["DIRECTORY"],
+        )
+        server.serve_forever()
@@ -0,0 +1,183 @@
+"""
+This script contains tools used for ARP based network scanning:
+- table of MAC to IP address mapping, filled by network gatherer. Air drivers resolve
+  IP addresses from it, so DHCP lease changes do not break device communication.
+- tiered scanner, that probes recently seen hosts on each cycle and sweeps
+  configured subnets only once per sweep interval.
+"""
+
+import ipaddress
+import logging
+import time
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from utils.state import StateFile
+
+# logger of this module
+logger = logging.getLogger(__name__)
+
+
+class ArpTable:
+    """Persistent MAC to IP address table. MAC addresses are stored in lower case."""
+
+    def __init__(self, name: str = "arp_table") -> None:
+        # persistent state, {mac_address: {"ip": str, "seen": float}}
+        self.state = StateFile(name)
+
+    def __enter__(self) -> object:
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback) -> None:
+        self.save()
+
+    def __contains__(self, mac_address: str) -> bool:
+        return mac_address.lower() in self.state.data
+
+    def update(
+        self, mapping: typing.Dict[str, str], timestamp: float = None
+    ) -> typing.Dict[str, str]:
+        """Merges MAC to IP pairs seen in network into table.
+        Returns pairs whose IP address is new or has changed."""
+        timestamp = timestamp or time.time()
+        changed = {}
+        for mac_address, ip_address in mapping.items():
+            entry = self.state.data.setdefault(mac_address.lower(), {})
+            # host heard without IP address (i.e. passively) keeps the last known one
+            if ip_address and entry.get("ip") != ip_address:
+                changed[mac_address.lower()] = ip_address
+                entry["ip"] = ip_address
+            entry.setdefault("ip", "")
+            entry["seen"] = timestamp
+        return changed
+
+    def save(self) -> bool:
+        """Stores table. Returns True if operation succeed, otherwise returns False."""
+        return self.state.save()
+
+    def resolve(self, mac_address: str, default: str = "") -> str:
+        """Returns the most recent IP address of given MAC address,
+        or default one if IP address of MAC address is not known yet."""
+        entry = self.state.data.get(mac_address.lower())
+        return (entry or {}).get("ip") or default
+
+    def recent(self, seconds: float, now: float = None) -> typing.Dict[str, str]:
+        """Returns MAC to IP pairs seen in last 'seconds'."""
+        start = (now or time.time()) - seconds
+        return {
+            mac_address: entry["ip"]
+            for mac_address, entry in self.state.data.items()
+            if entry.get("seen", 0) >= start
+        }
+
+
+class ArpScanner:
+    """Tiered ARP scanner. On each cycle unicast ARP requests are sent to hosts seen within
+    KNOWN_HOST_TTL, so scan time scales with number of active hosts. Full broadcast sweep of each
+    configured subnet is performed once per SWEEP_INTERVAL, split into chunks swept in parallel.
+    Only ARP layer of scapy is imported, when first request is sent.
+    """
+
+    def __init__(
+        self,
+        arp_table: ArpTable,
+        settings: typing.Dict = config.NETWORK,
+        name: str = "arp_scanner",
+    ) -> None:
+        self.arp_table = arp_table
+        self.settings = settings
+        # persistent state, {"sweep": float}
+        self.state = StateFile(name)
+
+    @property
+    def sweep_due(self) -> bool:
+        """Returns True if full sweep should be performed in current cycle."""
+        return (
+            self.state.data.get("sweep", 0) + self.settings["SWEEP_INTERVAL"]
+            <= time.time()
+        )
+
+    def scan(self, sweep: bool = None) -> typing.Dict[str, str]:
+        """Returns MAC to IP addresses mapping of hosts that answered in current cycle.
+        Full sweep is performed when it is due, or when 'sweep' argument is set to True.
+        """
+        start = time.monotonic()
+        sweep = self.sweep_due if sweep is None else sweep
+        known = self.arp_table.recent(self.settings["KNOWN_HOST_TTL"])
+        # known hosts are probed before sweep, so their answers are not lost
+        # when sweep fails or is not due
+        addresses = self.probe(known)
+        if sweep or not known:
+            addresses.update(self.sweep())
+            self.state.data["sweep"] = time.time()
+            self.state.save()
+        logger.debug(
+            "ARP | %s completed | known = %s | answered = %s | duration = %.2fs",
+            "Sweep" if sweep or not known else "Probe",
+            len(known),
+            len(addresses),
+            time.monotonic() - start,
+        )
+        return addresses
+
+    def probe(self, hosts: typing.Dict[str, str]) -> typing.Dict[str, str]:
+        """Sends unicast ARP request to each given host (MAC to IP addresses mapping)
+        and returns mapping of hosts that answered."""
+        # hosts heard only passively have no IP address to probe yet
+        hosts = {
+            mac_address: ip_address
+            for mac_address, ip_address in hosts.items()
+            if ip_address
+        }
+        if not hosts:
+            return {}
+        from scapy.layers.l2 import ARP, Ether
+
+        packets = [
+            Ether(dst=mac_address) / ARP(pdst=ip_address)
+            for mac_address, ip_address in hosts.items()
+        ]
+        return self.__send(packets)
+
+    def sweep(self) -> typing.Dict[str, str]:
+        """Sends broadcast ARP request to each address of configured subnets,
+        in chunks sent by parallel workers. Returns mapping of hosts that answered."""
+        addresses = {}
+        chunks = list(self.chunks())
+        with ThreadPoolExecutor(max_workers=self.settings["WORKERS"]) as executor:
+            for answered in executor.map(self.__sweep_chunk, chunks):
+                addresses.update(answered)
+        return addresses
+
+    def chunks(self) -> typing.Iterator[typing.List[str]]:
+        """Yields lists of host addresses of configured subnets, of CHUNK_SIZE length at most."""
+        size = self.settings["CHUNK_SIZE"]
+        for subnet in self.settings["SUBNETS"]:
+            hosts = [str(host) for host in ipaddress.ip_network(subnet.strip()).hosts()]
+            for index in range(0, len(hosts), size):
+                yield hosts[index : index + size]
+
+    def __sweep_chunk(self, hosts: typing.List[str]) -> typing.Dict[str, str]:
+        """Sweeps single chunk of addresses."""
+        from scapy.layers.l2 import ARP, Ether
+
+        try:
+            return self.__send(Ether(dst="ff:ff:ff:ff:ff:ff") / ARP(pdst=hosts))
+        except Exception:
+            logger.exception("ARP | SWEEP %s - %s", hosts[0], hosts[-1])
+            return {}
+
+    def __send(self, packets: typing.Any) -> typing.Dict[str, str]:
+        """Sends ARP requests and returns MAC to IP addresses mapping of answers."""
+        from scapy.layers.l2 import ARP, Ether
+        from scapy.sendrecv import srp
+
+        answered, _ = srp(
+            packets,
+            timeout=self.settings["TIMEOUT"],
+            retry=self.settings["RETRIES"],
+            iface=self.settings["INTERFACE"],
+            verbose=0,
+        )
+        return {received[Ether].src: received[ARP].psrc for _, received in answered}
@@ -0,0 +1,161 @@
+"""
+This script contains compression stage used before writing air and health points into InfluxDB.
+Readings that can be reconstructed from already written points within configured tolerance are suppressed.
+- deadband, holds last written value until reading differs from it more than tolerance.
+  Series is reconstructed by step (last value) interpolation.
+- swinging door, holds back single reading and writes it only when straight line from last written
+  point cannot cover following readings within tolerance. Series is reconstructed by linear interpolation.
+In both modes each field is written at least once per heartbeat.
+"""
+
+import typing
+from abc import ABC, abstractmethod
+
+import config
+from utils.state import StateFile
+
+
+# type of compression output, {timestamp: {field: value}}
+Rows = typing.Dict[float, typing.Dict[str, typing.Any]]
+
+
+class Compressor(ABC):
+    """Base class of compressors. Keeps state of each field of each series between gatherer runs."""
+
+    def __init__(
+        self, name: str = "compression", settings: typing.Dict = config.COMPRESSION
+    ) -> None:
+        self.heartbeat = settings["HEARTBEAT"]
+        self.tolerances = settings["TOLERANCES"]
+        # persistent state, {series: {field: field state}}
+        self.state = StateFile(name)
+
+    def save(self) -> bool:
+        """Stores state of compressor. It has to be called only when rows returned by 'compress'
+        have been written, otherwise readings are compressed again from previously stored state,
+        so rows that have not been written are never taken as archived.
+        Returns True if operation succeed, otherwise returns False."""
+        return self.state.save()
+
+    def compress(
+        self, series: str, values: typing.Dict[str, typing.Any], timestamp: float
+    ) -> Rows:
+        """Returns rows that should be written for readings of given series, grouped by timestamp.
+        Empty readings (None) are skipped."""
+        rows = {}
+        fields = self.state.data.setdefault(series, {})
+        for field, value in values.items():
+            if value is None:
+                continue
+            state = fields.setdefault(field, {})
+            tolerance = self.tolerances.get(field, 0)
+            for point_timestamp, point_value in self.offer(
+                state, timestamp, value, tolerance
+            ):
+                rows.setdefault(point_timestamp, {})[field] = point_value
+        return dict(sorted(rows.items()))
+
+    @abstractmethod
+    def offer(
+        self, state: typing.Dict, timestamp: float, value: typing.Any, tolerance: float
+    ) -> typing.List[typing.Tuple[float, typing.Any]]:
+        """Should implement compression of single field reading.
+        Returns list of points (timestamp, value) that have to be written."""
+        pass
+
+
+class NoCompressor(Compressor):
+    """Writes every reading."""
+
+    def offer(self, state, timestamp, value, tolerance):
+        return [(timestamp, value)]
+
+
+class DeadbandCompressor(Compressor):
+    """Writes reading when it differs from last written value more than tolerance
+    or when heartbeat time passed since last write."""
+
+    def offer(self, state, timestamp, value, tolerance):
+        if (
+            "value" not in state
+            or abs(value - state["value"]) > tolerance
+            or timestamp - state["timestamp"] >= self.heartbeat
+        ):
+            state["value"], state["timestamp"] = value, timestamp
+            return [(timestamp, value)]
+        return []
+
+
+class SwingingDoorCompressor(Compressor):
+    """Swinging door trending. Last written (archived) point is a hinge of two doors,
+    whose slopes are narrowed by each held reading. When doors open beyond parallel,
+    previously held reading is written and becomes a new hinge."""
+
+    def offer(self, state, timestamp, value, tolerance):
+        points = []
+        # first reading of field
+        if "archive" not in state:
+            self.__archive(state, timestamp, value)
+            return [(timestamp, value)]
+        archive_timestamp, archive_value = state["archive"]
+        duration = timestamp - archive_timestamp
+        # readings out of order are ignored
+        if duration <= 0:
+            return []
+        # heartbeat, writes held and current reading and starts new segment
+        if duration >= self.heartbeat:
+            if state["held"]:
+                points.append(self.__close(state))
+            self.__archive(state, timestamp, value)
+            points.append((timestamp, value))
+            return points
+        upper = (value + tolerance - archive_value) / duration
+        lower = (value - tolerance - archive_value) / duration
+        if state["upper"] is not None:
+            upper = min(upper, state["upper"])
+            lower = max(lower, state["lower"])
+        # doors opened beyond parallel, held reading is written and becomes new hinge
+        if lower > upper:
+            held_timestamp, held_value = self.__close(state)
+            points.append((held_timestamp, held_value))
+            self.__archive(state, held_timestamp, held_value)
+            duration = timestamp - held_timestamp
+            upper = (value + tolerance - held_value) / duration
+            lower = (value - tolerance - held_value) / duration
+        state["upper"], state["lower"] = upper, lower
+        state["held"] = [timestamp, value]
+        return points
+
+    @staticmethod
+    def __close(state: typing.Dict) -> typing.Tuple[float, typing.Any]:
+        """Returns point that closes current segment at time of held reading.
+        Point lies on the middle line between doors, so every reading of segment
+        (including held one) is within tolerance of line drawn from hinge to this point.
+        Value keeps type of held reading, integer fields are rounded, as InfluxDB rejects
+        float value of integer field.
+        """
+        archive_timestamp, archive_value = state["archive"]
+        held_timestamp, held_value = state["held"]
+        slope = (state["upper"] + state["lower"]) / 2
+        value = archive_value + slope * (held_timestamp - archive_timestamp)
+        if isinstance(held_value, int):
+            value = type(held_value)(round(value))
+        return held_timestamp, value
+
+    @staticmethod
+    def __archive(state: typing.Dict, timestamp: float, value: typing.Any) -> None:
+        """Sets given point as written hinge of doors."""
+        state["archive"] = [timestamp, value]
+        state["held"] = None
+        state["upper"] = state["lower"] = None
+
+
+def get_compressor(mode: str = config.COMPRESSION["MODE"]) -> Compressor:
+    """Returns compressor instance of given mode."""
+    compressors = {
+        "deadband": DeadbandCompressor,
+        "swinging_door": SwingingDoorCompressor,
+        "off": NoCompressor,
+    }
+    # each mode keeps its own state, so switching modes never mixes them
+    return compressors[mode](name=f"compression_{mode}")
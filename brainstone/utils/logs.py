@@ -0,0 +1,250 @@
+"""
+This script contains logging configuration of brainstone.
+Records are put on in-memory queue by the logging thread and written to handlers by
+background listener thread, so file I/O never blocks gathering cycle.
+Records are rendered as JSON documents (one per line) or as text, each record carries
+identifier of current cycle and device, when it is logged within them.
+Log file is rotated by size and can be shared by several processes.
+Level of each module can be changed at runtime in logging state file, i.e.
+{"levels": {"utils.arp": "DEBUG", "miio": "WARNING"}}, it is applied on start of each script
+and on SIGHUP by long running ones.
+"""
+
+import atexit
+import contextlib
+import contextvars
+import datetime
+import fcntl
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import signal
+import sys
+import threading
+import typing
+
+import config
+from utils.state import StateFile
+
+
+# identifier of current gathering cycle, shared by each thread of process
+CYCLE = None
+
+# identifier (MAC address) of device, that is being processed by current thread
+DEVICE = contextvars.ContextVar("device", default=None)
+
+# listener that writes queued records to handlers, and process that started it
+listener = None
+owner = None
+
+
+@contextlib.contextmanager
+def cycle(name: str) -> typing.Iterator[str]:
+    """Marks records logged within context with new cycle identifier."""
+    global CYCLE
+    previous, CYCLE = CYCLE, f"{name}-{os.urandom(4).hex()}"
+    try:
+        yield CYCLE
+    finally:
+        CYCLE = previous
+
+
+@contextlib.contextmanager
+def device(mac_address: str) -> typing.Iterator[None]:
+    """Marks records logged by current thread within context with device identifier."""
+    token = DEVICE.set(mac_address)
+    try:
+        yield
+    finally:
+        DEVICE.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """Adds cycle and device identifiers to record.
+    Attached to queue handler, so identifiers are read in thread that logs the record.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.cycle = CYCLE
+        record.device = DEVICE.get()
+        return True
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """Queue handler, that only merges message with its arguments before record is queued.
+    Rendering of record is left to listener thread."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        # traceback object can not be kept, it holds frames of logging thread
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """Renders record as single line JSON document."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        document = {
+            "time": datetime.datetime.fromtimestamp(record.created).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname,
+            "logger": record.name,
+            "process": record.process,
+            "message": record.getMessage(),
+        }
+        for key in ("cycle", "device"):
+            value = getattr(record, key, None)
+            if value:
+                document[key] = value
+        if record.exc_info:
+            document["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            document["exception"] = record.exc_text
+        return json.dumps(document, default=str)
+
+
+class RotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """Size based rotating file handler, that can be shared by several processes.
+    Size is checked on disk, rotation is made under file lock and file rotated
+    by other process is reopened before next record is written."""
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        self.__reopen()
+        try:
+            return os.stat(self.baseFilename).st_size >= self.maxBytes > 0
+        except OSError:
+            return False
+
+    def doRollover(self) -> None:
+        with open(f"{self.baseFilename}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # other process could rotate file while lock was awaited
+            try:
+                rotated = os.stat(self.baseFilename).st_size < self.maxBytes
+            except OSError:
+                rotated = True
+            if rotated:
+                self.__reopen(force=True)
+            else:
+                super().doRollover()
+
+    def __reopen(self, force: bool = False) -> None:
+        """Reopens log file, if it has been replaced since it was opened."""
+        if self.stream is None:
+            return
+        try:
+            current = os.stat(self.baseFilename)
+            opened = os.fstat(self.stream.fileno())
+            replaced = (current.st_dev, current.st_ino) != (
+                opened.st_dev,
+                opened.st_ino,
+            )
+        except OSError:
+            replaced = True
+        if replaced or force:
+            self.stream.close()
+            self.stream = self._open()
+
+
+def parse_levels(value: str) -> typing.Dict[str, str]:
+    """Returns levels of modules given as "module=LEVEL" pairs separated by commas."""
+    levels = {}
+    for pair in filter(None, (pair.strip() for pair in value.split(","))):
+        name, _, level = pair.partition("=")
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def apply_levels(settings: typing.Dict = config.LOGGING) -> None:
+    """Sets level of root logger and of each configured module.
+    Levels from logging state file take precedence over environment."""
+    logging.getLogger().setLevel(settings["LEVEL"].upper())
+    levels = parse_levels(settings["LEVELS"])
+    levels.update(StateFile(settings["STATE"]).data.get("levels", {}))
+    for name, level in levels.items():
+        try:
+            logging.getLogger(name).setLevel(level.upper())
+        except (ValueError, TypeError):
+            logging.getLogger(__name__).warning(
+                "Unknown level %r of logger %r", level, name
+            )
+
+
+def handlers(settings: typing.Dict = config.LOGGING) -> typing.List[logging.Handler]:
+    """Returns handlers that write records, log file and console when it is interactive."""
+    formatter = (
+        JsonFormatter()
+        if settings["FORMAT"] == "json"
+        else logging.Formatter("%(asctime)s | %(levelname)s | %(message)s")
+    )
+    targets = []
+    try:
+        targets.append(
+            RotatingFileHandler(
+                settings["FILE"],
+                maxBytes=settings["MAX_BYTES"],
+                backupCount=settings["BACKUP_COUNT"],
+            )
+        )
+    except OSError as e:
+        print(f"Unable to open log file {settings['FILE']}: {e}", file=sys.stderr)
+    # output of scripts run by cron is appended to log file, so console would duplicate records
+    if sys.stderr.isatty() or not targets:
+        targets.append(logging.StreamHandler())
+    for handler in targets:
+        handler.setFormatter(formatter)
+    return targets
+
+
+def setup(settings: typing.Dict = config.LOGGING) -> None:
+    """Configures root logger to put records on queue, that is written by listener thread.
+    Subsequent calls have no effect."""
+    global listener, owner
+    root = logging.getLogger()
+    if root.handlers:
+        return
+    targets = handlers(settings)
+    records = queue.SimpleQueue()
+    handler = QueueHandler(records)
+    handler.addFilter(ContextFilter())
+    root.addHandler(handler)
+    listener = logging.handlers.QueueListener(
+        records, *targets, respect_handler_level=True
+    )
+    listener.start()
+    owner = os.getpid()
+    apply_levels(settings)
+    atexit.register(stop)
+    # listener thread does not exist in forked processes (i.e. executor workers),
+    # so they write records directly
+    os.register_at_fork(after_in_child=stop)
+    # long running scripts reload levels on SIGHUP
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGHUP, lambda signum, frame: apply_levels(settings))
+
+
+def stop() -> None:
+    """Writes queued records and replaces queue handler with handlers of listener,
+    so records logged afterwards (i.e. by exit handlers) are written directly."""
+    global listener
+    if listener is None:
+        return
+    root = logging.getLogger()
+    # thread of listener is not copied into forked process
+    if os.getpid() == owner:
+        listener.stop()
+    for handler in root.handlers[:]:
+        if isinstance(handler, QueueHandler):
+            root.removeHandler(handler)
+            for target in listener.handlers:
+                target.addFilter(ContextFilter())
+                root.addHandler(target)
+    listener = None
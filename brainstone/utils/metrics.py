@@ -0,0 +1,223 @@
+"""
+This script contains metrics registry of brainstone, exposed in Prometheus text format.
+Gatherer runs are short-lived, so each process records metrics in memory and merges them
+into metrics state file on exit. Exporter script serves merged metrics on /metrics endpoint.
+https://prometheus.io/docs/instrumenting/exposition_formats/
+"""
+
+import atexit
+import contextlib
+import fcntl
+import functools
+import logging
+import os
+import threading
+import time
+import typing
+
+import config
+from utils.state import StateFile
+
+# logger of this module
+logger = logging.getLogger(__name__)
+
+
+# type and description of each metric
+DEFINITIONS = {
+    "brainstone_cycle_duration_seconds": (
+        "histogram",
+        "Duration of gathering cycle.",
+    ),
+    "brainstone_fetch_duration_seconds": (
+        "histogram",
+        "Duration of fetching data from single device.",
+    ),
+    "brainstone_fetch_failures_total": (
+        "counter",
+        "Number of failed fetches of device data.",
+    ),
+    "brainstone_database_duration_seconds": (
+        "histogram",
+        "Duration of database operation.",
+    ),
+    "brainstone_notification_duration_seconds": (
+        "histogram",
+        "Duration of sending notification.",
+    ),
+    "brainstone_ble_disconnects_total": (
+        "counter",
+        "Number of bluetooth connections dropped by device.",
+    ),
+    "brainstone_points_written_total": (
+        "counter",
+        "Number of points written to InfluxDB.",
+    ),
+    "brainstone_spool_depth": (
+        "gauge",
+        "Number of points spooled locally and not yet written to InfluxDB.",
+    ),
+    "brainstone_reading_mean": (
+        "gauge",
+        "Mean of device readings in statistics window.",
+    ),
+    "brainstone_reading_min": (
+        "gauge",
+        "Minimum of device readings in statistics window.",
+    ),
+    "brainstone_reading_max": (
+        "gauge",
+        "Maximum of device readings in statistics window.",
+    ),
+    "brainstone_reading_slope_per_hour": (
+        "gauge",
+        "Trend of device readings in statistics window, as change per hour.",
+    ),
+}
+
+
+def labels_key(labels: typing.Dict[str, typing.Any]) -> str:
+    """Returns labels rendered in Prometheus format, sorted by label name."""
+    return ",".join(
+        '{}="{}"'.format(
+            name,
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for name, value in sorted(labels.items())
+    )
+
+
+class Registry:
+    """Metrics recorded by current process, not yet merged into metrics state file.
+    Counters and histograms are stored as increments, gauges as the last value."""
+
+    def __init__(
+        self, name: str = "metrics", buckets: typing.Tuple = config.METRICS["BUCKETS"]
+    ) -> None:
+        self.name = name
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        # {metric: {labels: value}}, histogram value is {"buckets": [...], "sum": float, "count": int}
+        self.samples = {}
+
+    def clear(self) -> None:
+        """Removes recorded metrics."""
+        with self.lock:
+            self.samples = {}
+
+    def increment(self, metric: str, amount: float = 1, **labels) -> None:
+        """Increases counter."""
+        key = labels_key(labels)
+        with self.lock:
+            samples = self.samples.setdefault(metric, {})
+            samples[key] = samples.get(key, 0) + amount
+
+    def set(self, metric: str, value: float, **labels) -> None:
+        """Sets gauge value."""
+        with self.lock:
+            self.samples.setdefault(metric, {})[labels_key(labels)] = value
+
+    def observe(self, metric: str, value: float, **labels) -> None:
+        """Records single observation of histogram."""
+        key = labels_key(labels)
+        with self.lock:
+            sample = self.samples.setdefault(metric, {}).setdefault(
+                key, {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            )
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    sample["buckets"][index] += 1
+            sample["sum"] += value
+            sample["count"] += 1
+
+    @contextlib.contextmanager
+    def timer(self, metric: str, **labels) -> typing.Iterator[None]:
+        """Records duration of context in histogram, also when exception is raised."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(metric, time.monotonic() - start, **labels)
+
+    def timed(self, metric: str, **labels) -> typing.Callable:
+        """Returns decorator that records duration of each call of function in histogram,
+        labelled with function name as operation."""
+
+        def decorator(function: typing.Callable) -> typing.Callable:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.timer(metric, operation=function.__name__, **labels):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def flush(self) -> bool:
+        """Merges recorded metrics into metrics state file and clears them.
+        State file is locked, so processes finishing at the same time do not lose updates.
+        Returns True if operation succeed, otherwise returns False."""
+        with self.lock:
+            samples, self.samples = self.samples, {}
+        if not samples:
+            return True
+        try:
+            os.makedirs(config.STATE_DIR, exist_ok=True)
+            with open(os.path.join(config.STATE_DIR, f"{self.name}.lock"), "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                state = StateFile(self.name)
+                for metric, values in samples.items():
+                    merged = state.data.setdefault(metric, {})
+                    for key, value in values.items():
+                        merged[key] = self.__merge(metric, merged.get(key), value)
+                return state.save()
+        except Exception:
+            logger.exception("METRICS")
+            return False
+
+    def render(self) -> str:
+        """Returns metrics merged into metrics state file in Prometheus text format."""
+        state = StateFile(self.name)
+        lines = []
+        for metric, (kind, description) in DEFINITIONS.items():
+            lines.append(f"# HELP {metric} {description}")
+            lines.append(f"# TYPE {metric} {kind}")
+            for key, value in sorted(state.data.get(metric, {}).items()):
+                if kind != "histogram":
+                    lines.append(f"{metric}{self.__labels(key)} {value}")
+                    continue
+                # bucket counts are stored cumulative, as exposition format expects
+                for bound, count in zip(self.buckets, value["buckets"]):
+                    labels = self.__labels(key, f'le="{bound}"')
+                    lines.append(f"{metric}_bucket{labels} {count}")
+                labels = self.__labels(key, 'le="+Inf"')
+                lines.append(f"{metric}_bucket{labels} {value['count']}")
+                lines.append(f"{metric}_sum{self.__labels(key)} {value['sum']}")
+                lines.append(f"{metric}_count{self.__labels(key)} {value['count']}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def __labels(*keys: str) -> str:
+        """Returns labels in braces, or empty string when there are no labels."""
+        labels = ",".join(key for key in keys if key)
+        return f"{{{labels}}}" if labels else ""
+
+    def __merge(self, metric: str, stored: typing.Any, value: typing.Any) -> typing.Any:
+        """Returns stored sample updated with recorded one."""
+        kind = DEFINITIONS.get(metric, ("counter", ""))[0]
+        if stored is None or kind == "gauge":
+            return value
+        if kind == "histogram":
+            # buckets configuration has changed, history is discarded
+            if len(stored["buckets"]) != len(value["buckets"]):
+                return value
+            return {
+                "buckets": [a + b for a, b in zip(stored["buckets"], value["buckets"])],
+                "sum": stored["sum"] + value["sum"],
+                "count": stored["count"] + value["count"],
+            }
+        return stored + value
+
+
+# registry of current process, merged into state file on exit
+REGISTRY = Registry()
+atexit.register(REGISTRY.flush)
@@ -0,0 +1,122 @@
+"""
+This script contains passive presence monitor, that detects devices in local network
+by sniffing ARP and DHCP traffic instead of sending requests.
+"""
+
+import logging
+import queue
+import threading
+import time
+import typing
+
+import config
+
+# logger of this module
+logger = logging.getLogger(__name__)
+
+
+# kernel level filter, only ARP and DHCP packets are passed to monitor
+BPF_FILTER = "arp or (udp and (port 67 or 68))"
+
+# address used as source by hosts without IP address (ARP probes, DHCP discovery)
+EMPTY_ADDRESS = "0.0.0.0"
+
+
+class PassiveMonitor:
+    """Sniffs ARP and DHCP packets in background thread and keeps presence table
+    of MAC addresses with IP address and time they were last heard from.
+    Each MAC address heard for the first time is passed to 'on_new' callback,
+    called from separate thread, so slow callbacks do not cause packet loss."""
+
+    def __init__(
+        self,
+        on_new: typing.Callable[[str, str], typing.Any] = None,
+        known: typing.Iterable[str] = (),
+        interface: str = config.NETWORK["INTERFACE"],
+    ) -> None:
+        self.on_new = on_new
+        # presence table, {mac_address: (ip_address, last_seen)}
+        self.table = {}
+        self.lock = threading.Lock()
+        # MAC addresses that are not reported as new
+        self.known = {mac_address.lower() for mac_address in known}
+        # MAC addresses waiting for callback
+        self.new = queue.Queue()
+        from scapy.sendrecv import AsyncSniffer
+
+        self.sniffer = AsyncSniffer(
+            filter=BPF_FILTER, prn=self.__handle, store=False, iface=interface
+        )
+
+    def start(self) -> None:
+        """Starts sniffing and callback threads."""
+        threading.Thread(target=self.__notify, daemon=True).start()
+        self.sniffer.start()
+        logger.info("PRESENCE | Passive monitor started | filter = %s", BPF_FILTER)
+
+    def stop(self) -> None:
+        """Stops sniffing thread."""
+        self.sniffer.stop()
+        logger.info("PRESENCE | Passive monitor stopped")
+
+    def present(self, seconds: float, now: float = None) -> typing.Dict[str, str]:
+        """Returns MAC to IP addresses mapping of hosts heard from in last 'seconds'.
+        IP address is empty when host has not been seen with one yet."""
+        start = (now or time.time()) - seconds
+        with self.lock:
+            return {
+                mac_address: ip_address
+                for mac_address, (ip_address, seen) in self.table.items()
+                if seen >= start
+            }
+
+    def update(self, mac_address: str, ip_address: str = "") -> None:
+        """Marks host as present. IP address is kept when host has been heard without one."""
+        mac_address = mac_address.lower()
+        with self.lock:
+            previous = self.table.get(mac_address)
+            if previous and not ip_address:
+                ip_address = previous[0]
+            self.table[mac_address] = (ip_address, time.time())
+        if previous is None and mac_address not in self.known:
+            self.known.add(mac_address)
+            self.new.put((mac_address, ip_address))
+
+    def __handle(self, packet: typing.Any) -> None:
+        """Extracts MAC and IP address of sender from ARP or DHCP packet."""
+        from scapy.layers.dhcp import BOOTP, DHCP
+        from scapy.layers.l2 import ARP
+
+        try:
+            if ARP in packet:
+                ip_address = packet[ARP].psrc
+                self.update(
+                    packet[ARP].hwsrc,
+                    "" if ip_address == EMPTY_ADDRESS else ip_address,
+                )
+            elif BOOTP in packet and packet[BOOTP].op == 1:
+                # client hardware address is padded to 16 bytes
+                mac_address = ":".join(
+                    f"{byte:02x}" for byte in packet[BOOTP].chaddr[:6]
+                )
+                ip_address = packet[BOOTP].ciaddr
+                if DHCP in packet:
+                    for option in packet[DHCP].options:
+                        if isinstance(option, tuple) and option[0] == "requested_addr":
+                            ip_address = option[1]
+                self.update(
+                    mac_address, "" if ip_address == EMPTY_ADDRESS else ip_address
+                )
+        except Exception:
+            logger.exception("PRESENCE")
+
+    def __notify(self) -> None:
+        """Passes new MAC addresses to callback."""
+        while True:
+            mac_address, ip_address = self.new.get()
+            logger.info("PRESENCE | New host %s (%s)", mac_address, ip_address)
+            if self.on_new:
+                try:
+                    self.on_new(mac_address, ip_address)
+                except Exception:
+                    logger.exception("PRESENCE")
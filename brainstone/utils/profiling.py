@@ -0,0 +1,124 @@
+"""
+This script contains on-demand profiling of gatherer cycles and their stages.
+Two profilers are available:
+- cProfile, deterministic, records only the thread that started it. Writes .pstats files,
+  readable with pstats module, snakeviz or gprof2dot.
+- sampling profiler, samples stacks of each thread in fixed interval, so it also covers
+  device communication running in executor threads. Writes collapsed stacks (.folded files),
+  readable with flamegraph.pl, speedscope or inferno.
+Only the newest profiles of each name are kept.
+"""
+
+import collections
+import contextlib
+import cProfile
+import glob
+import logging
+import os
+import sys
+import threading
+import time
+import typing
+
+import config
+
+# logger of this module
+logger = logging.getLogger(__name__)
+
+
+class SamplingProfiler:
+    """Samples call stacks of each thread of process in background thread.
+    Stacks are counted in collapsed format, one line per unique stack."""
+
+    def __init__(self, interval: float = config.PROFILING["INTERVAL"]) -> None:
+        self.interval = interval
+        # {collapsed stack: number of samples}
+        self.stacks = collections.Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.__sample, daemon=True)
+
+    def enable(self) -> None:
+        """Starts sampling."""
+        self.thread.start()
+
+    def disable(self) -> None:
+        """Stops sampling."""
+        self.stopped.set()
+        self.thread.join()
+
+    def dump_stats(self, path: str) -> None:
+        """Writes collapsed stacks to file."""
+        with open(path, "w") as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f"{stack} {count}\n")
+
+    def __sample(self) -> None:
+        """Records stack of each thread until profiler is disabled."""
+        own = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(
+                        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                    )
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+
+
+# file extension of each profiler output
+EXTENSIONS = {"cprofile": "pstats", "sampling": "folded"}
+
+# flag that informs if profiler is running, profilers of nested stages are not started
+active = threading.Event()
+
+
+@contextlib.contextmanager
+def profile(
+    name: str, stage: str, settings: typing.Dict = config.PROFILING
+) -> typing.Iterator[None]:
+    """Profiles context, if profiling is enabled for given stage.
+    Profile is written to '{name}_{stage}_{time}' file of profiles directory."""
+    mode = settings["MODE"]
+    if mode not in EXTENSIONS or stage not in settings["STAGES"] or active.is_set():
+        yield
+        return
+    profiler = cProfile.Profile() if mode == "cprofile" else SamplingProfiler()
+    active.set()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        active.clear()
+        save(profiler, f"{name}_{stage}", EXTENSIONS[mode], settings)
+
+
+def save(
+    profiler: typing.Any,
+    prefix: str,
+    extension: str,
+    settings: typing.Dict = config.PROFILING,
+) -> None:
+    """Writes profile and removes the oldest profiles of the same prefix above KEEP limit."""
+    try:
+        os.makedirs(settings["DIRECTORY"], exist_ok=True)
+        path = os.path.join(
+            settings["DIRECTORY"],
+            f"{prefix}_{time.strftime('%Y%m%d_%H%M%S')}.{extension}",
+        )
+        profiler.dump_stats(path)
+        logger.info("PROFILING | Profile written to %s", path)
+        # timestamps in names keep profiles ordered by time
+        profiles = sorted(
+            glob.glob(os.path.join(settings["DIRECTORY"], f"{prefix}_*.{extension}"))
+        )
+        for old_path in profiles[: -settings["KEEP"]]:
+            os.remove(old_path)
+    except Exception:
+        logger.exception("PROFILING")
@@ -0,0 +1,412 @@
+"""
+This script contains tools used for keeping gathering cycles bounded in time:
+- overlap lock, that prevents cron from starting next cycle while previous one is still running.
+- circuit breaker, that skips repeatedly failing devices with exponential backoff.
+- deadline executor, that runs device communication with per device and per cycle deadlines.
+- process executor, that runs device communication in supervised worker processes,
+  killed and respawned when driver hangs.
+"""
+
+import collections
+import contextvars
+import fcntl
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import queue
+import signal
+import threading
+import time
+import traceback
+import typing
+
+import config
+from utils import logs, tracing
+from utils.metrics import REGISTRY
+from utils.state import StateFile
+
+# logger of this module
+logger = logging.getLogger(__name__)
+
+
+class CycleLock:
+    """Non-blocking, process wide lock of single gathering cycle type.
+    Lock is released by operating system if process dies, so stale locks are not possible.
+    """
+
+    def __init__(self, name: str) -> None:
+        # absolute path to lock file
+        self.path = os.path.join(config.STATE_DIR, f"{name}.lock")
+        # lock file descriptor
+        self.file = None
+        # flag that informs if lock has been acquired
+        self.acquired = False
+
+    def __enter__(self) -> object:
+        os.makedirs(config.STATE_DIR, exist_ok=True)
+        self.file = open(self.path, "w")
+        try:
+            fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self.acquired = False
+        else:
+            self.acquired = True
+            self.file.write(str(os.getpid()))
+            self.file.flush()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback) -> None:
+        if self.acquired:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+
+class CircuitBreaker:
+    """Tracks consecutive failures of each device (identified by MAC address).
+    After 'threshold' consecutive failures device is skipped for backoff time,
+    that doubles with each next failure, up to 'backoff_max'.
+    When backoff time passes, single attempt is allowed (half-open state)."""
+
+    def __init__(
+        self,
+        name: str = "breakers",
+        threshold: int = config.GATHERER["BREAKER_THRESHOLD"],
+        backoff: float = config.GATHERER["BREAKER_BACKOFF"],
+        backoff_max: float = config.GATHERER["BREAKER_BACKOFF_MAX"],
+    ) -> None:
+        self.threshold = threshold
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        # persistent state, {mac_address: {"failures": int, "open_until": float}}
+        self.state = StateFile(name)
+
+    def __enter__(self) -> object:
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback) -> None:
+        self.state.save()
+
+    def allow(self, key: str) -> bool:
+        """Returns True if device should be contacted in current cycle."""
+        entry = self.state.data.get(key)
+        return not entry or entry.get("open_until", 0) <= time.time()
+
+    def success(self, key: str) -> None:
+        """Closes circuit of given device."""
+        if self.state.data.pop(key, None):
+            logger.info("BREAKER | %s | Circuit closed", key)
+
+    def failure(self, key: str) -> None:
+        """Registers failure of given device and opens circuit if threshold has been reached."""
+        entry = self.state.data.setdefault(key, {"failures": 0, "open_until": 0})
+        entry["failures"] += 1
+        if entry["failures"] >= self.threshold:
+            # exponential backoff, counted from the moment threshold has been reached
+            backoff = min(
+                self.backoff * 2 ** (entry["failures"] - self.threshold),
+                self.backoff_max,
+            )
+            entry["open_until"] = time.time() + backoff
+            logger.warning(
+                "BREAKER | %s | Circuit opened for %.0fs after %s failures",
+                key,
+                backoff,
+                entry["failures"],
+            )
+
+
+class Task(typing.NamedTuple):
+    """Single unit of work submitted to DeadlineExecutor."""
+
+    key: str
+    lane: str
+    function: typing.Callable
+    args: typing.Tuple
+
+
+class Result(typing.NamedTuple):
+    """Outcome of single task. 'value' is None when task failed, timed out or has been skipped."""
+
+    key: str
+    value: typing.Any
+    error: typing.Optional[str]
+    duration: float
+    # task has not been started, as its lane is still used by timed out task
+    skipped: bool = False
+
+
+class DeadlineExecutor:
+    """Runs tasks in daemon threads grouped into lanes.
+    Tasks of the same lane are executed one after another (i.e. each BLE device shares single adapter),
+    different lanes are executed concurrently. Each task is abandoned after 'timeout' seconds
+    and whole execution is stopped when cycle 'budget' is exhausted. Abandoned threads are daemonic,
+    so they never block the process from exiting. Abandoned thread can not be stopped and still uses
+    resource of its lane, so remaining tasks of lane are skipped until the next cycle.
+    """
+
+    def __init__(
+        self,
+        timeout: float = config.GATHERER["DEVICE_TIMEOUT"],
+        budget: float = config.GATHERER["CYCLE_BUDGET"],
+    ) -> None:
+        self.timeout = timeout
+        self.deadline = time.monotonic() + budget
+        # tasks grouped by lane name
+        self.lanes = {}
+
+    @property
+    def remaining(self) -> float:
+        """Returns number of seconds left in cycle budget."""
+        return max(self.deadline - time.monotonic(), 0.0)
+
+    def submit(
+        self, key: str, function: typing.Callable, *args, lane: str = None
+    ) -> None:
+        """Adds task to lane. When lane is not given, task runs in its own lane."""
+        lane = lane or key
+        self.lanes.setdefault(lane, []).append(Task(key, lane, function, args))
+
+    def run(self) -> typing.List[Result]:
+        """Executes submitted tasks and returns list of results in completion order.
+        Tasks that did not finish before cycle deadline are returned as timed out."""
+        results = queue.Queue()
+        pending = {task.key for tasks in self.lanes.values() for task in tasks}
+        # threads do not inherit context, so it is copied to keep current span of each task
+        for tasks in self.lanes.values():
+            threading.Thread(
+                target=contextvars.copy_context().run,
+                args=(self.__run_lane, tasks, results),
+                daemon=True,
+            ).start()
+        completed = []
+        while pending:
+            try:
+                result = results.get(timeout=self.remaining)
+            except queue.Empty:
+                break
+            pending.discard(result.key)
+            completed.append(result)
+        # tasks still pending are stragglers cancelled by cycle deadline
+        for key in pending:
+            logger.warning("EXECUTOR | %s | Cancelled, cycle budget exhausted", key)
+            completed.append(Result(key, None, "cycle budget exhausted", 0.0))
+        self.lanes = {}
+        return completed
+
+    def __run_lane(self, tasks: typing.List[Task], results: queue.Queue) -> None:
+        """Executes tasks of single lane one after another."""
+        for index, task in enumerate(tasks):
+            # cycle budget exhausted, remaining tasks are not started at all
+            if not self.remaining:
+                return
+            result, finished = self.__run_task(task, min(self.timeout, self.remaining))
+            results.put(result)
+            if not finished:
+                for skipped in tasks[index + 1 :]:
+                    logger.warning(
+                        "EXECUTOR | %s | Skipped, lane %s is used by timed out %s",
+                        skipped.key,
+                        task.lane,
+                        task.key,
+                    )
+                    results.put(Result(skipped.key, None, None, 0.0, skipped=True))
+                return
+
+    @staticmethod
+    def __run_task(task: Task, timeout: float) -> typing.Tuple[Result, bool]:
+        """Runs single task in separate daemon thread and waits for it at most 'timeout' seconds.
+        Returns result of task and False, if its thread is still running."""
+        outcome = {}
+
+        def target() -> None:
+            try:
+                with logs.device(task.key):
+                    outcome["value"] = task.function(*task.args)
+            except Exception:
+                outcome["error"] = traceback.format_exc()
+
+        start = time.monotonic()
+        worker = threading.Thread(
+            target=contextvars.copy_context().run, args=(target,), daemon=True
+        )
+        worker.start()
+        worker.join(timeout)
+        duration = time.monotonic() - start
+        if worker.is_alive():
+            logger.warning("EXECUTOR | %s | Timed out after %.1fs", task.key, timeout)
+            return (
+                Result(task.key, None, f"timed out after {timeout:.1f}s", duration),
+                False,
+            )
+        return (
+            Result(task.key, outcome.get("value"), outcome.get("error"), duration),
+            True,
+        )
+
+
+def work(connection: multiprocessing.connection.Connection) -> None:
+    """Main loop of worker process. Executes tasks received through pipe
+    and sends back (value, error) pairs, until pipe is closed by supervisor."""
+    # own process group, so helper processes spawned by drivers (i.e. bluepy-helper)
+    # are killed together with worker
+    os.setpgrp()
+    # metrics inherited from supervisor are merged by supervisor itself,
+    # spans of tasks are children of span that was current when worker has been spawned
+    REGISTRY.clear()
+    while True:
+        try:
+            key, function, args = connection.recv()
+        except EOFError:
+            return
+        try:
+            with logs.device(key):
+                value, error = function(*args), None
+        except Exception:
+            value, error = None, traceback.format_exc()
+        # worker is killed instead of exiting, so its metrics and spans are written after each task
+        REGISTRY.flush()
+        tracing.flush()
+        try:
+            connection.send((value, error))
+        except Exception:
+            connection.send((None, traceback.format_exc()))
+
+
+class Worker(typing.NamedTuple):
+    """Worker process with supervisor end of its pipe."""
+
+    process: multiprocessing.Process
+    connection: multiprocessing.connection.Connection
+
+
+class Running(typing.NamedTuple):
+    """Task executed by worker."""
+
+    worker: Worker
+    task: Task
+    start: float
+    deadline: float
+
+
+class ProcessExecutor(DeadlineExecutor):
+    """Runs tasks in pool of supervised worker processes, with the same lanes and deadlines
+    as DeadlineExecutor. Worker whose task exceeds timeout is killed with its whole process group
+    and respawned, so driver hanging in C code never freezes gatherer. Supervisor only waits on pipes,
+    so it stays responsive regardless of workers state. Functions, arguments and values of tasks
+    have to be picklable, compact values (i.e. packed datasets) keep transfer cost low.
+    """
+
+    def __init__(
+        self,
+        timeout: float = config.GATHERER["DEVICE_TIMEOUT"],
+        budget: float = config.GATHERER["CYCLE_BUDGET"],
+        workers: int = config.GATHERER["WORKERS"],
+    ) -> None:
+        super().__init__(timeout, budget)
+        self.workers = max(workers, 1)
+
+    def run(self) -> typing.List[Result]:
+        """Executes submitted tasks and returns list of results in completion order.
+        Tasks that did not finish before cycle deadline are returned as timed out."""
+        lanes = {lane: collections.deque(tasks) for lane, tasks in self.lanes.items()}
+        pending = {task.key for tasks in lanes.values() for task in tasks}
+        # workers waiting for task and tasks being executed, {connection: Running}
+        idle, running = [], {}
+        completed = []
+        try:
+            while pending and self.remaining:
+                # starts next task of each lane that is not busy, as long as workers are available
+                busy = {run.task.lane for run in running.values()}
+                for lane, tasks in lanes.items():
+                    if not tasks or lane in busy:
+                        continue
+                    if not idle and len(running) >= self.workers:
+                        break
+                    worker = idle.pop() if idle else self.__spawn()
+                    task = tasks.popleft()
+                    start = time.monotonic()
+                    worker.connection.send((task.key, task.function, task.args))
+                    running[worker.connection] = Running(
+                        worker, task, start, start + min(self.timeout, self.remaining)
+                    )
+                # waits for the first result, at most until the nearest deadline
+                deadline = min(run.deadline for run in running.values())
+                ready = multiprocessing.connection.wait(
+                    list(running), timeout=max(deadline - time.monotonic(), 0)
+                )
+                for connection in ready:
+                    run = running.pop(connection)
+                    try:
+                        value, error = connection.recv()
+                    except (EOFError, OSError):
+                        # worker died during task (i.e. crashed in native code)
+                        self.__kill(run.worker)
+                        value, error = None, (
+                            f"worker died with exit code {run.worker.process.exitcode}"
+                        )
+                    else:
+                        idle.append(run.worker)
+                    completed.append(
+                        Result(run.task.key, value, error, time.monotonic() - run.start)
+                    )
+                    pending.discard(run.task.key)
+                # kills workers of tasks that exceeded their deadline, they are respawned on demand
+                now = time.monotonic()
+                for connection, run in list(running.items()):
+                    if run.deadline > now:
+                        continue
+                    del running[connection]
+                    self.__kill(run.worker)
+                    duration = now - run.start
+                    logger.warning(
+                        "EXECUTOR | %s | Worker killed after %.1fs",
+                        run.task.key,
+                        duration,
+                    )
+                    completed.append(
+                        Result(
+                            run.task.key,
+                            None,
+                            f"worker killed after {duration:.1f}s",
+                            duration,
+                        )
+                    )
+                    pending.discard(run.task.key)
+        finally:
+            for run in running.values():
+                self.__kill(run.worker)
+            for worker in idle:
+                # closed pipe ends worker main loop
+                worker.connection.close()
+                worker.process.join(1)
+                if worker.process.is_alive():
+                    self.__kill(worker)
+        # tasks still pending are stragglers cancelled by cycle deadline
+        for key in pending:
+            logger.warning("EXECUTOR | %s | Cancelled, cycle budget exhausted", key)
+            completed.append(Result(key, None, "cycle budget exhausted", 0.0))
+        self.lanes = {}
+        return completed
+
+    @staticmethod
+    def __spawn() -> Worker:
+        """Starts new worker process."""
+        connection, child_connection = multiprocessing.Pipe()
+        process = multiprocessing.Process(
+            target=work, args=(child_connection,), daemon=True
+        )
+        process.start()
+        child_connection.close()
+        return Worker(process, connection)
+
+    @staticmethod
+    def __kill(worker: Worker) -> None:
+        """Kills worker process with its process group."""
+        try:
+            os.killpg(worker.process.pid, signal.SIGKILL)
+        except OSError:
+            # worker has not created its own group yet or has already exited
+            worker.process.kill()
+        worker.process.join()
+        worker.connection.close()
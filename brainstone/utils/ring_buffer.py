@@ -0,0 +1,235 @@
+"""
+This script contains columnar ring buffers of recent readings of each device and metric.
+Timestamps and values are stored in two float64 columns of fixed capacity, optionally backed
+by memory-mapped file, so readings survive restarts and are shared with other processes.
+Window statistics are vectorized with NumPy when it is installed, otherwise plain Python is used.
+Statistics of each device and metric are exported as metrics after each air cycle.
+"""
+
+import math
+import mmap
+import os
+import re
+import struct
+import time
+import typing
+from itertools import chain
+
+import config
+from models.data import AirData
+from utils.metrics import REGISTRY
+
+
+# header of buffer storage: magic, capacity, index of next write, number of stored readings
+HEADER = struct.Struct("<8sQQQ")
+MAGIC = b"BHRING01"
+
+# size of single column item (float64)
+ITEM_SIZE = 8
+
+
+class RingBuffer:
+    """Fixed capacity buffer of (timestamp, value) readings of single metric.
+    When buffer is full, each new reading overwrites the oldest one."""
+
+    def __init__(self, capacity: int, path: str = None) -> None:
+        self.capacity = capacity
+        size = HEADER.size + 2 * ITEM_SIZE * capacity
+        if path:
+            # existing file of different capacity is discarded
+            reset = not os.path.isfile(path) or os.path.getsize(path) != size
+            descriptor = os.open(path, os.O_RDWR | os.O_CREAT)
+            try:
+                if reset:
+                    os.ftruncate(descriptor, size)
+                self.storage = mmap.mmap(descriptor, size)
+            finally:
+                os.close(descriptor)
+        else:
+            reset = True
+            self.storage = bytearray(size)
+        magic, stored_capacity, _, _ = HEADER.unpack_from(self.storage)
+        if reset or magic != MAGIC or stored_capacity != capacity:
+            HEADER.pack_into(self.storage, 0, MAGIC, capacity, 0, 0)
+        # columns
+        self.view = memoryview(self.storage)
+        self.timestamps = self.view[
+            HEADER.size : HEADER.size + ITEM_SIZE * capacity
+        ].cast("d")
+        self.values = self.view[HEADER.size + ITEM_SIZE * capacity :].cast("d")
+
+    def __len__(self) -> int:
+        return HEADER.unpack_from(self.storage)[3]
+
+    def close(self) -> None:
+        """Releases columns and flushes memory-mapped file."""
+        self.timestamps.release()
+        self.values.release()
+        self.view.release()
+        if isinstance(self.storage, mmap.mmap):
+            self.storage.flush()
+            self.storage.close()
+
+    def append(self, timestamp: float, value: float) -> None:
+        """Adds single reading. Header is updated after columns, so concurrent
+        readers never see index pointing at not yet written reading."""
+        _, _, head, count = HEADER.unpack_from(self.storage)
+        self.timestamps[head] = timestamp
+        self.values[head] = value
+        HEADER.pack_into(
+            self.storage,
+            0,
+            MAGIC,
+            self.capacity,
+            (head + 1) % self.capacity,
+            min(count + 1, self.capacity),
+        )
+
+    def window(
+        self, seconds: float, now: float = None
+    ) -> typing.Tuple[typing.Sequence[float], typing.Sequence[float]]:
+        """Returns timestamps and values of readings from last 'seconds', ordered by time.
+        Returned columns are copies (NumPy arrays or lists), independent of buffer."""
+        start = (now or time.time()) - seconds
+        _, _, head, count = HEADER.unpack_from(self.storage)
+        # physical index ranges in chronological order
+        if count < self.capacity:
+            ranges = ((0, count),)
+        else:
+            ranges = ((head, self.capacity), (0, head))
+        # NumPy is imported when buffer is read, as it takes significant part of
+        # gatherer startup time, also when no data is buffered
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        if numpy is not None:
+            timestamps = numpy.frombuffer(self.timestamps, dtype=numpy.float64)
+            values = numpy.frombuffer(self.values, dtype=numpy.float64)
+            timestamps = numpy.concatenate([timestamps[a:b] for a, b in ranges])
+            values = numpy.concatenate([values[a:b] for a, b in ranges])
+            mask = timestamps >= start
+            return timestamps[mask], values[mask]
+        timestamps, values = [], []
+        for a, b in ranges:
+            for timestamp, value in zip(self.timestamps[a:b], self.values[a:b]):
+                if timestamp >= start:
+                    timestamps.append(timestamp)
+                    values.append(value)
+        return timestamps, values
+
+    def stats(self, seconds: float, now: float = None) -> typing.Dict[str, float]:
+        """Returns count, minimum, maximum, mean, standard deviation and slope
+        (change per second, least squares) of readings from last 'seconds'.
+        Statistics of empty window are None."""
+        timestamps, values = self.window(seconds, now)
+        count = len(values)
+        if not count:
+            return dict.fromkeys(("count", "min", "max", "mean", "std", "slope"))
+        # columns are NumPy arrays when it is installed
+        if not isinstance(values, list):
+            mean = float(values.mean())
+            std = float(values.std())
+            minimum, maximum = float(values.min()), float(values.max())
+            centered = timestamps - timestamps.mean()
+            variance = float((centered**2).sum())
+            covariance = float((centered * (values - mean)).sum())
+        else:
+            mean = math.fsum(values) / count
+            std = math.sqrt(math.fsum((value - mean) ** 2 for value in values) / count)
+            minimum, maximum = min(values), max(values)
+            time_mean = math.fsum(timestamps) / count
+            centered = [timestamp - time_mean for timestamp in timestamps]
+            variance = math.fsum(item**2 for item in centered)
+            covariance = math.fsum(
+                item * (value - mean) for item, value in zip(centered, values)
+            )
+        return {
+            "count": count,
+            "min": minimum,
+            "max": maximum,
+            "mean": mean,
+            "std": std,
+            "slope": covariance / variance if variance else 0.0,
+        }
+
+
+class ReadingsStore:
+    """Ring buffers of each device (identified by MAC address) and metric.
+    Buffers are opened lazily and kept in directory given in configuration."""
+
+    def __init__(
+        self,
+        directory: str = config.READINGS["DIRECTORY"],
+        window: float = config.READINGS["WINDOW"],
+        resolution: float = config.READINGS["RESOLUTION"],
+    ) -> None:
+        self.directory = directory
+        self.capacity = int(math.ceil(window / resolution))
+        # opened buffers, {(mac_address, metric): RingBuffer}
+        self.buffers = {}
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def __enter__(self) -> object:
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Closes each opened buffer."""
+        for buffer in self.buffers.values():
+            buffer.close()
+        self.buffers = {}
+
+    def buffer(self, key: str, metric: str) -> RingBuffer:
+        """Returns buffer of given device and metric."""
+        if (key, metric) not in self.buffers:
+            path = None
+            if self.directory:
+                name = re.sub(r"[^0-9A-Za-z_]", "", f"{key}_{metric}".lower())
+                path = os.path.join(self.directory, f"{name}.ring")
+            self.buffers[(key, metric)] = RingBuffer(self.capacity, path)
+        return self.buffers[(key, metric)]
+
+    def add(self, air_data: AirData, timestamp: float = None) -> None:
+        """Adds each non-empty air and health field of dataset to buffers of its device."""
+        timestamp = timestamp or time.time()
+        for metric, value in chain(
+            air_data.air_data.items(), air_data.health_data.items()
+        ):
+            if value is not None:
+                self.buffer(air_data.device.mac_address, metric).append(
+                    timestamp, value
+                )
+
+    def stats(
+        self, key: str, metric: str, seconds: float, now: float = None
+    ) -> typing.Dict[str, float]:
+        """Returns window statistics of given device and metric."""
+        return self.buffer(key, metric).stats(seconds, now)
+
+    def publish(
+        self, air_data: AirData, seconds: float = config.READINGS["STATS_WINDOW"]
+    ) -> None:
+        """Sets gauges of window statistics of each buffered metric of dataset."""
+        key = air_data.device.mac_address
+        for metric, value in chain(
+            air_data.air_data.items(), air_data.health_data.items()
+        ):
+            if value is None:
+                continue
+            stats = self.stats(key, metric, seconds)
+            if not stats["count"]:
+                continue
+            for name in ("mean", "min", "max"):
+                REGISTRY.set(
+                    f"brainstone_reading_{name}", stats[name], device=key, field=metric
+                )
+            REGISTRY.set(
+                "brainstone_reading_slope_per_hour",
+                stats["slope"] * 3600,
+                device=key,
+                field=metric,
+            )
@@ -0,0 +1,113 @@
+"""
+This script contains adaptive scheduler, that decides how often each device should be polled.
+Gatherer is triggered by cron more often than any device needs to be polled,
+scheduler lets through only devices that are due.
+"""
+
+import logging
+import random
+import time
+import typing
+
+import config
+from utils.state import StateFile
+
+# logger of this module
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveScheduler:
+    """Stores polling interval and next due time of each device (identified by MAC address).
+    Interval shrinks when readings change faster than configured thresholds or device location
+    is in alert state, and stretches when readings are stable. Interval always stays within bounds.
+    """
+
+    def __init__(
+        self, name: str = "schedule", settings: typing.Dict = config.SCHEDULER
+    ) -> None:
+        self.settings = settings
+        # persistent state, {mac_address: {"interval": float, "next": float, "last": dict}}
+        self.state = StateFile(name)
+
+    def __enter__(self) -> object:
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback) -> None:
+        self.state.save()
+
+    def due(self, key: str) -> bool:
+        """Returns True if device should be polled in current cycle.
+        Device that has never been polled is always due."""
+        entry = self.state.data.get(key)
+        return not entry or entry.get("next", 0) <= time.time()
+
+    def interval(self, key: str) -> float:
+        """Returns current polling interval of device."""
+        entry = self.state.data.get(key, {})
+        return entry.get("interval", self.settings["DEFAULT_INTERVAL"])
+
+    def delay(self, key: str) -> float:
+        """Returns number of seconds to next poll of device,
+        or its interval when next poll is overdue (i.e. device has been skipped)."""
+        entry = self.state.data.get(key, {})
+        delay = entry.get("next", 0) - time.time()
+        return delay if delay > 0 else self.interval(key)
+
+    def postpone(self, key: str) -> None:
+        """Schedules next poll of device without changing its interval,
+        used when device has not responded."""
+        entry = self.state.data.setdefault(key, {"last": {}})
+        entry["interval"] = self.interval(key)
+        entry["next"] = time.time() + self.__jittered(entry["interval"])
+
+    def update(
+        self, key: str, values: typing.Dict[str, typing.Any], alert: bool = False
+    ) -> float:
+        """Adjusts interval of device based on received readings and returns new interval."""
+        entry = self.state.data.setdefault(key, {"last": {}})
+        interval = self.interval(key)
+        if alert:
+            interval = self.settings["MIN_INTERVAL"]
+        # first reading of device has nothing to be compared with
+        elif entry.get("last"):
+            # the highest change of readings, relative to its threshold
+            change = self.__change(entry.get("last", {}), values)
+            if change >= 1:
+                interval *= self.settings["SHRINK_FACTOR"]
+            elif change < 0.5:
+                interval *= self.settings["STRETCH_FACTOR"]
+        # keeps interval within bounds
+        interval = min(
+            max(interval, self.settings["MIN_INTERVAL"]), self.settings["MAX_INTERVAL"]
+        )
+        if interval != entry.get("interval"):
+            logger.debug("SCHEDULER | %s | Interval changed to %.0fs", key, interval)
+        entry["interval"] = interval
+        entry["next"] = time.time() + self.__jittered(interval)
+        entry["last"] = {
+            field: value for field, value in values.items() if value is not None
+        }
+        return interval
+
+    def __change(
+        self,
+        previous: typing.Dict[str, typing.Any],
+        current: typing.Dict[str, typing.Any],
+    ) -> float:
+        """Returns the highest absolute change of readings divided by its threshold.
+        Readings without previous value or threshold are ignored."""
+        changes = [0.0]
+        for field, threshold in self.settings["THRESHOLDS"].items():
+            if previous.get(field) is None or current.get(field) is None:
+                continue
+            changes.append(abs(current[field] - previous[field]) / threshold)
+        return max(changes)
+
+    def __jittered(self, interval: float) -> float:
+        """Returns interval randomly shifted by configured fraction, to spread devices over time.
+        Cron granularity is compensated by shortening the interval by half of minimal interval.
+        """
+        jitter = self.settings["JITTER"]
+        return interval * random.uniform(1 - jitter, 1 + jitter) - (
+            self.settings["MIN_INTERVAL"] / 2
+        )
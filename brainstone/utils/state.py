@@ -0,0 +1,63 @@
+"""
+This script contains helpers used for storing state that has to survive between gatherer runs.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import typing
+
+import config
+
+# logger of this module
+logger = logging.getLogger(__name__)
+
+
+class StateFile:
+    """Class representation of single JSON document stored in state directory.
+    Content is loaded on initialization and written back atomically on save."""
+
+    def __init__(self, name: str) -> None:
+        # absolute path to state file
+        self.path = os.path.join(config.STATE_DIR, f"{name}.json")
+        # loaded content of state file
+        self.data = self.load()
+
+    def __enter__(self) -> object:
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback) -> None:
+        # state is stored even if exception occurred, it reflects what already happened
+        self.save()
+
+    def load(self) -> typing.Dict:
+        """Returns content of state file or empty dictionary if file does not exist or is corrupted."""
+        try:
+            with open(self.path, "r") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return {}
+        except Exception:
+            logger.exception("STATE | %s", self.path)
+            return {}
+        else:
+            return data if isinstance(data, dict) else {}
+
+    def save(self) -> bool:
+        """Writes content to temporary file and replaces state file with it,
+        so readers never see partially written document.
+        Returns True if operation succeed, otherwise returns False."""
+        try:
+            os.makedirs(config.STATE_DIR, exist_ok=True)
+            descriptor, temporary_path = tempfile.mkstemp(
+                dir=config.STATE_DIR, suffix=".tmp"
+            )
+            with os.fdopen(descriptor, "w") as file:
+                json.dump(self.data, file)
+            os.replace(temporary_path, self.path)
+        except Exception:
+            logger.exception("STATE | %s", self.path)
+            return False
+        else:
+            return True
@@ -0,0 +1,264 @@
+"""
+This script contains lightweight tracing of brainstone, used for finding where time of cycle goes.
+Span measures single operation (i.e. cycle stage, device fetch, database query), spans opened
+within other span become its children. Current span is kept in context variable, so it is
+propagated to executor threads and inherited by forked worker processes.
+Spans are exported when root span ends, by one of exporters:
+- "file", appends spans as JSON documents (one per line) to '{trace id}.jsonl' file
+  of traces directory, only the newest traces are kept.
+- "http", posts spans to collector (i.e. 'tracer.py collect' stand-in), that stores them the same way.
+Trace is rendered as waterfall of its spans by tracer script.
+"""
+
+import atexit
+import contextlib
+import contextvars
+import functools
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import typing
+
+import config
+
+# logger of this module
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    """Single timed operation of trace."""
+
+    __slots__ = (
+        "name",
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "start",
+        "duration",
+        "attributes",
+        "error",
+        "process",
+        "thread",
+        "clock",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        parent: typing.Optional["Span"],
+        attributes: typing.Dict[str, typing.Any],
+    ) -> None:
+        self.name = name
+        # identifier of trace starts with timestamp, so trace files are ordered by time
+        self.trace_id = (
+            parent.trace_id
+            if parent
+            else f"{int(time.time()):08x}{os.urandom(8).hex()}"
+        )
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        # wall clock is comparable between processes, monotonic clock measures duration
+        self.start = time.time()
+        self.clock = time.perf_counter()
+        self.duration = None
+        self.attributes = attributes
+        self.error = None
+        self.process = os.getpid()
+        self.thread = threading.current_thread().name
+
+    def finish(self) -> None:
+        """Records duration of span."""
+        self.duration = time.perf_counter() - self.clock
+
+    def to_dict(self) -> typing.Dict[str, typing.Any]:
+        """Returns span as JSON serializable dictionary."""
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "duration": self.duration,
+            "attributes": self.attributes,
+            "error": self.error,
+            "process": self.process,
+            "thread": self.thread,
+        }
+
+
+# span of current thread (or task), None outside of traced operation
+current = contextvars.ContextVar("span", default=None)
+
+# finished spans waiting for export
+finished = []
+lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def span(
+    name: str, settings: typing.Dict = config.TRACING, **attributes
+) -> typing.Iterator[typing.Optional[Span]]:
+    """Measures context as span of given name, child of current span.
+    Span without parent starts new trace, that is exported when it ends.
+    Does nothing when tracing is disabled."""
+    if not settings["EXPORTER"]:
+        yield None
+        return
+    parent = current.get()
+    item = Span(name, parent, attributes)
+    token = current.set(item)
+    try:
+        yield item
+    except BaseException as e:
+        item.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        item.finish()
+        current.reset(token)
+        with lock:
+            finished.append(item)
+        if parent is None:
+            flush(settings)
+
+
+def traced(name: str = None, **attributes) -> typing.Callable:
+    """Returns decorator that measures each call of function as span,
+    named with qualified name of function by default."""
+
+    def decorator(function: typing.Callable) -> typing.Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name or function.__qualname__, **attributes):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def annotate(**attributes) -> None:
+    """Adds attributes to current span."""
+    item = current.get()
+    if item is not None:
+        item.attributes.update(attributes)
+
+
+def flush(settings: typing.Dict = config.TRACING) -> None:
+    """Exports finished spans. Spans of abandoned threads (i.e. timed out devices)
+    are exported with the next trace or on exit."""
+    global finished
+    with lock:
+        spans, finished = finished, []
+    if not spans:
+        return
+    try:
+        if settings["EXPORTER"] == "http":
+            post(spans, settings)
+        else:
+            write([item.to_dict() for item in spans], settings)
+    except Exception:
+        logger.warning("TRACING | Unable to export %s spans", len(spans), exc_info=True)
+
+
+def post(spans: typing.List[Span], settings: typing.Dict = config.TRACING) -> None:
+    """Sends spans to collector."""
+    # imported on first export, file exporter does not need it
+    import urllib.request
+
+    request = urllib.request.Request(
+        settings["ENDPOINT"],
+        data=json.dumps([item.to_dict() for item in spans]).encode(),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    with urllib.request.urlopen(request, timeout=settings["TIMEOUT"]):
+        pass
+
+
+def write(
+    spans: typing.List[typing.Dict], settings: typing.Dict = config.TRACING
+) -> None:
+    """Appends spans to files of their traces and removes the oldest traces above KEEP limit."""
+    os.makedirs(settings["DIRECTORY"], exist_ok=True)
+    traces = {}
+    for item in spans:
+        traces.setdefault(item["trace_id"], []).append(json.dumps(item, default=str))
+    for trace_id, lines in traces.items():
+        # single write of appended file, so spans of worker processes are not interleaved
+        with open(
+            os.path.join(settings["DIRECTORY"], f"{trace_id}.jsonl"), "a"
+        ) as file:
+            file.write("".join(f"{line}\n" for line in lines))
+    for path in sorted(glob.glob(os.path.join(settings["DIRECTORY"], "*.jsonl")))[
+        : -settings["KEEP"]
+    ]:
+        with contextlib.suppress(OSError):
+            os.remove(path)
+
+
+def read(trace_id: str = None, settings: typing.Dict = config.TRACING) -> typing.List:
+    """Returns spans of given trace (or the newest trace) stored in traces directory."""
+    paths = sorted(glob.glob(os.path.join(settings["DIRECTORY"], "*.jsonl")))
+    if trace_id:
+        paths = [path for path in paths if os.path.basename(path).startswith(trace_id)]
+    if not paths:
+        return []
+    with open(paths[-1]) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def waterfall(spans: typing.List[typing.Dict], width: int = 40) -> str:
+    """Renders spans of trace as waterfall, each span is drawn as bar placed
+    on common time axis, below its parent and ordered by start time."""
+    if not spans:
+        return "No spans"
+    ids = {item["span_id"] for item in spans}
+    children = {}
+    for item in sorted(spans, key=lambda item: item["start"]):
+        # parent of span could be lost, i.e. with abandoned thread of previous trace
+        parent = item["parent_id"] if item["parent_id"] in ids else None
+        children.setdefault(parent, []).append(item)
+    begin = min(item["start"] for item in spans)
+    end = max(item["start"] + (item["duration"] or 0) for item in spans)
+    scale = width / max(end - begin, 1e-9)
+    lines = [
+        f"trace {spans[0]['trace_id']} | {len(spans)} spans | {(end - begin) * 1000:.1f} ms",
+        f"{'offset [ms]':>12} {'duration [ms]':>14}  {'':{width}}  span",
+    ]
+
+    def render(item: typing.Dict, depth: int) -> None:
+        offset = item["start"] - begin
+        duration = item["duration"]
+        left = min(int(offset * scale), width - 1)
+        length = max(int((duration or 0) * scale), 1)
+        bar = " " * left + "=" * min(length, width - left)
+        details = " ".join(
+            f"{key}={value}" for key, value in item["attributes"].items()
+        )
+        if item["error"]:
+            details += f" ERROR {item['error']}"
+        lines.append(
+            f"{offset * 1000:>12.1f} "
+            + (f"{duration * 1000:>14.1f}" if duration is not None else f"{'-':>14}")
+            + f"  {bar:{width}}  {'  ' * depth}{item['name']} {details}".rstrip()
+        )
+        for child in children.get(item["span_id"], []):
+            render(child, depth + 1)
+
+    for root in children.get(None, []):
+        render(root, 0)
+    return "\n".join(lines)
+
+
+def forget() -> None:
+    """Drops spans inherited by forked process, they are exported by parent."""
+    global finished, lock
+    finished, lock = [], threading.Lock()
+
+
+# spans of threads still running at exit (i.e. passive network) are not lost
+atexit.register(flush)
+os.register_at_fork(after_in_child=forget)
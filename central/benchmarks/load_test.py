@@ -0,0 +1,395 @@
+"""
+Load test of central REST API.
+- seed, creates rooms and devices in PostgreSQL and writes months of synthetic air data
+  of each room to InfluxDB. Seeded records are marked with "loadtest" brand and room names
+  prefix, ids of seeded rooms and devices are written to fixture file.
+- run, requests rooms, rooms air, devices, device and settings endpoints from concurrent
+  clients and reports throughput and latency percentiles of each endpoint, together with
+  number and time of ORM queries and Flux queries reported in Server-Timing header.
+- clean, removes seeded records from PostgreSQL and seeded series from InfluxDB.
+Seeding and cleaning use Django settings of central, so they have to be run where central runs.
+Seeded air data should be written to separate InfluxDB instance (INFLUX_URL of central), i.e.
+$ docker run -d --name influxdb-loadtest -p 8087:8086 -e DOCKER_INFLUXDB_INIT_MODE=setup \
+  -e DOCKER_INFLUXDB_INIT_USERNAME=loadtest -e DOCKER_INFLUXDB_INIT_PASSWORD=loadtest \
+  -e DOCKER_INFLUXDB_INIT_ORG=boolhub -e DOCKER_INFLUXDB_INIT_BUCKET=air \
+  -e DOCKER_INFLUXDB_INIT_ADMIN_TOKEN=loadtest influxdb:2.2.0
+
+Usage:
+$ INFLUX_URL=http://localhost:8087 INFLUX_TOKEN=loadtest python3 load_test.py seed --rooms 50 --devices 500 --months 3
+$ python3 load_test.py run --url http://localhost:8000 --concurrency 16 --duration 60
+$ INFLUX_URL=http://localhost:8087 INFLUX_TOKEN=loadtest python3 load_test.py clean
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import typing
+import urllib.error
+import urllib.request
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+# brand of seeded devices and prefix of seeded rooms names
+MARKER = "loadtest"
+
+# endpoints driven by load test, device endpoint is formatted with id of seeded device
+ENDPOINTS = (
+    "api/rooms/",
+    "api/rooms/air",
+    "api/devices/",
+    "api/devices/{device_id}",
+    "api/settings/",
+)
+
+# categories of seeded devices other than air devices
+CATEGORIES = ("network", "computer", "smartphone", "tablet", "tv", "light", "other")
+
+
+def setup_django() -> None:
+    """Initializes Django with central settings, so its models can be used."""
+    import django
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "central.settings")
+    django.setup()
+
+
+def escape(value: str) -> str:
+    """Escapes tag value of line protocol."""
+    return (
+        value.replace("\\", "\\\\")
+        .replace(",", "\\,")
+        .replace("=", "\\=")
+        .replace(" ", "\\ ")
+    )
+
+
+def synthetic_air(
+    series: str, start: int, end: int, interval: int
+) -> typing.Iterator[str]:
+    """Returns air points of single device in line protocol, from start to end (seconds since epoch).
+    Temperature and humidity follow daily cycle, AQI follows random walk."""
+    aqi = random.randint(5, 60)
+    phase = random.uniform(0, 2 * math.pi)
+    for timestamp in range(start, end, interval):
+        day = 2 * math.pi * (timestamp % 86400) / 86400 + phase
+        aqi = min(300, max(0, aqi + random.randint(-3, 3)))
+        temperature = 21.5 + 2.5 * math.sin(day) + random.uniform(-0.3, 0.3)
+        humidity = int(45 - 10 * math.sin(day) + random.uniform(-2, 2))
+        yield f"{series} aqi={aqi}i,humidity={humidity}i,temperature={temperature:.1f} {timestamp}"
+
+
+def seed(arguments: argparse.Namespace) -> None:
+    """Creates rooms and devices in PostgreSQL and writes their air data to InfluxDB."""
+    setup_django()
+    from django.conf import settings
+    from influxdb_client import InfluxDBClient, WritePrecision
+    from influxdb_client.client.write_api import SYNCHRONOUS
+
+    from devices.models import Device
+    from rooms.models import Room
+
+    start = time.perf_counter()
+    rooms = Room.objects.bulk_create(
+        Room(
+            name=f"{MARKER} {index:04d}",
+            length=random.uniform(2, 8),
+            width=random.uniform(2, 6),
+            height=2.6,
+        )
+        for index in range(arguments.rooms)
+    )
+    devices = []
+    for index in range(arguments.devices):
+        # first devices are air devices, devices are spread evenly over rooms
+        air = index < arguments.air_devices
+        devices.append(
+            Device(
+                name=f"{MARKER} {'air' if air else 'device'} {index:05d}",
+                category="air" if air else random.choice(CATEGORIES),
+                brand=MARKER,
+                mac_address=f"02:00:00:{index // 65536:02x}:{index // 256 % 256:02x}:{index % 256:02x}",
+                ip_address=f"10.{index // 65536}.{index // 256 % 256}.{index % 256}",
+                token="",
+                location=rooms[index % len(rooms)] if rooms else None,
+            )
+        )
+    devices = Device.objects.bulk_create(devices)
+    print(
+        f"PostgreSQL | {len(rooms)} rooms, {len(devices)} devices created in {time.perf_counter() - start:.1f} s"
+    )
+    # ids of bulk created objects are returned by PostgreSQL backend
+    with open(arguments.fixture, "w") as file:
+        json.dump(
+            {
+                "rooms": [room.pk for room in rooms],
+                "devices": [device.pk for device in devices],
+            },
+            file,
+        )
+    # air data of each air device, written in batches
+    influx = settings.DATABASES["influxdb"]
+    end = int(time.time())
+    first = end - int(arguments.months * 30 * 86400)
+    start, points = time.perf_counter(), 0
+    with InfluxDBClient(
+        url=influx["URL"], token=influx["API_TOKEN"], org=influx["ORGANIZATION"]
+    ) as client:
+        write_api = client.write_api(write_options=SYNCHRONOUS)
+        for device in devices:
+            if device.category != "air" or device.location is None:
+                continue
+            tags = {
+                "brand": device.brand,
+                "category": device.category,
+                "device": device.name,
+                "mac_address": device.mac_address,
+                "room": device.location.name,
+            }
+            series = ",".join(
+                ["air"]
+                + [f"{tag}={escape(value)}" for tag, value in sorted(tags.items())]
+            )
+            batch = []
+            for line in synthetic_air(series, first, end, arguments.interval):
+                batch.append(line)
+                if len(batch) == arguments.batch:
+                    write_api.write(
+                        bucket="air", record=batch, write_precision=WritePrecision.S
+                    )
+                    points += len(batch)
+                    batch = []
+            if batch:
+                write_api.write(
+                    bucket="air", record=batch, write_precision=WritePrecision.S
+                )
+                points += len(batch)
+    duration = time.perf_counter() - start
+    print(
+        f"InfluxDB | {points} air points written in {duration:.1f} s ({points / max(duration, 1e-9):.0f} points/s)"
+    )
+
+
+def clean(arguments: argparse.Namespace) -> None:
+    """Removes seeded records from PostgreSQL and seeded series from InfluxDB."""
+    setup_django()
+    from django.conf import settings
+    from influxdb_client import InfluxDBClient
+
+    from devices.models import Device
+    from rooms.models import Room
+
+    devices, _ = Device.objects.filter(brand=MARKER).delete()
+    rooms, _ = Room.objects.filter(name__startswith=f"{MARKER} ").delete()
+    print(f"PostgreSQL | {rooms} rooms, {devices} devices removed")
+    influx = settings.DATABASES["influxdb"]
+    with InfluxDBClient(
+        url=influx["URL"], token=influx["API_TOKEN"], org=influx["ORGANIZATION"]
+    ) as client:
+        client.delete_api().delete(
+            start="1970-01-01T00:00:00Z",
+            stop=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() + 3600)),
+            predicate=f'_measurement="air" AND brand="{MARKER}"',
+            bucket="air",
+        )
+    print("InfluxDB | seeded air series removed")
+    if os.path.exists(arguments.fixture):
+        os.remove(arguments.fixture)
+
+
+class Statistics:
+    """Latencies and backend timings of requests, grouped by endpoint."""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        # {endpoint: [latency in seconds]}
+        self.latencies = collections.defaultdict(list)
+        # {endpoint: number of failed requests}
+        self.errors = collections.Counter()
+        # {(endpoint, backend): [calls, milliseconds]}, summed from Server-Timing headers
+        self.backends = collections.defaultdict(lambda: [0, 0.0])
+
+    def add(
+        self, endpoint: str, latency: float, ok: bool, server_timing: str = ""
+    ) -> None:
+        """Records single request."""
+        timings = parse_server_timing(server_timing)
+        with self.lock:
+            self.latencies[endpoint].append(latency)
+            if not ok:
+                self.errors[endpoint] += 1
+            for backend, (calls, duration) in timings.items():
+                entry = self.backends[(endpoint, backend)]
+                entry[0] += calls
+                entry[1] += duration
+
+
+def parse_server_timing(header: str) -> typing.Dict[str, typing.Tuple[int, float]]:
+    """Returns backends calls and time in milliseconds from Server-Timing header,
+    {backend: (calls, milliseconds)}. Total time of request is omitted."""
+    timings = {}
+    for metric in filter(None, (part.strip() for part in header.split(","))):
+        name, *parameters = (parameter.strip() for parameter in metric.split(";"))
+        if name == "total":
+            continue
+        calls, duration = 0, 0.0
+        for parameter in parameters:
+            key, _, value = parameter.partition("=")
+            if key == "dur":
+                duration = float(value)
+            elif key == "desc":
+                calls = int(value.strip('"').split()[0])
+        timings[name] = (calls, duration)
+    return timings
+
+
+def percentile(values: typing.List[float], rank: float) -> float:
+    """Returns percentile of sorted values, nearest rank method."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, math.ceil(rank / 100 * len(values)) - 1))]
+
+
+def client(
+    base_url: str,
+    endpoints: typing.List[str],
+    device_ids: typing.List[int],
+    deadline: float,
+    requests: int,
+    statistics: Statistics,
+) -> None:
+    """Requests endpoints in turns, until deadline passes or given number of requests is made."""
+    made = 0
+    while time.monotonic() < deadline and (not requests or made < requests):
+        endpoint = endpoints[made % len(endpoints)]
+        url = (
+            f"{base_url}/{endpoint.format(device_id=random.choice(device_ids or [0]))}"
+        )
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(url, timeout=60) as response:
+                response.read()
+                ok, server_timing = True, response.headers.get("Server-Timing", "")
+        except urllib.error.HTTPError as e:
+            e.read()
+            ok, server_timing = False, e.headers.get("Server-Timing", "")
+        except OSError:
+            ok, server_timing = False, ""
+        statistics.add(endpoint, time.perf_counter() - start, ok, server_timing)
+        made += 1
+
+
+def run(arguments: argparse.Namespace) -> None:
+    """Drives endpoints from concurrent clients and prints report."""
+    device_ids = []
+    if os.path.exists(arguments.fixture):
+        with open(arguments.fixture) as file:
+            device_ids = json.load(file)["devices"]
+    endpoints = [
+        endpoint
+        for endpoint in arguments.endpoints
+        if device_ids or "{device_id}" not in endpoint
+    ]
+    statistics = Statistics()
+    deadline = time.monotonic() + arguments.duration
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(arguments.concurrency) as executor:
+        futures = [
+            executor.submit(
+                client,
+                arguments.url.rstrip("/"),
+                # clients start with different endpoints, so each endpoint is requested concurrently
+                endpoints[index % len(endpoints) :]
+                + endpoints[: index % len(endpoints)],
+                device_ids,
+                deadline,
+                arguments.requests,
+                statistics,
+            )
+            for index in range(arguments.concurrency)
+        ]
+        for future in futures:
+            future.result()
+    duration = time.perf_counter() - start
+    print(
+        f"{'endpoint':<24} {'requests':>8} {'errors':>6} {'req/s':>7} {'p50 [ms]':>9} "
+        f"{'p90 [ms]':>9} {'p99 [ms]':>9} {'max [ms]':>9} {'db calls':>8} {'db [ms]':>8} "
+        f"{'influx [ms]':>11}"
+    )
+    for endpoint in endpoints:
+        latencies = sorted(statistics.latencies[endpoint])
+        count = len(latencies) or 1
+        db_calls, db_time = statistics.backends[(endpoint, "db")]
+        _, influx_time = statistics.backends[(endpoint, "influx")]
+        print(
+            f"{endpoint:<24} {len(latencies):>8} {statistics.errors[endpoint]:>6} "
+            f"{len(latencies) / duration:>7.1f} "
+            f"{percentile(latencies, 50) * 1000:>9.1f} {percentile(latencies, 90) * 1000:>9.1f} "
+            f"{percentile(latencies, 99) * 1000:>9.1f} {(latencies or [0])[-1] * 1000:>9.1f} "
+            f"{db_calls / count:>8.1f} {db_time / count:>8.1f} {influx_time / count:>11.1f}"
+        )
+    total = sum(len(latencies) for latencies in statistics.latencies.values())
+    print(
+        f"\n{total} requests in {duration:.1f} s, {total / duration:.1f} req/s, "
+        f"{sum(statistics.errors.values())} errors, concurrency {arguments.concurrency}"
+    )
+
+
+# main section of script
+if __name__ == "__main__":
+    # parses script arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-f",
+        "--fixture",
+        default=os.path.join(tempfile.gettempdir(), "central_loadtest.json"),
+        help="File with ids of seeded rooms and devices",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    seed_parser = commands.add_parser("seed")
+    seed_parser.add_argument("-r", "--rooms", type=int, default=20)
+    seed_parser.add_argument("-d", "--devices", type=int, default=200)
+    seed_parser.add_argument(
+        "-a",
+        "--air-devices",
+        type=int,
+        default=20,
+        help="Number of seeded devices tagged as air, with synthetic air data",
+    )
+    seed_parser.add_argument("-m", "--months", type=float, default=3)
+    seed_parser.add_argument(
+        "-i",
+        "--interval",
+        type=int,
+        default=300,
+        help="Interval of synthetic air points in seconds",
+    )
+    seed_parser.add_argument(
+        "-b", "--batch", type=int, default=5000, help="Points per InfluxDB write"
+    )
+    commands.add_parser("clean")
+    run_parser = commands.add_parser("run")
+    run_parser.add_argument("-u", "--url", default="http://localhost:8000")
+    run_parser.add_argument("-c", "--concurrency", type=int, default=8)
+    run_parser.add_argument(
+        "-t", "--duration", type=float, default=30, help="Duration of test in seconds"
+    )
+    run_parser.add_argument(
+        "-n",
+        "--requests",
+        type=int,
+        default=0,
+        help="Number of requests of each client, unlimited by default",
+    )
+    run_parser.add_argument(
+        "-e", "--endpoints", nargs="+", default=list(ENDPOINTS), metavar="ENDPOINT"
+    )
+    arguments = parser.parse_args()
+    {"seed": seed, "clean": clean, "run": run}[arguments.command](arguments)
@@ -0,0 +1,134 @@
+"""
+Metrics registry of central, exposed in Prometheus text format on /metrics endpoint.
+Central runs as single process, so metrics are kept in memory.
+Timings of backend calls made during request are also collected per request,
+they are reported in Server-Timing header by MetricsMiddleware.
+https://prometheus.io/docs/instrumenting/exposition_formats/
+"""
+
+import contextlib
+import contextvars
+import threading
+import time
+import typing
+
+from django.http import HttpResponse
+
+
+# upper bounds of duration histograms buckets, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# upper bounds of queries count histogram buckets
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+# timings of backend calls of current request, {backend: [calls, seconds]}
+timings = contextvars.ContextVar("timings", default=None)
+
+
+class Histogram:
+    """Histogram of observations, grouped by labels values."""
+
+    def __init__(
+        self, name: str, description: str, buckets: typing.Tuple = DURATION_BUCKETS
+    ) -> None:
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        # {labels: [bucket counts, sum, count]}, bucket counts are cumulative
+        self.samples = {}
+        REGISTRY.append(self)
+
+    def observe(self, value: float, **labels) -> None:
+        """Records single observation."""
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            sample = self.samples.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    sample[0][index] += 1
+            sample[1] += value
+            sample[2] += 1
+
+    def render(self) -> typing.List[str]:
+        """Returns lines of histogram in Prometheus text format."""
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self.lock:
+            samples = sorted(
+                (key, (list(counts), total, count))
+                for key, (counts, total, count) in self.samples.items()
+            )
+        for key, (counts, total, count) in samples:
+            labels = [f'{name}="{escape(value)}"' for name, value in key]
+            for bound, bucket in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{braces(labels, bound)} {bucket}")
+            lines.append(f"{self.name}_bucket{braces(labels, '+Inf')} {count}")
+            lines.append(f"{self.name}_sum{braces(labels)} {total}")
+            lines.append(f"{self.name}_count{braces(labels)} {count}")
+        return lines
+
+
+def escape(value: typing.Any) -> str:
+    """Escapes label value."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def braces(labels: typing.List[str], bound: typing.Any = None) -> str:
+    """Returns labels in braces, with bucket upper bound when given.
+    Empty string is returned when there are no labels."""
+    if bound is not None:
+        labels = labels + [f'le="{bound}"']
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def record(backend: str, seconds: float) -> None:
+    """Adds backend call to timings of current request, if there is one."""
+    current = timings.get()
+    if current is not None:
+        entry = current.setdefault(backend, [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+
+
+@contextlib.contextmanager
+def influx_query(name: str) -> typing.Iterator[None]:
+    """Measures single Flux query, including reading of its results."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        INFLUX_QUERY_DURATION.observe(duration, query=name)
+        record("influx", duration)
+
+
+def metrics(request) -> HttpResponse:
+    """Returns each metric in Prometheus text format."""
+    lines = [line for histogram in REGISTRY for line in histogram.render()]
+    return HttpResponse(
+        "\n".join(lines) + "\n", content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+# histograms exposed on metrics endpoint
+REGISTRY = []
+
+REQUEST_DURATION = Histogram(
+    "central_request_duration_seconds", "Duration of HTTP request by route and status."
+)
+REQUEST_QUERIES = Histogram(
+    "central_request_db_queries",
+    "Number of ORM queries of HTTP request by route.",
+    COUNT_BUCKETS,
+)
+REQUEST_QUERIES_DURATION = Histogram(
+    "central_request_db_duration_seconds",
+    "Time spent in ORM queries of HTTP request by route.",
+)
+INFLUX_QUERY_DURATION = Histogram(
+    "central_influx_query_duration_seconds",
+    "Duration of Flux query, including reading of its results.",
+)
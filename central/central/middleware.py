@@ -0,0 +1,117 @@
+"""
+Middlewares of central project.
+"""
+
+import cProfile
+import glob
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+from . import metrics
+
+
+class MetricsMiddleware:
+    """Records duration of each request by route and status code, with number and duration
+    of ORM queries. Durations of backend calls are also reported in Server-Timing header,
+    so slow part of request can be seen in browser developer tools."""
+
+    def __init__(self, get_response) -> None:
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = metrics.timings.set({})
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(self.__query):
+                response = self.get_response(request)
+            duration = time.perf_counter() - start
+            timings = metrics.timings.get()
+        finally:
+            metrics.timings.reset(token)
+        # route pattern instead of path, so each device does not create its own series
+        route = getattr(request.resolver_match, "route", None) or "unmatched"
+        queries, queries_duration = timings.get("db", (0, 0.0))
+        metrics.REQUEST_DURATION.observe(
+            duration, route=route, method=request.method, status=response.status_code
+        )
+        metrics.REQUEST_QUERIES.observe(queries, route=route)
+        metrics.REQUEST_QUERIES_DURATION.observe(queries_duration, route=route)
+        response["Server-Timing"] = ", ".join(
+            [
+                f'{backend};dur={seconds * 1000:.1f};desc="{calls} calls"'
+                for backend, (calls, seconds) in sorted(timings.items())
+            ]
+            + [f"total;dur={duration * 1000:.1f}"]
+        )
+        return response
+
+    @staticmethod
+    def __query(execute, sql, params, many, context):
+        """Measures single ORM query."""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            metrics.record("db", time.perf_counter() - start)
+
+
+class ProfilingMiddleware:
+    """Profiles with cProfile given fraction of requests to selected routes and writes
+    profiles as .pstats files, only the newest ones of each route are kept.
+    Enabled when PROFILING["RATE"] setting is greater than zero. Only one request
+    is profiled at a time, as profiler can not run in more threads at once."""
+
+    def __init__(self, get_response) -> None:
+        if settings.PROFILING["RATE"] <= 0:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.lock = threading.Lock()
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        profiler = getattr(request, "profiler", None)
+        if profiler is not None:
+            profiler.disable()
+            self.lock.release()
+            self.__save(profiler, request.resolver_match.route)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs) -> None:
+        """Starts profiler of sampled request, after its route has been resolved."""
+        if request.resolver_match.route not in settings.PROFILING["ROUTES"]:
+            return None
+        if random.random() >= settings.PROFILING["RATE"]:
+            return None
+        # request is not profiled when other one is being profiled
+        if not self.lock.acquire(blocking=False):
+            return None
+        request.profiler = cProfile.Profile()
+        request.profiler.enable()
+        return None
+
+    @staticmethod
+    def __save(profiler: cProfile.Profile, route: str) -> None:
+        """Writes profile and removes the oldest profiles of route above KEEP limit."""
+        try:
+            directory = settings.PROFILING["DIRECTORY"]
+            os.makedirs(directory, exist_ok=True)
+            prefix = re.sub(r"[^0-9A-Za-z]+", "_", route).strip("_")
+            profiler.dump_stats(
+                os.path.join(
+                    directory, f"{prefix}_{time.strftime('%Y%m%d_%H%M%S')}.pstats"
+                )
+            )
+            # timestamps in names keep profiles ordered by time
+            profiles = sorted(glob.glob(os.path.join(directory, f"{prefix}_*.pstats")))
+            for path in profiles[: -settings.PROFILING["KEEP"]]:
+                os.remove(path)
+        except Exception as e:
+            logging.error(f"Unable to save profile of {route}\n{e}")
@@ -32,7 +32,7 @@ SECRET_KEY = get_random_secret_key()
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
 
-ALLOWED_HOSTS = [os.environ.get("SERVER_IP"), "localhost", "boolhub"]
+ALLOWED_HOSTS = [os.environ.get("SERVER_IP"), "localhost", "boolhub", "central"]
 
 
 # Application definition
@@ -52,6 +52,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "central.middleware.MetricsMiddleware",
+    "central.middleware.ProfilingMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -100,7 +102,7 @@ DATABASES = {
         "PORT": 5432,
     },
     "influxdb": {
-        "URL": f"http://localhost:8086",
+        "URL": os.environ.get("INFLUX_URL", "http://localhost:8086"),
         "API_TOKEN": os.environ.get("INFLUX_TOKEN"),
         "ORGANIZATION": "boolhub",
     },
@@ -145,6 +147,20 @@ STATIC_URL = "/static/"
 STATIC_ROOT = os.path.join(BASE_DIR, "static")
 
 
+# Profiling of sampled requests, disabled when rate is zero
+
+PROFILING = {
+    # fraction of requests to profiled routes that are profiled
+    "RATE": float(os.environ.get("PROFILING_RATE", 0)),
+    "ROUTES": ["api/rooms/air", "api/devices/", "api/devices/<str:device_id>"],
+    # directory of profiles and number of the newest profiles kept of each route
+    "DIRECTORY": os.environ.get(
+        "PROFILING_DIRECTORY", os.path.join(BASE_DIR, "profiles")
+    ),
+    "KEEP": int(os.environ.get("PROFILING_KEEP", 20)),
+}
+
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
 
@@ -17,6 +17,8 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import include, path
 
+from . import metrics
+
 
 # main url patterns handler
 urlpatterns = [
@@ -28,4 +30,6 @@ urlpatterns = [
     path("api/devices/", include("devices.urls")),
     # administration panel
     path("admin/", admin.site.urls),
+    # prometheus metrics
+    path("metrics", view=metrics.metrics),
 ]
@@ -5,6 +5,7 @@ from influxdb_client.client.exceptions import InfluxDBError
 
 from .models import Room
 from .serializer import RoomSerializer
+from central.metrics import influx_query
 from django.conf import settings
 
 
@@ -39,20 +40,22 @@ def rooms_air(request) -> Response:
             air_data = {"aqi": None, "temperature": None, "humidity": None}
             # queries influxdb for most recent air data from current iteration room
             # query asks for data from last 1 hour in case air device has problem with fetching air data
-            air_query_result = influx_query_api.query_stream(
-                query=f"""
-                from(bucket: "air")
-                |> range(start: -1h)
-                |> filter(fn: (r) => r["_measurement"] == "air")
-                |> filter(fn: (r) => r["_field"] == "aqi" or r["_field"] == "humidity" or r["_field"] == "temperature")
-                |> filter(fn: (r) => r["room"] == "{room.get("name")}")
-                |> aggregateWindow(every: 5m, fn: last, createEmpty: false)
-                |> last()
-                """
-            )
-            # updates air data dictionary
-            for table in air_query_result:
-                air_data[table.get_field()] = table.get_value()
+            # results are streamed, so reading them is measured together with query
+            with influx_query("rooms_air"):
+                air_query_result = influx_query_api.query_stream(
+                    query=f"""
+                    from(bucket: "air")
+                    |> range(start: -1h)
+                    |> filter(fn: (r) => r["_measurement"] == "air")
+                    |> filter(fn: (r) => r["_field"] == "aqi" or r["_field"] == "humidity" or r["_field"] == "temperature")
+                    |> filter(fn: (r) => r["room"] == "{room.get("name")}")
+                    |> aggregateWindow(every: 5m, fn: last, createEmpty: false)
+                    |> last()
+                    """
+                )
+                # updates air data dictionary
+                for table in air_query_result:
+                    air_data[table.get_field()] = table.get_value()
             # combines roum data with air data
             results.append({**room, "airData": air_data})
     except InfluxDBError as e:
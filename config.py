@@ -1,5 +1,8 @@
-import os
+import atexit
 import logging
+import logging.handlers
+import os
+import queue
 
 from dotenv import load_dotenv
 
@@ -16,20 +19,50 @@ VARIABLES_PATH = os.path.join(BASE_DIR, ".env")
 # absolute path to log file
 LOG_FILE = os.path.join(BASE_DIR, "scripts.log")
 
+# loading environmental variables
+load_dotenv(VARIABLES_PATH)
+
 # logging configuration
+LOGGING = {
+    # level of root logger and levels of modules, given as "module=LEVEL" pairs separated by commas
+    "LEVEL": os.environ.get("LOG_LEVEL", "DEBUG"),
+    "LEVELS": os.environ.get("LOG_LEVELS", ""),
+    # log file is rotated when it exceeds given size, with given number of rotated files kept
+    "MAX_BYTES": int(os.environ.get("LOG_MAX_BYTES", 10 * 1024 * 1024)),
+    "BACKUP_COUNT": int(os.environ.get("LOG_BACKUP_COUNT", 5)),
+}
+
+# records are put on queue and written to console and log file by listener thread,
+# so scripts are not blocked by writing them
+log_handlers = [
+    logging.StreamHandler(),
+    logging.handlers.RotatingFileHandler(
+        LOG_FILE,
+        maxBytes=LOGGING["MAX_BYTES"],
+        backupCount=LOGGING["BACKUP_COUNT"],
+    ),
+]
+for log_handler in log_handlers:
+    log_handler.setFormatter(
+        logging.Formatter("%(asctime)s | %(levelname)s | %(message)s")
+    )
+log_queue = queue.SimpleQueue()
+log_listener = logging.handlers.QueueListener(log_queue, *log_handlers)
+log_listener.start()
+atexit.register(log_listener.stop)
 logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s | %(levelname)s | %(message)s",
-    handlers=[logging.StreamHandler(), logging.FileHandler(LOG_FILE)],
+    level=LOGGING["LEVEL"].upper(),
+    format="%(message)s",
+    handlers=[logging.handlers.QueueHandler(log_queue)],
 )
-
-# loading environmental variables
-load_dotenv(VARIABLES_PATH)
+for log_level in filter(None, LOGGING["LEVELS"].split(",")):
+    name, _, level = log_level.partition("=")
+    logging.getLogger(name.strip()).setLevel(level.strip().upper())
 
 # databases configuration
 DATABASE = {
     "INFLUX": {
-        "URL": f"http://localhost:8086",
+        "URL": os.environ.get("INFLUX_URL", "http://localhost:8086"),
         "API_TOKEN": os.environ.get("INFLUX_TOKEN"),
         "ORGANIZATION": "boolhub",
     },
@@ -43,4 +76,45 @@ DATABASE = {
 }
 
 # backups configuration
-BACKUPS = {"PATH": os.environ.get("BOOLHUB_BACKUPS_PATH")}
+BACKUPS = {
+    "PATH": os.environ.get("BOOLHUB_BACKUPS_PATH"),
+    # "zip", "zstd" (streamed tar archive compressed with zstd) or "store" (incremental snapshot)
+    "FORMAT": os.environ.get("BOOLHUB_BACKUPS_FORMAT", "zip"),
+    # compression level of zstd, it runs one worker thread per core
+    "ZSTD_LEVEL": int(os.environ.get("BOOLHUB_BACKUPS_ZSTD_LEVEL", 3)),
+    # size of parts PostgreSQL dump is split into, each part is kept in memory while archived
+    "PART_SIZE": int(os.environ.get("BOOLHUB_BACKUPS_PART_SIZE", 32 * 1024 * 1024)),
+    # directory of chunk store of incremental backups
+    "STORE": os.environ.get("BOOLHUB_BACKUPS_STORE")
+    or os.path.join(os.environ.get("BOOLHUB_BACKUPS_PATH", ""), "store"),
+    # bounds of chunk size in bytes and mask of line checksum, that places boundary
+    # after one of 512 lines on average
+    "MIN_CHUNK": 16 * 1024,
+    "MAX_CHUNK": 1024 * 1024,
+    "CHUNK_MASK": 511,
+    "ZLIB_LEVEL": 6,
+    # number of threads hashing and compressing chunks
+    "WORKERS": os.cpu_count() or 1,
+    # number of the newest daily, weekly and monthly snapshots kept in chunk store
+    "KEEP_DAILY": int(os.environ.get("BOOLHUB_BACKUPS_KEEP_DAILY", 7)),
+    "KEEP_WEEKLY": int(os.environ.get("BOOLHUB_BACKUPS_KEEP_WEEKLY", 4)),
+    "KEEP_MONTHLY": int(os.environ.get("BOOLHUB_BACKUPS_KEEP_MONTHLY", 12)),
+    # number of parallel jobs of pg_restore, used when dump has been written to file
+    "RESTORE_JOBS": int(
+        os.environ.get("BOOLHUB_BACKUPS_RESTORE_JOBS", min(os.cpu_count() or 1, 4))
+    ),
+    # InfluxDB increment starts this many seconds before the end of previous one,
+    # so points written late by gatherers are not missed
+    "INFLUX_OVERLAP": int(os.environ.get("BOOLHUB_BACKUPS_INFLUX_OVERLAP", 3600)),
+}
+
+# containers management configuration
+DOCKER = {
+    "COMPOSE_FILE": os.path.join(BASE_DIR, "docker-compose.yml"),
+    # address of central REST API, its readiness is probed over HTTP
+    "CENTRAL_URL": os.environ.get("CENTRAL_URL", "http://localhost:80"),
+    # seconds to wait until started service is ready, timeout of single probe and pause between probes
+    "READY_TIMEOUT": int(os.environ.get("BOOLHUB_DOCKER_READY_TIMEOUT", 180)),
+    "PROBE_TIMEOUT": 5,
+    "PROBE_INTERVAL": 1,
+}
@@ -4,4 +4,13 @@ CREATE TABLE IF NOT EXISTS unknown_devices (
     mac_address varchar(250) NOT NULL,
     last_time varchar(250) NOT NULL,
     PRIMARY KEY (mac_address)
-);
\ No newline at end of file
+);
+CREATE TABLE IF NOT EXISTS poll_tasks (
+    mac_address varchar(250) NOT NULL,
+    capability varchar(250) NOT NULL,
+    due_time timestamptz NOT NULL DEFAULT now(),
+    node varchar(250),
+    lease_until timestamptz,
+    attempts integer NOT NULL DEFAULT 0,
+    PRIMARY KEY (mac_address)
+);
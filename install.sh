@@ -23,6 +23,8 @@ apt-get install openssh-client
 
 printf "\n\nStep 2. Net Tools Installation\n"
 apt-get install net-tools
+# used by archivist for compression of streamed backups
+apt-get install zstd -y
 
 
 
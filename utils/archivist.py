@@ -1,20 +1,374 @@
 """
 Script used for performing backups, recovers and managing archives.
+Backup dumps InfluxDB and PostgreSQL concurrently, each component is archived as soon as its dump
+is finished, so backup takes roughly as long as the slowest dump. Duration of each step is reported.
+Archive is written in one of formats:
+- "zip", dumps are written to backup directory and zipped.
+- "zstd", dumps are streamed straight into tar archive compressed by 'zstd -T0', that uses each core.
+  PostgreSQL dump is split into parts of PART_SIZE bytes, InfluxDB backup is streamed out of its container.
+  Manifest with size and SHA-256 checksum of each member is written as the last member.
+- "store", incremental snapshot in deduplicated chunk store (see store.py). PostgreSQL is dumped
+  uncompressed and deduplicated, InfluxDB points written since previous snapshot are exported
+  over HTTP API as line protocol. Any kept snapshot can be restored, snapshots are pruned
+  by daily, weekly and monthly retention.
 """
 
 import argparse
 import asyncio
+import csv
 import datetime
+import hashlib
+import io
+import json
 import logging
 import os
+import queue
 import shutil
+import subprocess
 import sys
-import traceback
+import tarfile
+import threading
+import time
+import typing
+import urllib.parse
+import urllib.request
+import zipfile
 from datetime import date
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
 
 import config
+from utils import docker
+from utils.store import NAME_FORMAT, ChunkStore, prune
+
+# logger of this module
+logger = logging.getLogger("archivist")
+
+
+def measured(
+    step: str, timings: typing.Dict[str, float], function: typing.Callable, *args
+) -> typing.Any:
+    """Runs step of backup or recovery and records its duration.
+    Returns result of step, or None if it failed."""
+    logger.info("ARCHIVIST | %s started", step)
+    start = time.monotonic()
+    try:
+        result = function(*args)
+    except Exception:
+        logger.exception("ARCHIVIST | %s", step.upper())
+        return None
+    timings[step] = time.monotonic() - start
+    logger.info("ARCHIVIST | %s finished in %.1fs", step, timings[step])
+    return result
+
+
+class InfluxAPI:
+    """Reads and writes points of InfluxDB buckets over HTTP API, as line protocol."""
+
+    # columns of Flux result, that are not tags
+    COLUMNS = {
+        "",
+        "result",
+        "table",
+        "_start",
+        "_stop",
+        "_time",
+        "_value",
+        "_field",
+        "_measurement",
+    }
+
+    # escaping of measurement, tag keys, tag values, field keys and string field values
+    NAME_ESCAPES = str.maketrans({",": "\\,", " ": "\\ "})
+    KEY_ESCAPES = str.maketrans({",": "\\,", "=": "\\=", " ": "\\ "})
+    STRING_ESCAPES = str.maketrans({'"': '\\"', "\\": "\\\\"})
+
+    # number of lines written in single request
+    BATCH_SIZE = 5000
+
+    @staticmethod
+    def request(
+        path: str, data: bytes = None, content_type: str = "application/json", **params
+    ) -> typing.Any:
+        """Sends request to API and returns its response."""
+        params.setdefault("org", config.DATABASE["INFLUX"]["ORGANIZATION"])
+        request = urllib.request.Request(
+            f"{config.DATABASE['INFLUX']['URL']}{path}?{urllib.parse.urlencode(params)}",
+            data=data,
+            headers={
+                "Authorization": f"Token {config.DATABASE['INFLUX']['API_TOKEN']}",
+                "Content-Type": content_type,
+                "Accept": "application/csv"
+                if path.endswith("query")
+                else "application/json",
+            },
+        )
+        return urllib.request.urlopen(request, timeout=300)
+
+    @staticmethod
+    def buckets() -> typing.List[str]:
+        """Returns names of buckets of organization, except system ones."""
+        with InfluxAPI.request("/api/v2/buckets", limit=100) as response:
+            buckets = json.load(response)["buckets"]
+        return sorted(
+            bucket["name"] for bucket in buckets if not bucket["name"].startswith("_")
+        )
+
+    @staticmethod
+    def create_bucket(name: str) -> None:
+        """Creates bucket with infinite retention, unless it already exists."""
+        with InfluxAPI.request("/api/v2/buckets", name=name) as response:
+            if json.load(response)["buckets"]:
+                return
+        with InfluxAPI.request("/api/v2/orgs") as response:
+            organization = json.load(response)["orgs"][0]["id"]
+        body = {"orgID": organization, "name": name, "retentionRules": []}
+        InfluxAPI.request("/api/v2/buckets", json.dumps(body).encode()).close()
+
+    @staticmethod
+    def export(bucket: str, start: str, stop: str) -> typing.Iterator[bytes]:
+        """Returns points of bucket written between given RFC3339 times,
+        as blocks of line protocol."""
+        query = {
+            "query": f'from(bucket: "{bucket}") |> range(start: {start}, stop: {stop})',
+            "type": "flux",
+            "dialect": {"annotations": ["datatype"], "header": True},
+        }
+        with InfluxAPI.request("/api/v2/query", json.dumps(query).encode()) as response:
+            rows = csv.reader(io.TextIOWrapper(response, encoding="utf-8", newline=""))
+            lines = []
+            for line in InfluxAPI.line_protocol(rows):
+                lines.append(line)
+                if len(lines) >= InfluxAPI.BATCH_SIZE:
+                    yield "".join(lines).encode()
+                    lines = []
+            if lines:
+                yield "".join(lines).encode()
+
+    @staticmethod
+    def line_protocol(rows: typing.Iterable[typing.List[str]]) -> typing.Iterator[str]:
+        """Converts rows of annotated Flux CSV into lines of line protocol.
+        Each table of result is preceded by its datatypes and header."""
+        types, header = [], None
+        for row in rows:
+            if not row or not any(row):
+                continue
+            if row[0] == "#datatype":
+                types, header = row, None
+                continue
+            if header is None:
+                header = {name: index for index, name in enumerate(row)}
+                if "error" in header:
+                    raise ValueError(f"Query failed: {next(iter(rows), row)}")
+                tags = sorted(
+                    (name.translate(InfluxAPI.KEY_ESCAPES), index)
+                    for name, index in header.items()
+                    if name not in InfluxAPI.COLUMNS
+                )
+                value_index = header["_value"]
+                kind = types[value_index] if types else "string"
+                continue
+            series = row[header["_measurement"]].translate(
+                InfluxAPI.NAME_ESCAPES
+            ) + "".join(
+                f",{key}={row[index].translate(InfluxAPI.KEY_ESCAPES)}"
+                for key, index in tags
+                if row[index]
+            )
+            value = row[value_index]
+            if kind == "long":
+                value = f"{value}i"
+            elif kind == "unsignedLong":
+                value = f"{value}u"
+            elif kind not in ("double", "boolean"):
+                value = f'"{value.translate(InfluxAPI.STRING_ESCAPES)}"'
+            yield (
+                f"{series} {row[header['_field']].translate(InfluxAPI.KEY_ESCAPES)}={value} "
+                f"{InfluxAPI.timestamp(row[header['_time']])}\n"
+            )
+
+    @staticmethod
+    def count(bucket: str) -> int:
+        """Returns number of field values stored in bucket."""
+        query = {
+            "query": f'from(bucket: "{bucket}") |> range(start: 0) |> count() '
+            '|> group() |> sum() |> keep(columns: ["_value"])',
+            "type": "flux",
+            "dialect": {"header": True},
+        }
+        with InfluxAPI.request("/api/v2/query", json.dumps(query).encode()) as response:
+            rows = list(csv.reader(io.TextIOWrapper(response, encoding="utf-8")))
+        header = rows[0] if rows else []
+        return sum(int(row[header.index("_value")]) for row in rows[1:] if any(row))
+
+    @staticmethod
+    def timestamp(text: str) -> int:
+        """Returns nanoseconds since epoch of RFC3339 time, i.e. '2023-01-01T10:00:00.123456789Z'."""
+        seconds, _, fraction = text.rstrip("Z").partition(".")
+        moment = datetime.datetime.fromisoformat(seconds).replace(
+            tzinfo=datetime.timezone.utc
+        )
+        return int(moment.timestamp()) * 1_000_000_000 + int(fraction.ljust(9, "0")[:9])
+
+    @staticmethod
+    def write(bucket: str, blocks: typing.Iterable[bytes]) -> int:
+        """Writes line protocol given as blocks of bytes to bucket, lines can be split
+        between blocks. Returns number of written points."""
+        InfluxAPI.create_bucket(bucket)
+        written, remainder, lines = 0, b"", []
+
+        def send() -> None:
+            InfluxAPI.request(
+                "/api/v2/write",
+                b"".join(lines),
+                "text/plain; charset=utf-8",
+                bucket=bucket,
+                precision="ns",
+            ).close()
+
+        for block in blocks:
+            block = remainder + block
+            end = block.rfind(b"\n") + 1
+            remainder = block[end:]
+            for line in block[:end].splitlines(keepends=True):
+                lines.append(line)
+                if len(lines) >= InfluxAPI.BATCH_SIZE:
+                    send()
+                    written += len(lines)
+                    lines = []
+        if remainder:
+            lines.append(remainder)
+        if lines:
+            send()
+            written += len(lines)
+        return written
+
+
+class ProcessSink:
+    """Writes data to standard input of process in background thread, so reader of archive
+    is not blocked by slow consumer, as long as queue of blocks is not full."""
+
+    # maximal number of queued writes
+    QUEUE_SIZE = 64
+
+    def __init__(self, command: typing.List[str]) -> None:
+        self.command = command
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+        self.queue = queue.Queue(self.QUEUE_SIZE)
+        self.broken = False
+        self.thread = threading.Thread(target=self.__feed, daemon=True)
+        self.thread.start()
+
+    def write(self, data: bytes) -> int:
+        self.queue.put(bytes(data))
+        return len(data)
+
+    def close(self) -> None:
+        """Closes standard input of process and waits for it to exit.
+        Raises CalledProcessError if process has failed."""
+        self.queue.put(None)
+        self.thread.join()
+        if self.process.wait() or self.broken:
+            raise subprocess.CalledProcessError(self.process.returncode, self.command)
+
+    def __feed(self) -> None:
+        while True:
+            data = self.queue.get()
+            if data is None:
+                break
+            # data is still taken from queue after process exited, so reader is never blocked
+            if not self.broken:
+                try:
+                    self.process.stdin.write(data)
+                except (BrokenPipeError, ValueError):
+                    self.broken = True
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            self.broken = True
+
+
+class HashingReader:
+    """File-like object, that computes SHA-256 checksum of data read from wrapped file."""
+
+    def __init__(self, file: typing.BinaryIO) -> None:
+        self.file = file
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.file.read(size)
+        self.sha256.update(data)
+        self.size += len(data)
+        return data
+
+
+class StreamArchive:
+    """Tar archive compressed on the fly by 'zstd' process, using each core.
+    Members can be added by several threads, each member is written as a whole.
+    Size and checksum of each member are recorded and written in manifest, when archive is closed.
+    Archive is written under temporary name and renamed when it is closed successfully.
+    """
+
+    # name of manifest member
+    MANIFEST = "manifest.json"
+
+    def __init__(self, path: str, level: int = config.BACKUPS["ZSTD_LEVEL"]) -> None:
+        self.path = path
+        self.file = open(f"{path}.partial", "wb")
+        self.process = subprocess.Popen(
+            ["zstd", "-T0", f"-{level}", "-q", "-c"],
+            stdin=subprocess.PIPE,
+            stdout=self.file,
+        )
+        self.tar = tarfile.open(fileobj=self.process.stdin, mode="w|")
+        self.lock = threading.Lock()
+        # {member name: {"size": int, "sha256": str}}
+        self.members = {}
+
+    def add(self, name: str, data: bytes) -> None:
+        """Adds member of given content."""
+        self.add_stream(name, io.BytesIO(data), len(data))
+
+    def add_stream(self, name: str, file: typing.BinaryIO, size: int) -> None:
+        """Adds member of given size, read from file."""
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = int(time.time())
+        reader = HashingReader(file)
+        with self.lock:
+            self.tar.addfile(info, reader)
+        if reader.size != size:
+            raise EOFError(f"Member {name} ended after {reader.size} of {size} bytes")
+        self.members[name] = {"size": size, "sha256": reader.sha256.hexdigest()}
+
+    def close(self, manifest: typing.Dict) -> bool:
+        """Writes manifest, finishes compression and renames archive.
+        Returns True if operation succeed, otherwise returns False."""
+        try:
+            self.add(
+                self.MANIFEST,
+                json.dumps({**manifest, "members": self.members}, indent=2).encode(),
+            )
+            self.tar.close()
+            self.process.stdin.close()
+            if self.process.wait():
+                raise subprocess.CalledProcessError(self.process.returncode, "zstd")
+        except Exception:
+            logger.exception("ARCHIVIST | BACKUP | ARCHIVE")
+            self.abort()
+            return False
+        self.file.close()
+        os.replace(f"{self.path}.partial", self.path)
+        return True
+
+    def abort(self) -> None:
+        """Stops compression and removes incomplete archive."""
+        self.process.kill()
+        self.process.wait()
+        self.file.close()
+        if os.path.exists(f"{self.path}.partial"):
+            os.remove(f"{self.path}.partial")
 
 
 class Backup:
@@ -25,8 +379,9 @@ class Backup:
         """Makes backup of each InfluxDB bucket.
         Returns True if operation succeed, otherwise returns False.
         """
+        output, errors = b"", b""
         try:
-            logging.info("InfluxDB backup process started!")
+            logger.info("InfluxDB backup process started!")
             # command that will be executed inside docker container
             command = f"""
             docker exec influxdb influx backup \
@@ -40,22 +395,29 @@ class Backup:
                 stderr=asyncio.subprocess.PIPE,
             )
             output, errors = await process.communicate()
+            if process.returncode:
+                raise subprocess.CalledProcessError(process.returncode, "influx backup")
         except Exception:
-            logging.error(f"ARCHIVIST | BACKUP | INFLUX\n{traceback.format_exc()}")
+            logger.exception("ARCHIVIST | BACKUP | INFLUX")
             return False
         else:
-            logging.info(
-                f"{output.decode('utf-8')}InfluxDB backup process has been completed successfully!"
+            logger.info(
+                "%sInfluxDB backup process has been completed successfully!",
+                output.decode("utf-8"),
             )
             return True
         finally:
-            logging.debug(output)
-            logging.debug(errors)
+            logger.debug(output)
+            logger.debug(errors)
 
     @staticmethod
     async def postgresql(backup_directory: str) -> bool:
+        """Makes dump of PostgreSQL database.
+        Returns True if operation succeed, otherwise returns False.
+        """
+        output, errors = b"", b""
         try:
-            logging.info("PostgreSQL backup process started!")
+            logger.info("PostgreSQL backup process started!")
             # command that will be executed inside docker container
             command = f"""
             docker exec postgresql \
@@ -70,39 +432,375 @@ class Backup:
                 stderr=asyncio.subprocess.PIPE,
             )
             output, errors = await process.communicate()
+            if process.returncode:
+                raise subprocess.CalledProcessError(process.returncode, "pg_dump")
         except Exception:
-            logging.error(f"ARCHIVIST | BACKUP | POSTGRESQL\n{traceback.format_exc()}")
+            logger.exception("ARCHIVIST | BACKUP | POSTGRESQL")
             return False
         else:
-            logging.info(
-                f"{output.decode('utf-8')}PostgreSQL backup process has been completed successfully!"
+            logger.info(
+                "%sPostgreSQL backup process has been completed successfully!",
+                output.decode("utf-8"),
             )
             return True
         finally:
-            logging.debug(output)
-            logging.debug(errors)
+            logger.debug(output)
+            logger.debug(errors)
 
     @staticmethod
-    def archive_directory(backup_directory: str) -> bool:
-        """Archive backup directory defined in backup_directory argument.
-        Archive name is based on current date in 'YEAR_MONTH_DAY' format.
+    def archive_component(
+        backup_directory: str, component: str, archive: zipfile.ZipFile
+    ) -> bool:
+        """Adds dump of single component (database) to backup archive.
+        InfluxDB shards are already gzipped, so they are stored without recompression.
+        Returns True if operation succeed, otherwise returns False.
         """
         try:
-            # make archive using shutil library
-            shutil.make_archive(
-                os.path.join(config.BACKUPS["PATH"], date.today().strftime("%Y_%m_%d")),
-                "zip",
-                root_dir=backup_directory,
-            )
+            for root, _, files in os.walk(os.path.join(backup_directory, component)):
+                for name in sorted(files):
+                    path = os.path.join(root, name)
+                    archive.write(
+                        path,
+                        os.path.relpath(path, backup_directory),
+                        zipfile.ZIP_STORED
+                        if name.endswith(".gz")
+                        else zipfile.ZIP_DEFLATED,
+                    )
         except Exception:
-            logging.error(f"ARCHIVIST\n{traceback.format_exc()}")
+            logger.exception("ARCHIVIST | BACKUP | %s", component.upper())
             return False
         else:
-            # clear backup directory after successful backup
-            if arguments.clean:
-                shutil.rmtree(backup_directory)
             return True
 
+    @staticmethod
+    async def component(
+        component: str,
+        dump: typing.Callable[[str], typing.Awaitable[bool]],
+        backup_directory: str,
+        archive: zipfile.ZipFile,
+        lock: asyncio.Lock,
+        timings: typing.Dict[str, float],
+    ) -> bool:
+        """Dumps single component and archives it as soon as dump is finished.
+        Archive is written by one component at a time, in thread, so event loop
+        keeps waiting for the other dump. Returns True if operation succeed, otherwise returns False.
+        """
+        start = time.monotonic()
+        if not await dump(backup_directory):
+            return False
+        timings[f"{component} dump"] = time.monotonic() - start
+        logger.info(
+            "ARCHIVIST | BACKUP | %s dumped in %.1fs",
+            component,
+            timings[f"{component} dump"],
+        )
+        async with lock:
+            start = time.monotonic()
+            archived = await asyncio.get_running_loop().run_in_executor(
+                None, Backup.archive_component, backup_directory, component, archive
+            )
+        timings[f"{component} archive"] = time.monotonic() - start
+        logger.info(
+            "ARCHIVIST | BACKUP | %s archived in %.1fs",
+            component,
+            timings[f"{component} archive"],
+        )
+        return archived
+
+    @staticmethod
+    async def run(backup_directory: str, clean: bool = True) -> bool:
+        """Makes backup of each database into archive named by current date in 'YEAR_MONTH_DAY' format.
+        Archive is written under temporary name and renamed when each component succeeded.
+        Returns True if operation succeed, otherwise returns False.
+        """
+        start = time.monotonic()
+        timings = {}
+        archive_path = f"{backup_directory}.zip"
+        with zipfile.ZipFile(f"{archive_path}.partial", "w") as archive:
+            lock = asyncio.Lock()
+            results = await asyncio.gather(
+                Backup.component(
+                    "influxdb",
+                    Backup.influx,
+                    backup_directory,
+                    archive,
+                    lock,
+                    timings,
+                ),
+                Backup.component(
+                    "postgresql",
+                    Backup.postgresql,
+                    backup_directory,
+                    archive,
+                    lock,
+                    timings,
+                ),
+            )
+        timings["total"] = time.monotonic() - start
+        logger.info(
+            "ARCHIVIST | BACKUP | Timing | %s",
+            ", ".join(f"{step} {duration:.1f}s" for step, duration in timings.items()),
+        )
+        if not all(results):
+            # dumps are kept for inspection, incomplete archive is not
+            os.remove(f"{archive_path}.partial")
+            logger.error("ARCHIVIST | BACKUP | Backup failed, archive not created")
+            return False
+        os.replace(f"{archive_path}.partial", archive_path)
+        # clear backup directory after successful backup
+        if clean:
+            shutil.rmtree(backup_directory)
+        return True
+
+    @staticmethod
+    def stream_postgresql(archive: StreamArchive) -> typing.List[str]:
+        """Streams dump of PostgreSQL database into archive, in parts of PART_SIZE bytes.
+        Returns names of parts."""
+        process = subprocess.Popen(
+            [
+                "docker",
+                "exec",
+                "postgresql",
+                "pg_dump",
+                "--clean",
+                "-Fc",
+                "--username",
+                config.DATABASE["POSTGRE"]["USER"],
+                config.DATABASE["POSTGRE"]["NAME"],
+            ],
+            stdout=subprocess.PIPE,
+        )
+        parts = []
+        try:
+            while True:
+                data = process.stdout.read(config.BACKUPS["PART_SIZE"])
+                if not data and parts:
+                    break
+                parts.append(f"postgresql/postgres_dump.dump.{len(parts):04d}")
+                archive.add(parts[-1], data)
+                # part shorter than requested size is the last one
+                if len(data) < config.BACKUPS["PART_SIZE"]:
+                    break
+        finally:
+            process.stdout.close()
+            if process.wait():
+                raise subprocess.CalledProcessError(process.returncode, "pg_dump")
+        return parts
+
+    @staticmethod
+    def stream_influx(archive: StreamArchive, name: str) -> typing.List[str]:
+        """Makes backup of each InfluxDB bucket in temporary directory of its container
+        and streams it into archive. Returns names of members."""
+        # backup is written inside container, so no directory is shared with host
+        directory = f"/tmp/archivist_{name}"
+        members = []
+        try:
+            subprocess.run(
+                [
+                    "docker",
+                    "exec",
+                    "influxdb",
+                    "influx",
+                    "backup",
+                    "-t",
+                    config.DATABASE["INFLUX"]["API_TOKEN"],
+                    directory,
+                ],
+                check=True,
+                stdout=subprocess.DEVNULL,
+            )
+            process = subprocess.Popen(
+                ["docker", "exec", "influxdb", "tar", "-cf", "-", "-C", directory, "."],
+                stdout=subprocess.PIPE,
+            )
+            try:
+                with tarfile.open(fileobj=process.stdout, mode="r|") as source:
+                    for member in source:
+                        if not member.isfile():
+                            continue
+                        members.append(f"influxdb/{os.path.normpath(member.name)}")
+                        archive.add_stream(
+                            members[-1], source.extractfile(member), member.size
+                        )
+            finally:
+                process.stdout.close()
+                if process.wait():
+                    raise subprocess.CalledProcessError(process.returncode, "tar")
+        finally:
+            subprocess.run(
+                ["docker", "exec", "influxdb", "rm", "-rf", directory],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        return members
+
+    @staticmethod
+    async def stream(name: str = None) -> bool:
+        """Streams backup of each database into '{name}.tar.zst' archive, where name
+        is based on current date in 'YEAR_MONTH_DAY' format by default. Both databases
+        are streamed concurrently, without temporary directories on host.
+        Returns True if operation succeed, otherwise returns False.
+        """
+        name = name or date.today().strftime("%Y_%m_%d")
+        os.makedirs(config.BACKUPS["PATH"], exist_ok=True)
+        archive = StreamArchive(os.path.join(config.BACKUPS["PATH"], f"{name}.tar.zst"))
+        loop = asyncio.get_running_loop()
+        start = time.monotonic()
+        timings = {}
+        influxdb, postgresql = await asyncio.gather(
+            loop.run_in_executor(
+                None,
+                measured,
+                "influxdb stream",
+                timings,
+                Backup.stream_influx,
+                archive,
+                name,
+            ),
+            loop.run_in_executor(
+                None,
+                measured,
+                "postgresql stream",
+                timings,
+                Backup.stream_postgresql,
+                archive,
+            ),
+        )
+        if influxdb is None or postgresql is None:
+            archive.abort()
+            logger.error("ARCHIVIST | BACKUP | Backup failed, archive not created")
+            return False
+        timings["total"] = time.monotonic() - start
+        closed = archive.close(
+            {
+                "version": 1,
+                "name": name,
+                "created": datetime.datetime.now().isoformat(timespec="seconds"),
+                "components": {"influxdb": influxdb, "postgresql": postgresql},
+                "timings": timings,
+            }
+        )
+        logger.info(
+            "ARCHIVIST | BACKUP | Timing | %s",
+            ", ".join(f"{step} {duration:.1f}s" for step, duration in timings.items()),
+        )
+        return closed
+
+    @staticmethod
+    def store_postgresql(chunk_store: ChunkStore) -> typing.Dict[str, typing.Any]:
+        """Stores dump of PostgreSQL database in chunk store. Dump is not compressed,
+        so data of unchanged tables is deduplicated. Returns chunks of dump."""
+        process = subprocess.Popen(
+            [
+                "docker",
+                "exec",
+                "postgresql",
+                "pg_dump",
+                "--clean",
+                "--if-exists",
+                "-Fc",
+                "-Z0",
+                "--username",
+                config.DATABASE["POSTGRE"]["USER"],
+                config.DATABASE["POSTGRE"]["NAME"],
+            ],
+            stdout=subprocess.PIPE,
+        )
+        try:
+            stored = chunk_store.write(
+                iter(lambda: process.stdout.read(config.BACKUPS["MAX_CHUNK"]), b"")
+            )
+        finally:
+            process.stdout.close()
+            if process.wait():
+                raise subprocess.CalledProcessError(process.returncode, "pg_dump")
+        return stored
+
+    @staticmethod
+    def store_influx(
+        chunk_store: ChunkStore, previous: typing.Optional[typing.Dict], stop: str
+    ) -> typing.Dict[str, typing.List[typing.Dict]]:
+        """Stores points of each bucket written since previous snapshot (with overlap)
+        in chunk store. Returns increment of each bucket."""
+        increments = {}
+        for bucket in InfluxAPI.buckets():
+            start = "1970-01-01T00:00:00Z"
+            if previous and previous["influxdb"].get(bucket):
+                start = (
+                    datetime.datetime.fromisoformat(
+                        previous["influxdb"][bucket][-1]["stop"].rstrip("Z")
+                    )
+                    - datetime.timedelta(seconds=config.BACKUPS["INFLUX_OVERLAP"])
+                ).isoformat() + "Z"
+            increment = chunk_store.write(InfluxAPI.export(bucket, start, stop))
+            increments[bucket] = [{"start": start, "stop": stop, **increment}]
+        return increments
+
+    @staticmethod
+    async def incremental(name: str = None) -> bool:
+        """Makes snapshot of both databases in chunk store, named by current time.
+        PostgreSQL is dumped whole and deduplicated, only points of InfluxDB written since
+        previous snapshot are exported. Snapshots outside of retention policy are removed afterwards.
+        Returns True if operation succeed, otherwise returns False.
+        """
+        name = name or datetime.datetime.now().strftime(NAME_FORMAT)
+        stop = datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
+        loop = asyncio.get_running_loop()
+        start = time.monotonic()
+        timings = {}
+        with ChunkStore() as chunk_store:
+            snapshots = chunk_store.snapshots()
+            previous = chunk_store.load(snapshots[-1]) if snapshots else None
+            postgresql, influxdb = await asyncio.gather(
+                loop.run_in_executor(
+                    None,
+                    measured,
+                    "postgresql snapshot",
+                    timings,
+                    Backup.store_postgresql,
+                    chunk_store,
+                ),
+                loop.run_in_executor(
+                    None,
+                    measured,
+                    "influxdb snapshot",
+                    timings,
+                    Backup.store_influx,
+                    chunk_store,
+                    previous,
+                    stop,
+                ),
+            )
+            if postgresql is None or influxdb is None:
+                # chunks stored by failed snapshot are removed by the next pruning
+                logger.error("ARCHIVIST | BACKUP | Snapshot %s failed", name)
+                return False
+            timings["total"] = time.monotonic() - start
+            chunk_store.save(
+                {
+                    "version": 1,
+                    "name": name,
+                    "created": datetime.datetime.now().isoformat(timespec="seconds"),
+                    "postgresql": postgresql,
+                    "influxdb": influxdb,
+                    "timings": timings,
+                }
+            )
+            increments = [item for items in influxdb.values() for item in items]
+            size = postgresql["size"] + sum(item["size"] for item in increments)
+            stored = postgresql["stored"] + sum(item["stored"] for item in increments)
+            logger.info(
+                "ARCHIVIST | BACKUP | Snapshot %s | %.1f MB read, %.1f MB stored | %s",
+                name,
+                size / 1e6,
+                stored / 1e6,
+                ", ".join(
+                    f"{step} {duration:.1f}s" for step, duration in timings.items()
+                ),
+            )
+            prune(chunk_store)
+        return True
+
     @staticmethod
     def prepare_directory(overwrite: bool = False) -> str:
         """Creates backup subdirectory for current scheduled backup.
@@ -140,7 +838,7 @@ class Recovery:
     async def influx() -> bool:
         """Recovers whole Influx database. Returns True if operation succeed, otherwise returns False."""
         try:
-            logging.info("InfluxDB recovery process started!")
+            logger.info("InfluxDB recovery process started!")
             # command that will be executed inside docker container
             command = f"""
             docker exec influxdb influx restore \
@@ -156,22 +854,23 @@ class Recovery:
             )
             output, errors = await process.communicate()
         except Exception:
-            logging.error(f"ARCHIVIST | RECOVERY | INFLUX\n{traceback.format_exc()}")
+            logger.exception("ARCHIVIST | RECOVERY | INFLUX")
             return False
         else:
-            logging.info(
-                f"{output.decode('utf-8')}InfluxDB recovery process has been completed successfully!"
+            logger.info(
+                "%sInfluxDB recovery process has been completed successfully!",
+                output.decode("utf-8"),
             )
             return True
         finally:
-            logging.debug(output)
-            logging.debug(errors)
+            logger.debug(output)
+            logger.debug(errors)
 
     @staticmethod
     async def postgresql() -> bool:
         """Recovers whole PostgreSQL database. Returns True if operation succeed, otherwise returns False."""
         try:
-            logging.info("PostgreSQL recovery process started!")
+            logger.info("PostgreSQL recovery process started!")
             # command that will be executed inside docker container
             command = f"""
             docker exec postgresql \
@@ -188,18 +887,394 @@ class Recovery:
             )
             output, errors = await process.communicate()
         except Exception:
-            logging.error(
-                f"ARCHIVIST | RECOVERY | POSTGRESQL\n{traceback.format_exc()}"
-            )
+            logger.exception("ARCHIVIST | RECOVERY | POSTGRESQL")
             return False
         else:
-            logging.info(
-                f"{output.decode('utf-8')}PostgreSQL recovery process has been completed successfully!"
+            logger.info(
+                "%sPostgreSQL recovery process has been completed successfully!",
+                output.decode("utf-8"),
             )
             return True
         finally:
-            logging.debug(output)
-            logging.debug(errors)
+            logger.debug(output)
+            logger.debug(errors)
+
+    @staticmethod
+    def members(
+        path: str,
+    ) -> typing.Iterator[typing.Tuple[str, int, typing.BinaryIO]]:
+        """Returns name, size and content of each member of archive, without extracting it.
+        Members of zip archive are returned with PostgreSQL dump first,
+        members of zstd archive in order they have been written."""
+        if path.endswith(".zip"):
+            with zipfile.ZipFile(path) as archive:
+                members = sorted(
+                    (info for info in archive.infolist() if not info.is_dir()),
+                    key=lambda info: not info.filename.startswith("postgresql/"),
+                )
+                for info in members:
+                    with archive.open(info) as file:
+                        yield info.filename, info.file_size, file
+            return
+        process = subprocess.Popen(["zstd", "-dc", "-q", path], stdout=subprocess.PIPE)
+        try:
+            with tarfile.open(fileobj=process.stdout, mode="r|") as archive:
+                for info in archive:
+                    if info.isfile():
+                        yield info.name, info.size, archive.extractfile(info)
+        finally:
+            process.stdout.close()
+            if process.wait():
+                raise subprocess.CalledProcessError(process.returncode, "zstd")
+
+    @staticmethod
+    def read_archive(
+        path: str,
+        influxdb: tarfile.TarFile,
+        postgresql: typing.Union[ProcessSink, typing.BinaryIO],
+    ) -> typing.Dict[str, typing.Any]:
+        """Streams members of archive to restore processes, InfluxDB backup files into tar stream
+        extracted in its container and parts of PostgreSQL dump one after another.
+        Checksum of each member is compared with manifest, zip archives are verified
+        by CRC-32 of their members. Tar archive is written with manifest, so tar archive
+        without it is taken as incomplete. Returns manifest and list of mismatched members.
+        """
+        checksums, manifest = {}, {}
+        for name, size, file in Recovery.members(path):
+            if name == StreamArchive.MANIFEST:
+                manifest = json.load(file)
+                continue
+            reader = HashingReader(file)
+            if name.startswith("influxdb/"):
+                info = tarfile.TarInfo(name[len("influxdb/") :])
+                info.size = size
+                influxdb.addfile(info, reader)
+            elif name.startswith("postgresql/"):
+                shutil.copyfileobj(reader, postgresql, 1024 * 1024)
+            else:
+                logger.warning("ARCHIVIST | RECOVERY | Unknown member %s skipped", name)
+                continue
+            checksums[name] = {"size": reader.size, "sha256": reader.sha256.hexdigest()}
+        expected = manifest.get("members", {})
+        mismatched = sorted(
+            name
+            for name in set(expected) | set(checksums)
+            if expected and expected.get(name) != checksums.get(name)
+        )
+        if not expected and not path.endswith(".zip"):
+            mismatched.append(StreamArchive.MANIFEST)
+        return {
+            "manifest": manifest,
+            "mismatched": mismatched,
+            "members": len(checksums),
+        }
+
+    @staticmethod
+    def report(
+        counts: typing.Optional[typing.Dict[str, typing.Dict[str, int]]]
+    ) -> None:
+        """Logs numbers of rows and field values of restored databases."""
+        if not counts:
+            return
+        for label, component in (("Rows", "postgresql"), ("Field values", "influxdb")):
+            logger.info(
+                "ARCHIVIST | RECOVERY | %s | %s",
+                label,
+                ", ".join(
+                    f"{name} {count}" for name, count in counts[component].items()
+                ),
+            )
+
+    @staticmethod
+    def counts() -> typing.Dict[str, typing.Dict[str, int]]:
+        """Returns number of rows of each PostgreSQL table and field values of each bucket."""
+        query = (
+            "SELECT table_name, (xpath('/row/c/text()', query_to_xml(format("
+            "'SELECT count(*) AS c FROM %I.%I', table_schema, table_name), false, true, '')))"
+            "[1]::text FROM information_schema.tables "
+            "WHERE table_schema = 'public' AND table_type = 'BASE TABLE' ORDER BY 1"
+        )
+        output = subprocess.run(
+            [
+                "docker",
+                "exec",
+                "postgresql",
+                "psql",
+                "--username",
+                config.DATABASE["POSTGRE"]["USER"],
+                "--dbname",
+                config.DATABASE["POSTGRE"]["NAME"],
+                "-AtF",
+                "\t",
+                "-c",
+                query,
+            ],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        rows = dict(line.split("\t") for line in output.splitlines() if "\t" in line)
+        return {
+            "postgresql": {table: int(count) for table, count in rows.items()},
+            "influxdb": {
+                bucket: InfluxAPI.count(bucket) for bucket in InfluxAPI.buckets()
+            },
+        }
+
+    @staticmethod
+    async def wait_databases() -> bool:
+        """Waits until both databases are ready, i.e. when their containers have just been started.
+        Returns True if they are ready, otherwise returns False."""
+        if await docker.ready(("influxdb", "postgresql")):
+            return True
+        logger.error(
+            "ARCHIVIST | RECOVERY | Databases are not ready, nothing has been restored"
+        )
+        return False
+
+    @staticmethod
+    async def stream(path: str, jobs: int = config.BACKUPS["RESTORE_JOBS"]) -> bool:
+        """Restores both databases straight from archive, without extracting it on host.
+        InfluxDB backup and PostgreSQL dump are streamed into temporary files of their containers,
+        both databases are restored concurrently only when each checksum has been verified.
+        PostgreSQL dump of zip archive is written by pg_dump to file, so it has data offsets
+        and is restored by parallel jobs. Dump streamed into zstd archive has no offsets,
+        so it is restored by single job, in single transaction.
+        Numbers of rows and points are reported afterwards.
+        Returns True if operation succeed, otherwise returns False.
+        """
+        if not await Recovery.wait_databases():
+            return False
+        loop = asyncio.get_running_loop()
+        start = time.monotonic()
+        timings = {}
+        directory = f"/tmp/archivist_restore_{os.getpid()}"
+        parallel = path.endswith(".zip") and jobs > 1
+        influxdb = ProcessSink(
+            [
+                "docker",
+                "exec",
+                "-i",
+                "influxdb",
+                "sh",
+                "-c",
+                f"mkdir -p {directory} && tar -xf - -C {directory}",
+            ]
+        )
+        restore = [
+            "pg_restore",
+            "--clean",
+            "--if-exists",
+            "--username",
+            config.DATABASE["POSTGRE"]["USER"],
+            "--dbname",
+            config.DATABASE["POSTGRE"]["NAME"],
+        ]
+        if parallel:
+            restore += ["--jobs", str(jobs)]
+        else:
+            restore.append("--single-transaction")
+        postgresql = ProcessSink(
+            [
+                "docker",
+                "exec",
+                "-i",
+                "postgresql",
+                "sh",
+                "-c",
+                f"cat > {directory}.dump",
+            ]
+        )
+
+        def remove(container: str, path: str) -> None:
+            """Removes temporary file or directory of container."""
+            subprocess.run(["docker", "exec", container, "rm", "-rf", path])
+
+        def stage() -> bool:
+            for sink in (influxdb, postgresql):
+                sink.close()
+            return True
+
+        def restore_influx() -> bool:
+            try:
+                subprocess.run(
+                    [
+                        "docker",
+                        "exec",
+                        "influxdb",
+                        "influx",
+                        "restore",
+                        "-t",
+                        config.DATABASE["INFLUX"]["API_TOKEN"],
+                        directory,
+                        "--full",
+                    ],
+                    check=True,
+                    stdout=subprocess.DEVNULL,
+                )
+            finally:
+                remove("influxdb", directory)
+            return True
+
+        def restore_postgresql() -> bool:
+            try:
+                subprocess.run(
+                    ["docker", "exec", "postgresql", *restore, f"{directory}.dump"],
+                    check=True,
+                )
+            finally:
+                remove("postgresql", f"{directory}.dump")
+            return True
+
+        with tarfile.open(fileobj=influxdb, mode="w|") as tar:
+            verification = await loop.run_in_executor(
+                None,
+                measured,
+                "archive read",
+                timings,
+                Recovery.read_archive,
+                path,
+                tar,
+                postgresql,
+            )
+        if verification is not None and not verification["mismatched"]:
+            # databases are restored only from complete files of containers
+            staged = await loop.run_in_executor(
+                None, measured, "staging", timings, stage
+            )
+            verification = staged and verification
+        if verification is None or verification["mismatched"]:
+            # nothing has been restored yet, staged files are removed
+            for sink in (influxdb, postgresql):
+                if sink.process.poll() is None:
+                    sink.process.kill()
+            remove("influxdb", directory)
+            remove("postgresql", f"{directory}.dump")
+            logger.error(
+                "ARCHIVIST | RECOVERY | Archive %s is incomplete or corrupted%s",
+                path,
+                f", mismatched members: {', '.join(verification['mismatched'])}"
+                if verification
+                else "",
+            )
+            return False
+        logger.info(
+            "ARCHIVIST | RECOVERY | %s members verified with %s",
+            verification["members"],
+            "manifest" if verification["manifest"] else "CRC-32 of zip archive",
+        )
+        results = await asyncio.gather(
+            loop.run_in_executor(
+                None, measured, "influxdb restore", timings, restore_influx
+            ),
+            loop.run_in_executor(
+                None, measured, "postgresql restore", timings, restore_postgresql
+            ),
+        )
+        counts = await loop.run_in_executor(
+            None, measured, "counts", timings, Recovery.counts
+        )
+        timings["total"] = time.monotonic() - start
+        Recovery.report(counts)
+        logger.info(
+            "ARCHIVIST | RECOVERY | Timing | %s",
+            ", ".join(f"{step} {duration:.1f}s" for step, duration in timings.items()),
+        )
+        return all(results)
+
+    @staticmethod
+    def restore_postgresql(chunk_store: ChunkStore, chunks: typing.List[str]) -> int:
+        """Restores PostgreSQL database from dump stored in chunk store.
+        Returns size of restored dump."""
+        process = subprocess.Popen(
+            [
+                "docker",
+                "exec",
+                "-i",
+                "postgresql",
+                "pg_restore",
+                "--clean",
+                "--if-exists",
+                "--username",
+                config.DATABASE["POSTGRE"]["USER"],
+                "--dbname",
+                config.DATABASE["POSTGRE"]["NAME"],
+            ],
+            stdin=subprocess.PIPE,
+        )
+        size = 0
+        try:
+            for data in chunk_store.read(chunks):
+                process.stdin.write(data)
+                size += len(data)
+        finally:
+            process.stdin.close()
+            if process.wait():
+                raise subprocess.CalledProcessError(process.returncode, "pg_restore")
+        return size
+
+    @staticmethod
+    async def snapshot(name: str = None) -> bool:
+        """Restores both databases from snapshot of chunk store (the newest by default).
+        Points of InfluxDB are replayed from increments of each snapshot up to given one.
+        PostgreSQL and each bucket are restored concurrently.
+        Returns True if operation succeed, otherwise returns False.
+        """
+        if not await Recovery.wait_databases():
+            return False
+        loop = asyncio.get_running_loop()
+        start = time.monotonic()
+        timings = {}
+        with ChunkStore() as chunk_store:
+            names = chunk_store.snapshots()
+            name = name or (names[-1] if names else "")
+            if name not in names:
+                logger.error("ARCHIVIST | RECOVERY | Snapshot %s does not exist", name)
+                return False
+            chunks = {}
+            for snapshot in names[: names.index(name) + 1]:
+                for bucket, increments in chunk_store.load(snapshot)[
+                    "influxdb"
+                ].items():
+                    for increment in increments:
+                        chunks.setdefault(bucket, []).extend(increment["chunks"])
+            manifest = chunk_store.load(name)
+            results = await asyncio.gather(
+                loop.run_in_executor(
+                    None,
+                    measured,
+                    "postgresql restore",
+                    timings,
+                    Recovery.restore_postgresql,
+                    chunk_store,
+                    manifest["postgresql"]["chunks"],
+                ),
+                *(
+                    loop.run_in_executor(
+                        None,
+                        measured,
+                        f"influxdb {bucket} restore",
+                        timings,
+                        InfluxAPI.write,
+                        bucket,
+                        chunk_store.read(chunks[bucket]),
+                    )
+                    for bucket in chunks
+                ),
+            )
+        Recovery.report(
+            await loop.run_in_executor(
+                None, measured, "counts", timings, Recovery.counts
+            )
+        )
+        timings["total"] = time.monotonic() - start
+        logger.info(
+            "ARCHIVIST | RECOVERY | Snapshot %s | %s points | %s",
+            name,
+            sum(result or 0 for result in results[1:]),
+            ", ".join(f"{step} {duration:.1f}s" for step, duration in timings.items()),
+        )
+        return all(result is not None for result in results)
 
     @staticmethod
     def cleanup() -> bool:
@@ -215,7 +1290,7 @@ class Recovery:
             for directory in directories_to_delete:
                 shutil.rmtree(os.path.join(config.BACKUPS["PATH"], directory))
         except Exception:
-            logging.error(f"ARCHIVIST | RECOVERY\n{traceback.format_exc()}")
+            logger.exception("ARCHIVIST | RECOVERY")
             return False
         else:
             return True
@@ -234,12 +1309,12 @@ class Recovery:
             # unpack archive to general backup path
             shutil.unpack_archive(backup_archive_path, config.BACKUPS["PATH"], "zip")
         except ValueError:
-            logging.error(
-                f"Given date '{backup_date}' did not match format '%Y_%m_%d'!"
+            logger.error(
+                "Given date '%s' did not match format '%%Y_%%m_%%d'!", backup_date
             )
             return False
         except Exception:
-            logging.error(f"ARCHIVIST | RECOVERY | INFLUX\n{traceback.format_exc()}")
+            logger.exception("ARCHIVIST | RECOVERY | INFLUX")
             return False
         else:
             return True
@@ -267,19 +1342,52 @@ if __name__ == "__main__":
         default=True,
         help="[BACKUP] Delete directory after making archive?",
     )
+    parser.add_argument(
+        "-f",
+        "--format",
+        choices=("zip", "zstd", "store"),
+        default=config.BACKUPS["FORMAT"],
+        help="Format of archive, 'zstd' streams dumps without temporary directories, "
+        "'store' makes incremental snapshots in deduplicated chunk store",
+    )
+    parser.add_argument(
+        "-s",
+        "--snapshot",
+        help="[RECOVERY] Name of chunk store snapshot to recover, the newest by default.",
+    )
+    parser.add_argument(
+        "-u",
+        "--unpack",
+        action="store_true",
+        help="[RECOVERY] Unpack zip archive and restore databases one after another.",
+    )
     arguments = parser.parse_args()
 
     # if 'backup' mode has been chosen
-    if arguments.mode == "backup":
+    if arguments.mode == "backup" and arguments.format == "store":
+        # incremental snapshot of both databases
+        asyncio.run(Backup.incremental())
+    elif arguments.mode == "recovery" and arguments.format == "store":
+        # recovery of snapshot rebuilt from chunks
+        asyncio.run(Recovery.snapshot(arguments.snapshot))
+    elif arguments.mode == "backup" and arguments.format == "zstd":
+        # backup of both databases streamed into compressed archive
+        asyncio.run(Backup.stream())
+    elif arguments.mode == "backup":
         # current scheduled backup subdirectory
         backup_directory = Backup.prepare_directory(arguments.overwrite)
-        # backup influx database
-        asyncio.run(Backup.influx(backup_directory))
-        # backup postgresql database
-        asyncio.run(Backup.postgresql(backup_directory))
-        # archive backup subdirectory
-        Backup.archive_directory(backup_directory)
-    # if 'recovery' mode has been chosen
+        # backup of both databases, archived as soon as each dump is finished
+        asyncio.run(Backup.run(backup_directory, arguments.clean))
+    # if 'recovery' mode has been chosen, archive is streamed unless unpacking is requested
+    elif arguments.mode == "recovery" and not arguments.unpack:
+        asyncio.run(
+            Recovery.stream(
+                os.path.join(
+                    config.BACKUPS["PATH"],
+                    f"{arguments.date}.{'zip' if arguments.format == 'zip' else 'tar.zst'}",
+                )
+            )
+        )
     elif arguments.mode == "recovery":
         # unpack archive
         Recovery.unpack_directory(backup_date=arguments.date)
@@ -1,13 +1,321 @@
 """
-Script contains method used for managing docker containers.
+Script contains methods used for managing docker containers.
+Services are restarted individually, in order of their dependencies. Services are stopped
+after services that depend on them and started after services they depend on are ready,
+services of the same level are stopped and started concurrently.
+Service is ready when its readiness probe passes:
+- "postgresql", 'pg_isready' inside its container.
+- "influxdb", '/health' endpoint of its API.
+- "central", HTTP response of its REST API.
+- other services, running container (and healthy, if container has health check).
+Duration of each step is reported for each service.
+
+Usage:
+$ python3 docker.py restart [SERVICE ...]
+$ python3 docker.py start [SERVICE ...]
+$ python3 docker.py stop [SERVICE ...]
+$ python3 docker.py ready [SERVICE ...]
 """
 
+import argparse
 import asyncio
+import json
 import logging
-import traceback
+import os
+import sys
+import time
+import typing
+import urllib.error
+import urllib.request
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
 
 import config
 
+# logger of this module
+logger = logging.getLogger("docker")
+
+
+# services each service depends on, as in docker-compose.yml, with dependencies of services
+# on databases, that are not declared there (i.e. brainstone runs in host network)
+DEPENDENCIES = {
+    "portainer": (),
+    "influxdb": (),
+    "postgresql": (),
+    "central": ("postgresql", "influxdb"),
+    "central_frontend": ("central",),
+    "node_exporter": (),
+    "prometheus": ("node_exporter",),
+    "brainstone": ("postgresql", "influxdb"),
+}
+
+
+def levels(services: typing.Iterable[str]) -> typing.List[typing.List[str]]:
+    """Returns given services grouped into levels, each service is placed after
+    services it depends on. Dependencies that are not given are not taken into account.
+    """
+    remaining = {}
+    for service in services:
+        if service not in DEPENDENCIES:
+            raise ValueError(f"Unknown service {service}")
+        remaining[service] = set(DEPENDENCIES[service])
+    for service in remaining:
+        remaining[service] &= remaining.keys()
+    result = []
+    while remaining:
+        level = [service for service, needed in remaining.items() if not needed]
+        if not level:
+            raise ValueError(f"Circular dependencies of {', '.join(remaining)}")
+        result.append(level)
+        for service in level:
+            del remaining[service]
+        for needed in remaining.values():
+            needed.difference_update(level)
+    return result
+
+
+async def run(*command: str) -> typing.Tuple[int, str]:
+    """Runs command and returns its exit code and output."""
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+    )
+    output, _ = await process.communicate()
+    return process.returncode, output.decode("utf-8", "replace").strip()
+
+
+async def compose(*arguments: str) -> bool:
+    """Runs 'docker compose' command on compose file of system.
+    Returns True if operation succeed, otherwise returns False."""
+    code, output = await run(
+        "docker", "compose", "-f", config.DOCKER["COMPOSE_FILE"], *arguments
+    )
+    if code:
+        logger.error(
+            "DOCKER | 'docker compose %s' failed\n%s", " ".join(arguments), output
+        )
+    return not code
+
+
+def respond(url: str) -> typing.Optional[bytes]:
+    """Returns body of response of given address, or None if it does not respond successfully."""
+    try:
+        with urllib.request.urlopen(
+            url, timeout=config.DOCKER["PROBE_TIMEOUT"]
+        ) as response:
+            return response.read()
+    except (urllib.error.URLError, OSError):
+        return None
+
+
+async def postgresql_ready(service: str) -> bool:
+    """Checks if PostgreSQL accepts connections."""
+    # connection over TCP, initialization of new database runs temporary server on socket only
+    code, _ = await run(
+        "docker",
+        "exec",
+        service,
+        "pg_isready",
+        "-h",
+        "localhost",
+        "-U",
+        str(config.DATABASE["POSTGRE"]["USER"]),
+    )
+    return code == 0
+
+
+async def influxdb_ready(service: str) -> bool:
+    """Checks if InfluxDB reports itself as healthy."""
+    body = await asyncio.get_running_loop().run_in_executor(
+        None, respond, f"{config.DATABASE['INFLUX']['URL']}/health"
+    )
+    try:
+        return json.loads(body)["status"] == "pass"
+    except (TypeError, ValueError, KeyError):
+        return False
+
+
+async def central_ready(service: str) -> bool:
+    """Checks if central serves HTTP requests, it does once migrations are applied."""
+    body = await asyncio.get_running_loop().run_in_executor(
+        None, respond, f"{config.DOCKER['CENTRAL_URL']}/metrics"
+    )
+    return body is not None
+
+
+async def container_ready(service: str) -> bool:
+    """Checks if container is running and healthy, when it has health check."""
+    code, output = await run(
+        "docker",
+        "inspect",
+        "-f",
+        "{{.State.Status}} {{if .State.Health}}{{.State.Health.Status}}{{end}}",
+        service,
+    )
+    state, _, health = output.partition(" ")
+    return code == 0 and state == "running" and health in ("", "healthy")
+
+
+# readiness probes of services, container state is probed for the others
+PROBES = {
+    "postgresql": postgresql_ready,
+    "influxdb": influxdb_ready,
+    "central": central_ready,
+}
+
+
+async def wait_ready(
+    service: str, timeout: float = config.DOCKER["READY_TIMEOUT"]
+) -> bool:
+    """Probes service until it is ready, for at most 'timeout' seconds.
+    Returns True if service is ready, otherwise returns False."""
+    probe = PROBES.get(service, container_ready)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if await asyncio.wait_for(probe(service), config.DOCKER["PROBE_TIMEOUT"]):
+                return True
+        except asyncio.TimeoutError:
+            pass
+        if time.monotonic() >= deadline:
+            logger.error("DOCKER | %s is not ready after %ss", service, timeout)
+            return False
+        await asyncio.sleep(config.DOCKER["PROBE_INTERVAL"])
+
+
+async def ready(
+    services: typing.Iterable[str], timeout: float = config.DOCKER["READY_TIMEOUT"]
+) -> bool:
+    """Waits until each of given services is ready, services are probed concurrently.
+    Returns True if each service is ready, otherwise returns False."""
+    return all(
+        await asyncio.gather(*(wait_ready(service, timeout) for service in services))
+    )
+
+
+async def stop_service(service: str, timings: typing.Dict[str, typing.Any]) -> bool:
+    """Stops container of service and records duration of step."""
+    start = time.monotonic()
+    timings["stopped"] = await compose("stop", service)
+    timings["stop"] = time.monotonic() - start
+    return timings["stopped"]
+
+
+async def start_service(
+    service: str, timings: typing.Dict[str, typing.Any], timeout: float
+) -> bool:
+    """Starts container of service (creates it, if it has been removed) and waits until
+    service is ready. Records duration of each step and readiness of service."""
+    start = time.monotonic()
+    timings["ready"] = await compose("up", "-d", "--no-deps", service)
+    timings["start"] = time.monotonic() - start
+    if timings["ready"]:
+        start = time.monotonic()
+        timings["ready"] = await wait_ready(service, timeout)
+        timings["probe"] = time.monotonic() - start
+    return timings["ready"]
+
+
+def report(timings: typing.Dict[str, typing.Dict[str, typing.Any]]) -> None:
+    """Logs duration of each step of each service."""
+    for service, steps in timings.items():
+        durations = ", ".join(
+            f"{step} {steps[step]:.1f}s"
+            for step in ("stop", "start", "probe")
+            if step in steps
+        )
+        if "ready" in steps:
+            state = "ready" if steps["ready"] else "NOT READY"
+        else:
+            state = "stopped" if steps.get("stopped") else "NOT STOPPED"
+        logger.info("DOCKER | %s | %s | %s", service, state, durations or "skipped")
+
+
+async def stop_levels(
+    order: typing.List[typing.List[str]],
+    timings: typing.Dict[str, typing.Dict[str, typing.Any]],
+) -> None:
+    """Stops levels of services from the last one, services of level are stopped concurrently."""
+    for level in reversed(order):
+        await asyncio.gather(
+            *(stop_service(service, timings[service]) for service in level)
+        )
+
+
+async def start_levels(
+    order: typing.List[typing.List[str]],
+    timings: typing.Dict[str, typing.Dict[str, typing.Any]],
+    timeout: float,
+) -> None:
+    """Starts levels of services from the first one, services of level are started concurrently
+    when the previous level is ready. Service is not started if any of its dependencies is not ready.
+    """
+    for level in order:
+        started = []
+        for service in level:
+            failed = [
+                dependency
+                for dependency in DEPENDENCIES[service]
+                if timings.get(dependency, {}).get("ready") is False
+            ]
+            if failed:
+                logger.error(
+                    "DOCKER | %s is not started, %s not ready",
+                    service,
+                    ", ".join(failed),
+                )
+                timings[service]["ready"] = False
+            else:
+                started.append(service)
+        await asyncio.gather(
+            *(start_service(service, timings[service], timeout) for service in started)
+        )
+
+
+async def stop(
+    services: typing.Iterable[str] = DEPENDENCIES,
+) -> typing.Dict[str, typing.Dict[str, typing.Any]]:
+    """Stops given services (each one by default), services that depend on others are stopped first.
+    Returns duration of each step of each service."""
+    order = levels(services)
+    timings = {service: {} for level in order for service in level}
+    await stop_levels(order, timings)
+    report(timings)
+    return timings
+
+
+async def start(
+    services: typing.Iterable[str] = DEPENDENCIES,
+    timeout: float = config.DOCKER["READY_TIMEOUT"],
+) -> typing.Dict[str, typing.Dict[str, typing.Any]]:
+    """Starts given services (each one by default) in order of their dependencies.
+    Returns duration of each step of each service, and its readiness."""
+    order = levels(services)
+    timings = {service: {} for level in order for service in level}
+    await start_levels(order, timings, timeout)
+    report(timings)
+    return timings
+
+
+async def restart(
+    services: typing.Iterable[str] = DEPENDENCIES,
+    timeout: float = config.DOCKER["READY_TIMEOUT"],
+) -> typing.Dict[str, typing.Dict[str, typing.Any]]:
+    """Restarts given services (each one by default) in order of their dependencies.
+    Returns duration of each step of each service, and its readiness."""
+    order = levels(services)
+    logger.critical(
+        "DOCKER | Restarting %s", " -> ".join(", ".join(level) for level in order)
+    )
+    start_time = time.monotonic()
+    timings = {service: {} for level in order for service in level}
+    await stop_levels(order, timings)
+    await start_levels(order, timings, timeout)
+    report(timings)
+    logger.critical("DOCKER | Restart finished in %.1fs", time.monotonic() - start_time)
+    return timings
+
 
 async def docker_compose_down(rmi: bool = False) -> bool:
     """Stops each running docker container using 'docker compose down' command.
@@ -15,42 +323,65 @@ async def docker_compose_down(rmi: bool = False) -> bool:
     Returns True if operation succeed, otherwise returns False.
     """
     try:
-        logging.critical("Stopping all running containers")
-        # bash command
+        logger.critical("Stopping all running containers")
         if rmi:
-            command = f"docker compose -f {config.BASE_DIR}/docker-compose.yml down"
+            stopped = await compose("down", "--rmi", "local")
         else:
-            command = f"docker compose -f {config.BASE_DIR}/docker-compose.yml down --rmi local"
-        # create subprocess that calls shell command
-        process = await asyncio.create_subprocess_shell(
-            command,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-        )
-        _, output = await process.communicate()
+            stopped = await compose("down")
     except Exception:
-        logging.error(f"UTILS | DOCKER\n{traceback.format_exc()}")
+        logger.exception("UTILS | DOCKER")
         return False
-    else:
-        logging.critical(f"{output.decode('utf-8')}All containers has been stopped")
-        return True
+    if stopped:
+        logger.critical("All containers has been stopped")
+    return stopped
 
 
-async def docker_compose_up() -> bool:
-    """Starts each container using 'docker compose up -d' command.
-    Returns True if operation succeed, otherwise returns False."""
+async def docker_compose_up(timeout: float = config.DOCKER["READY_TIMEOUT"]) -> bool:
+    """Starts each container using 'docker compose up -d' command and waits until
+    each service is ready. Returns True if operation succeed, otherwise returns False.
+    """
     try:
-        logging.critical("Starts all containers")
-        # create subprocess that calls shell command
-        process = await asyncio.create_subprocess_shell(
-            f"docker compose -f {config.BASE_DIR}/docker-compose.yml up -d",
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-        )
-        _, output = await process.communicate()
+        logger.critical("Starts all containers")
+        started = await compose("up", "-d") and await ready(DEPENDENCIES, timeout)
     except Exception:
-        logging.error(f"UTILS | DOCKER\n{traceback.format_exc()}")
+        logger.exception("UTILS | DOCKER")
         return False
+    if started:
+        logger.critical("All containers has been started")
+    return started
+
+
+# main section of script
+if __name__ == "__main__":
+    # parses script arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=("restart", "start", "stop", "ready"))
+    parser.add_argument(
+        "services", nargs="*", help="Services to manage, each one by default"
+    )
+    parser.add_argument(
+        "-t",
+        "--timeout",
+        type=float,
+        default=config.DOCKER["READY_TIMEOUT"],
+        help="Seconds to wait until each started service is ready",
+    )
+    arguments = parser.parse_args()
+    services = arguments.services or list(DEPENDENCIES)
+    try:
+        levels(services)
+    except ValueError as e:
+        parser.error(str(e))
+    if arguments.command == "ready":
+        succeed = asyncio.run(ready(services, arguments.timeout))
+    elif arguments.command == "stop":
+        succeed = all(
+            steps["stopped"] for steps in asyncio.run(stop(services)).values()
+        )
     else:
-        logging.critical(f"{output.decode('utf-8')}All containers has been started")
-        return True
+        function = restart if arguments.command == "restart" else start
+        succeed = all(
+            steps.get("ready")
+            for steps in asyncio.run(function(services, arguments.timeout)).values()
+        )
+    sys.exit(0 if succeed else 1)
@@ -0,0 +1,244 @@
+"""
+Script contains content-addressed chunk store, used by incremental backups of archivist.
+Streams are split into chunks at content-defined boundaries, so data inserted or removed in the middle
+of stream changes only chunks around it and the rest is deduplicated. Each chunk is stored once,
+under its SHA-256 checksum, compressed with zlib. Snapshot is a manifest that lists chunks of each stream.
+Boundary is placed after line, whose CRC-32 checksum has each bit of MASK cleared, when chunk
+is at least MIN_CHUNK bytes long. Dumps of both databases are line oriented, data without lines
+is cut at MAX_CHUNK bytes.
+
+Layout of store directory:
+- chunks/{first two digits of checksum}/{checksum}, compressed chunks.
+- snapshots/{name}.json, manifests of snapshots, names begin with time of snapshot.
+"""
+
+import collections
+import concurrent.futures
+import datetime
+import hashlib
+import json
+import logging
+import os
+import typing
+import zlib
+
+import config
+
+# logger of this module
+logger = logging.getLogger("archivist")
+
+
+# format of snapshot names, they are ordered by time
+NAME_FORMAT = "%Y_%m_%d_%H%M%S"
+
+
+def split(
+    blocks: typing.Iterable[bytes],
+    min_chunk: int = config.BACKUPS["MIN_CHUNK"],
+    max_chunk: int = config.BACKUPS["MAX_CHUNK"],
+    mask: int = config.BACKUPS["CHUNK_MASK"],
+) -> typing.Iterator[bytes]:
+    """Splits stream given as blocks of bytes into content-defined chunks."""
+    buffer = b""
+    # start of current line in buffer, buffer always starts with current chunk
+    line = 0
+    for block in blocks:
+        buffer += block
+        view = memoryview(buffer)
+        start = 0
+        while True:
+            end = buffer.find(b"\n", line, start + max_chunk)
+            if end < 0:
+                if len(buffer) - start < max_chunk:
+                    break
+                # chunk without boundary, cut at maximal size
+                end = start + max_chunk
+            else:
+                end += 1
+                if end - start < min_chunk or zlib.crc32(view[line:end]) & mask:
+                    line = end
+                    continue
+            yield buffer[start:end]
+            start = line = end
+        view.release()
+        buffer, line = buffer[start:], line - start
+    if buffer:
+        yield buffer
+
+
+class ChunkStore:
+    """Stores chunks and manifests of snapshots in store directory.
+    Chunks are hashed and compressed by pool of threads, zlib and hashlib release GIL,
+    so each core is used."""
+
+    def __init__(
+        self,
+        path: str = config.BACKUPS["STORE"],
+        workers: int = config.BACKUPS["WORKERS"],
+    ) -> None:
+        self.path = path
+        self.workers = workers
+        self.executor = concurrent.futures.ThreadPoolExecutor(workers)
+        for directory in ("chunks", "snapshots"):
+            os.makedirs(os.path.join(path, directory), exist_ok=True)
+
+    def __enter__(self) -> object:
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback) -> None:
+        self.executor.shutdown()
+
+    def chunk_path(self, digest: str) -> str:
+        """Returns path of chunk of given checksum."""
+        return os.path.join(self.path, "chunks", digest[:2], digest)
+
+    def put(self, data: bytes) -> typing.Tuple[str, int]:
+        """Stores chunk, unless it is already stored.
+        Returns checksum of chunk and number of bytes that have been stored."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.chunk_path(digest)
+        if os.path.exists(path):
+            return digest, 0
+        compressed = zlib.compress(data, config.BACKUPS["ZLIB_LEVEL"])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # chunk is renamed when complete, so interrupted backup never leaves corrupted chunk
+        temporary = f"{path}.{os.getpid()}.{id(data)}"
+        with open(temporary, "wb") as file:
+            file.write(compressed)
+        os.replace(temporary, path)
+        return digest, len(compressed)
+
+    def get(self, digest: str) -> bytes:
+        """Returns content of chunk, verified with its checksum."""
+        with open(self.chunk_path(digest), "rb") as file:
+            data = zlib.decompress(file.read())
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"Chunk {digest} is corrupted")
+        return data
+
+    def write(self, blocks: typing.Iterable[bytes]) -> typing.Dict[str, typing.Any]:
+        """Stores stream given as blocks of bytes.
+        Returns its chunks, size and number of newly stored (compressed) bytes."""
+        result = {"chunks": [], "size": 0, "stored": 0}
+        pending = collections.deque()
+
+        def collect(future: concurrent.futures.Future) -> None:
+            digest, stored = future.result()
+            result["chunks"].append(digest)
+            result["stored"] += stored
+
+        for chunk in split(blocks):
+            result["size"] += len(chunk)
+            pending.append(self.executor.submit(self.put, chunk))
+            # number of chunks in memory is bounded, order of chunks is kept
+            if len(pending) > 2 * self.workers:
+                collect(pending.popleft())
+        while pending:
+            collect(pending.popleft())
+        return result
+
+    def read(self, digests: typing.Iterable[str]) -> typing.Iterator[bytes]:
+        """Returns content of stream stored as given chunks.
+        Following chunks are read and decompressed in advance."""
+        pending = collections.deque()
+        for digest in digests:
+            pending.append(self.executor.submit(self.get, digest))
+            if len(pending) > 2 * self.workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def snapshots(self) -> typing.List[str]:
+        """Returns names of stored snapshots, from the oldest."""
+        return sorted(
+            entry[:-5]
+            for entry in os.listdir(os.path.join(self.path, "snapshots"))
+            if entry.endswith(".json")
+        )
+
+    def load(self, name: str) -> typing.Dict:
+        """Returns manifest of snapshot."""
+        with open(os.path.join(self.path, "snapshots", f"{name}.json")) as file:
+            return json.load(file)
+
+    def save(self, manifest: typing.Dict) -> None:
+        """Writes manifest of snapshot, snapshot exists once its manifest is written."""
+        path = os.path.join(self.path, "snapshots", f"{manifest['name']}.json")
+        with open(f"{path}.partial", "w") as file:
+            json.dump(manifest, file, indent=2)
+        os.replace(f"{path}.partial", path)
+
+    def remove(self, name: str) -> None:
+        """Removes manifest of snapshot, its chunks are removed by 'collect'."""
+        os.remove(os.path.join(self.path, "snapshots", f"{name}.json"))
+
+    def collect(self) -> int:
+        """Removes chunks not referenced by any snapshot. Returns number of removed chunks."""
+        referenced = set()
+        for name in self.snapshots():
+            referenced.update(chunks(self.load(name)))
+        removed = 0
+        for root, _, files in os.walk(os.path.join(self.path, "chunks")):
+            for entry in files:
+                if entry not in referenced:
+                    os.remove(os.path.join(root, entry))
+                    removed += 1
+        return removed
+
+
+def chunks(manifest: typing.Dict) -> typing.Iterator[str]:
+    """Returns checksums of each chunk referenced by manifest."""
+    yield from manifest["postgresql"]["chunks"]
+    for increments in manifest["influxdb"].values():
+        for increment in increments:
+            yield from increment["chunks"]
+
+
+def expired(
+    names: typing.List[str],
+    daily: int = config.BACKUPS["KEEP_DAILY"],
+    weekly: int = config.BACKUPS["KEEP_WEEKLY"],
+    monthly: int = config.BACKUPS["KEEP_MONTHLY"],
+) -> typing.List[str]:
+    """Returns names of snapshots outside of retention policy, from the oldest.
+    The newest snapshot of each of the last 'daily' days, 'weekly' weeks and 'monthly' months
+    is kept, as well as the newest snapshot overall."""
+    kept = set(names[-1:])
+    periods = (
+        (daily, lambda moment: moment.date()),
+        (weekly, lambda moment: moment.isocalendar()[:2]),
+        (monthly, lambda moment: (moment.year, moment.month)),
+    )
+    for count, period in periods:
+        newest = {}
+        for name in names:
+            newest[period(datetime.datetime.strptime(name, NAME_FORMAT))] = name
+        kept.update(newest[key] for key in sorted(newest)[-count:] if count)
+    return [name for name in names if name not in kept]
+
+
+def prune(store: ChunkStore) -> typing.List[str]:
+    """Removes snapshots outside of retention policy and chunks referenced only by them.
+    InfluxDB increments of removed snapshot are moved to the next snapshot,
+    so each snapshot still holds every point written up to its time.
+    Returns names of removed snapshots."""
+    names = store.snapshots()
+    removed = expired(names)
+    for name in removed:
+        manifest = store.load(name)
+        successor = store.load(names[names.index(name) + 1])
+        for bucket, increments in manifest["influxdb"].items():
+            successor["influxdb"][bucket] = increments + successor["influxdb"].get(
+                bucket, []
+            )
+        # successor is written first, so interrupted pruning never loses increments
+        store.save(successor)
+        store.remove(name)
+        names.remove(name)
+    if removed:
+        logger.info(
+            "ARCHIVIST | STORE | Removed snapshots %s and %s unreferenced chunks",
+            ", ".join(removed),
+            store.collect(),
+        )
+    return removed